@@ -1,17 +1,14 @@
-import datetime
-
 from django.conf import settings
 from django.contrib.auth.models import User
 from django.db import models
 from django.db import transaction as dbtransaction
 from django.utils import timezone
-from django.utils.timezone import utc
 from django_countries.fields import CountryField
 
 from userena.models import UserenaBaseProfile
 from userena import settings as userena_settings
 
-from transaction.models import Transaction
+from transaction.models import DailyVolume
 
 from account.utils import AccountException
 
@@ -214,24 +211,15 @@ class BeamProfile(UserenaBaseProfile):
                 and not self.user.is_active)
 
     def todays_transaction_volume(self, site, new_amount=0):
+        # kept up to date in the daily volume ledger instead of adding up today's transactions
         try:
-            now = timezone.now()
-            today = datetime.datetime(now.year, now.month, now.day).replace(tzinfo=utc)
-
-            transactions = Transaction.objects.filter(
-                sender=self.user.id,
-                state__in=(Transaction.PAID, Transaction.PROCESSED),
-                paid_at__gte=today
-            )
-
-            amount = new_amount
+            volume = DailyVolume.objects.get(
+                user=self.user_id, site=site, day=timezone.now().date()).amount
+        except DailyVolume.DoesNotExist:
+            volume = 0
 
-            sending_currency = settings.SITE_SENDING_CURRENCY[site.id]
-
-            for t in transactions:
-                amount = amount + t.exchange_rate.exchange_amount(t.sent_amount, t.sent_currency, sending_currency)
-
-            return amount
+        try:
+            return volume + new_amount
 
         except TypeError:
 
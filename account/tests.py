@@ -1165,6 +1165,27 @@ class ProfileModelTests(TestCase, TestUtils):
         self.assertEqual(user.profile.todays_transaction_volume(site_beam, 15), 119.25)
         self.assertEqual(user.profile.todays_transaction_volume(site_bae, 15), 181.8)
 
+    def test_transaction_volume_queries(self):
+        user = self._create_fully_verified_user()
+        pricing = self._create_default_pricing_beam()
+        site = Site.objects.get(id=0)
+
+        for exchange_rate in (self._create_default_exchange_rate(), self._create_default_exchange_rate()):
+            for _ in range(3):
+                self._create_transaction(
+                    sender=user,
+                    pricing=pricing,
+                    exchange_rate=exchange_rate,
+                    sent_amount=10,
+                    sent_currency='USD',
+                    received_amount=33.1,
+                    receiving_country='GH'
+                )
+
+        # a single read of the daily volume ledger
+        with self.assertNumQueries(1):
+            self.assertEqual(user.profile.todays_transaction_volume(site), 37.5)
+
     def test_profile_information_complete(self):
         user = self._create_activated_user()
         self.assertFalse(user.profile.information_complete)
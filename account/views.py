@@ -28,9 +28,6 @@ from account.utils import AccountException, generate_aws_upload
 
 from pricing.models import get_current_limit
 
-from beam.utils.ip_blocking import country_blocked, is_tor_node,\
-    get_client_ip, HTTP_451_UNAVAILABLE_FOR_LEGAL_REASONS
-
 'DRF implementation of the userena.views used for Beam Accounts.'
 
 
@@ -84,12 +81,6 @@ class Signup(APIView):
 
     def post(self, request):
 
-        # block countries we are not licensed to operate in and tor clients
-        client_ip = get_client_ip(request)
-
-        if country_blocked(request, client_ip) or is_tor_node(client_ip):
-            return Response(status=HTTP_451_UNAVAILABLE_FOR_LEGAL_REASONS)
-
         serializer = self.serializer_class(data=request.DATA)
 
         if serializer.is_valid():
@@ -222,12 +213,6 @@ class Signin(APIView):
 
     def post(self, request):
 
-        # block countries we are not licensed to operate in and tor clients
-        client_ip = get_client_ip(request)
-
-        if country_blocked(request, client_ip) or is_tor_node(client_ip):
-            return Response(status=HTTP_451_UNAVAILABLE_FOR_LEGAL_REASONS)
-
         serializer = self.serializer_class(data=request.DATA)
         if serializer.is_valid():
             authenticated_user = serializer.object['user']
@@ -73,7 +73,8 @@ MIDDLEWARE_CLASSES = PRODUCTION_MIDDLEWARE + (
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    'corsheaders.middleware.CorsMiddleware'
+    'corsheaders.middleware.CorsMiddleware',
+    'beam.utils.ip_blocking.ScreeningMiddleware'
 )
 
 # Site types in Env
@@ -114,6 +115,17 @@ DATABASES = {
     'default': dj_database_url.config()
 }
 
+# Cache
+# holds the circuit breaker state, which workers only share with a backend all of them reach,
+# e.g. CACHE_BACKEND=django.core.cache.backends.memcached.MemcachedCache and CACHE_LOCATION=host:port;
+# with the local-memory default every gunicorn worker trips its breaker on its own
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', '')
+    }
+}
+
 # Internationalization
 LANGUAGE_CODE = 'en-us'
 
@@ -330,15 +342,42 @@ SITE_RECEIVING_COUNTRY = {
     1: (SIERRA_LEONE,)
 }
 
+# Seconds a worker may serve Pricing, ExchangeRate, Limit, Comparison and State
+# from its local snapshot before re-reading them, see beam.utils.snapshot_cache
+SNAPSHOT_CACHE_TIMEOUT = 60
+
+# Seconds a worker may go without checking whether another worker changed that
+# reference data, see beam.utils.snapshot_cache
+SNAPSHOT_VERSION_TIMEOUT = 5
+
+# Seconds shared caches may keep pricing, limit and state responses
+CONDITIONAL_GET_MAX_AGE = 10
+
+# Maximum number of sent amounts quoted in one request
+QUOTE_MAX_AMOUNTS = 1000
+
+# Seconds after which unpaid transactions are set invalid, has to exceed the lifetime of GoCoin invoices,
+# and after which those are archived
+TRANSACTION_EXPIRY = 60 * 60
+TRANSACTION_ARCHIVE_AFTER = 30 * 24 * 60 * 60
+# Transactions changed per UPDATE by ./manage.py expire_transactions
+TRANSACTION_SWEEP_CHUNK_SIZE = 1000
+
 # Payment Processors
 PAYMENT_PROCESSOR = 'GoCoinInvoice'
+# initiate payments in a background worker instead of the request thread
+ASYNC_PAYMENT_INITIATION = False
+# only store payment webhooks in the request thread and apply them in a background worker
+ASYNC_PAYMENT_WEBHOOKS = False
 
 # GoCoin Settings
 # API Key with permission 'invoice_read_write'
 GOCOIN_API_KEY = os.environ.get('GOCOIN_API_KEY')
 GOCOIN_MERCHANT_ID = os.environ.get('GOCOIN_MERCHANT_ID')
-GOCOIN_BASE_URL = 'https://api.gocoin.com/api/v1/'
+# point to ./manage.py run_fake_gocoin for local load tests
+GOCOIN_BASE_URL = os.environ.get('GOCOIN_BASE_URL', 'https://api.gocoin.com/api/v1/')
 GOCOIN_CREATE_INVOICE_URL = GOCOIN_BASE_URL + 'merchants/{}/invoices'.format(GOCOIN_MERCHANT_ID)
+GOCOIN_INVOICE_URL = GOCOIN_BASE_URL + 'invoices/{}'
 GOCOIN_INVOICE_CALLBACK_URL = API_BASE_URL + '/api/v1/btc_payment/gocoin/'
 GOCOIN_INVOICE_REDIRECT_SUFFIX = '/#!/send/complete/{}'
 GOCOIN_PAYMENT_REDIRECT = {
@@ -346,6 +385,36 @@ GOCOIN_PAYMENT_REDIRECT = {
     SIERRA_LEONE: USER_BASE_URL_SL + GOCOIN_INVOICE_REDIRECT_SUFFIX
 }
 
+# seconds to wait for a connection and for a response from GoCoin
+GOCOIN_CONNECT_TIMEOUT = 5
+GOCOIN_READ_TIMEOUT = 30
+# retries of failed reads from GoCoin and base delay between them in seconds
+GOCOIN_MAX_RETRIES = 2
+GOCOIN_RETRY_BACKOFF = 0.2
+# seconds after which idle connections to GoCoin are not reused
+GOCOIN_KEEPALIVE_TIMEOUT = 30
+# consecutive failed calls to GoCoin after which calls are rejected for the given seconds
+GOCOIN_CIRCUIT_BREAKER_THRESHOLD = 5
+GOCOIN_CIRCUIT_BREAKER_TIMEOUT = 60
+# invoice jobs fetched at once by process_invoice_jobs and seconds to wait if there are none
+GOCOIN_INVOICE_JOB_BATCH_SIZE = 20
+GOCOIN_INVOICE_JOB_POLL_INTERVAL = 1
+# seconds after which invoice jobs still running are taken to belong to a dead worker and requeued
+GOCOIN_INVOICE_JOB_TIMEOUT = 5 * 60
+# threads applying webhook deliveries, deliveries fetched at once and seconds to wait if there are none
+GOCOIN_WEBHOOK_WORKERS = 4
+GOCOIN_WEBHOOK_BATCH_SIZE = 100
+GOCOIN_WEBHOOK_POLL_INTERVAL = 1
+# seconds after which webhook deliveries still running are taken to belong to a dead worker and requeued
+GOCOIN_WEBHOOK_TIMEOUT = 5 * 60
+# seconds after which ./manage.py reconcile_invoices polls unpaid invoices, invoices per batch and concurrent requests
+GOCOIN_RECONCILE_AFTER = 30 * 60
+GOCOIN_RECONCILE_BATCH_SIZE = 100
+GOCOIN_RECONCILE_WORKERS = 8
+# seconds after creation until which GoCoin invoices can still be paid, ./manage.py expire_transactions
+# --archive keeps unpaid invoices at least that long
+GOCOIN_INVOICE_LIFETIME = 7 * 24 * 60 * 60
+
 # IP-based blocking
 COUNTRY_BLACKLIST = (
     'US',
@@ -358,9 +427,39 @@ COUNTRY_BLACKLIST = (
     'MM'  # Myanmar
 )
 
-TOR_TIMEOUT = 5
+# seconds each of the two queries to the Tor DNS exit list may take, has to fit twice into SCREENING_TIMEOUT
+TOR_TIMEOUT = 1
+# bulk list of Tor exit nodes (url or file path) and seconds between refreshes
+TOR_EXIT_LIST_URL = 'https://check.torproject.org/torbulkexitlist'
+TOR_EXIT_LIST_REFRESH_INTERVAL = 30 * 60
+# query the Tor DNS exit list while the bulk list has not been loaded
+TOR_DNS_FALLBACK = True
 
 GEOIP_PATH = BASE_DIR('static', 'geo_data', 'GeoIP.dat')
+# how GeoIP opens the database, 1 (GEOIP_MEMORY_CACHE) reads it into memory and 8 (GEOIP_MMAP_CACHE) maps it
+GEOIP_CACHE = 1
+# ip addresses per worker whose country is kept in memory
+GEOIP_CACHE_SIZE = 10000
+
+# files listing networks in CIDR notation, one per line, that are never or always blocked
+IP_ALLOW_LISTS = ()
+IP_DENY_LISTS = ()
+
+# paths of requests ScreeningMiddleware answers with 451 for denied clients, clients in blacklisted countries or using Tor
+SCREENED_URLS = (
+    r'^/api/v1/account/signup/$',
+    r'^/api/v1/account/signin/$',
+    r'^/api/v1/transaction/add/$'
+)
+# seconds screening verdicts are kept and number of verdicts kept per worker
+SCREENING_VERDICT_TIMEOUT = 5 * 60
+SCREENING_CACHE_SIZE = 10000
+# threads per worker running country and Tor checks concurrently and seconds they may take together
+SCREENING_THREADS = 4
+SCREENING_TIMEOUT = 3
+# block clients if the country or the Tor check fails or times out, instead of letting them through
+SCREENING_COUNTRY_FAIL_CLOSED = True
+SCREENING_TOR_FAIL_CLOSED = False
 
 # Bitcoin Against Ebola Specifics
 CHARITIES = {'SLLG': '7554', 'LBG': '5275', 'Build on Books': '77879237'}
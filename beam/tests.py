@@ -1,7 +1,15 @@
+import os
+import tempfile
+import time
+from multiprocessing.pool import ThreadPool
+
+from django.conf import settings
 from django.contrib.auth.models import User
 from django.contrib.sites.models import Site
+from django.core.urlresolvers import reverse
 from django.test import TestCase
 from django.test.client import RequestFactory
+from django.test.utils import override_settings
 from django.utils import timezone
 
 from userena.models import UserenaSignup
@@ -9,9 +17,16 @@ from userena import settings as userena_settings
 
 from rest_framework.authtoken.models import Token
 
+from mock import Mock, patch
+
 from account.models import BeamProfile as Profile
 
+from beam.utils import ip_blocking, metrics
 from beam.utils.angular_requests import get_site_by_request
+from beam.utils.ip_ranges import IPRangeSet
+from beam.utils.lru_cache import LRUCache
+from beam.utils.snapshot_cache import invalidate_snapshots
+from beam.utils.tor_exit_list import TorExitList
 
 from pricing.models import Pricing, ExchangeRate, Comparison, Limit,\
     end_previous_object, end_previous_object_by_site
@@ -176,6 +191,7 @@ class TestUtils(object):
         )
         end_previous_object_by_site(Pricing, site)
         pricing.save()
+        invalidate_snapshots()
         return pricing
 
     def _create_default_pricing_beam(self):
@@ -200,6 +216,7 @@ class TestUtils(object):
         )
         end_previous_object(ExchangeRate)
         exchange_rate.save()
+        invalidate_snapshots()
         return exchange_rate
 
     def _create_default_exchange_rate(self):
@@ -221,6 +238,7 @@ class TestUtils(object):
         )
         end_previous_object_by_site(Limit, site)
         limit.save()
+        invalidate_snapshots()
         return limit
 
     def _create_default_limit_beam(self):
@@ -245,6 +263,7 @@ class TestUtils(object):
         comparison = Comparison(price_comparison=self.default_comparison)
         end_previous_object(Comparison)
         comparison.save()
+        invalidate_snapshots()
         return comparison
 
     def _create_state(self, state=None, site_id=None):
@@ -256,6 +275,7 @@ class TestUtils(object):
         app_state = State(state=state, site=site)
         end_previous_object_by_site(State, site)
         app_state.save()
+        invalidate_snapshots()
         return app_state
 
     def _create_transaction(self, sender, pricing, exchange_rate, sent_amount,
@@ -331,3 +351,319 @@ class SiteMappingTests(TestCase, TestUtils):
         site = get_site_by_request(dummy_request)
         self.assertIsNotNone(site)
         self.assertEqual(site.id, 0)
+
+
+class TorExitListTests(TestCase):
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp()
+        os.close(handle)
+        self._write('# exit nodes\n171.25.193.77\n2001:db8::1\n\n')
+        self.exit_list = TorExitList(self.path, 60)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def _write(self, data):
+        with open(self.path, 'w') as exit_list:
+            exit_list.write(data)
+
+    def test_parse(self):
+        self.assertEqual(
+            TorExitList.parse('ExitNode 0011BD2485AD45D984EC4159C88FC066E5E3300E\n'
+                              'ExitAddress 162.247.74.201 2015-01-01 10:00:00\n'),
+            frozenset(['162.247.74.201'])
+        )
+
+    def test_load(self):
+        self.assertFalse(self.exit_list.loaded)
+        self.assertNotIn('171.25.193.77', self.exit_list)
+
+        self.assertTrue(self.exit_list.load())
+        self.assertIn('171.25.193.77', self.exit_list)
+        self.assertIn('2001:db8::1', self.exit_list)
+        self.assertNotIn('8.8.8.8', self.exit_list)
+        self.assertEqual(len(self.exit_list), 2)
+
+        # failed and empty refreshes keep the previous list
+        self._write('<html></html>\n\n')
+        self.assertFalse(self.exit_list.load())
+        os.remove(self.path)
+        self.assertFalse(self.exit_list.load())
+        self._write('8.8.8.8\n')
+        self.assertIn('171.25.193.77', self.exit_list)
+
+        self.assertTrue(self.exit_list.load())
+        self.assertIn('8.8.8.8', self.exit_list)
+        self.assertNotIn('171.25.193.77', self.exit_list)
+
+    @override_settings(ENV=settings.ENV_DEV, TOR_DNS_FALLBACK=True)
+    @patch('beam.utils.ip_blocking.is_using_tor', return_value=True)
+    def test_is_tor_node(self, mock_is_using_tor):
+        with patch.object(ip_blocking, 'tor_exit_nodes', self.exit_list),\
+                patch.object(self.exit_list, 'start') as mock_start:
+
+            # DNS is only queried until the list has been loaded
+            self.assertTrue(ip_blocking.is_tor_node('8.8.8.8'))
+            self.assertEqual(mock_is_using_tor.call_count, 1)
+
+            with override_settings(TOR_DNS_FALLBACK=False):
+                self.assertFalse(ip_blocking.is_tor_node('8.8.8.8'))
+
+            self.exit_list.load()
+            self.assertTrue(ip_blocking.is_tor_node('171.25.193.77'))
+            self.assertFalse(ip_blocking.is_tor_node('8.8.8.8'))
+            self.assertEqual(mock_is_using_tor.call_count, 1)
+            self.assertTrue(mock_start.called)
+
+
+@override_settings(ENV=settings.ENV_DEV)
+@patch('beam.utils.ip_blocking.DNS.DiscoverNameServers')
+class IsUsingTorTests(TestCase):
+
+    def _query(self, target_answers):
+        exit_answer = Mock(header={'status': 'NOERROR'}, answers=[{'typename': 'A', 'data': '127.0.0.2'}])
+        with patch('beam.utils.ip_blocking.DNS.DnsRequest') as mock_request:
+            mock_request.return_value.req.side_effect = [Mock(answers=target_answers), exit_answer]
+            is_tor = ip_blocking.is_using_tor('171.25.193.77')
+        return is_tor, mock_request
+
+    def test_single_a_record(self, mock_discover):
+        is_tor, mock_request = self._query([{'typename': 'A', 'data': '1.2.3.4'}])
+        self.assertTrue(is_tor)
+        self.assertEqual(mock_request.call_args[1]['name'], '77.193.25.171.80.1.2.3.4.ip-port.exitlist.torproject.org')
+
+    def test_cname_record(self, mock_discover):
+        is_tor, mock_request = self._query(
+            [{'typename': 'CNAME', 'data': 'beam.herokuapp.com'}, {'typename': 'A', 'data': '1.2.3.4'}])
+        self.assertTrue(is_tor)
+        self.assertEqual(mock_request.call_args[1]['name'], '77.193.25.171.80.1.2.3.4.ip-port.exitlist.torproject.org')
+
+    def test_no_a_record(self, mock_discover):
+        is_tor, mock_request = self._query([])
+        self.assertFalse(is_tor)
+        self.assertEqual(mock_request.call_count, 1)
+
+
+class LRUCacheTests(TestCase):
+
+    def setUp(self):
+        metrics.reset()
+        self.cache = LRUCache('test', 2)
+
+    def test_eviction(self):
+        self.assertEqual(self.cache.get('a', lambda: 1), 1)
+        self.assertEqual(self.cache.get('b', lambda: 2), 2)
+        self.assertEqual(self.cache.get('a', lambda: 3), 1)
+
+        # b is least recently used
+        self.assertEqual(self.cache.get('c', lambda: None), None)
+        self.assertEqual(len(self.cache), 2)
+        self.assertEqual(self.cache.get('c', lambda: 4), None)
+        self.assertEqual(self.cache.get('a', lambda: 5), 1)
+        self.assertEqual(self.cache.get('b', lambda: 6), 6)
+
+        self.assertEqual(metrics.get_counter('test.cache_hits'), 3)
+        self.assertEqual(metrics.get_counter('test.cache_misses'), 4)
+
+    @patch('beam.utils.lru_cache.time.time', return_value=1000.0)
+    def test_timeout(self, mock_time):
+        cache = LRUCache('test', 2, timeout=60)
+        self.assertEqual(cache.get('a', lambda: 1), 1)
+
+        mock_time.return_value += 59
+        self.assertEqual(cache.get('a', lambda: 2), 1)
+
+        mock_time.return_value += 1
+        self.assertEqual(cache.get('a', lambda: 3), 3)
+
+    def test_loader_fails(self):
+        def fail():
+            raise ValueError
+
+        self.assertRaises(ValueError, self.cache.get, 'a', fail)
+        self.assertEqual(len(self.cache), 0)
+
+
+@override_settings(ENV=settings.ENV_DEV)
+class CountryBlockedTests(TestCase):
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        ip_blocking.country_codes.clear()
+
+    def tearDown(self):
+        ip_blocking.country_codes.clear()
+
+    @patch('beam.utils.ip_blocking._geoip', None)
+    @patch('beam.utils.ip_blocking.GeoIP')
+    def test_country_blocked(self, mock_geoip):
+        mock_geoip.return_value.country_code.side_effect = lambda ip: {'1.2.3.4': 'US'}.get(ip, 'DE')
+        request = self.factory.get('/', HTTP_REFERER='http://dev.beamremit.com/')
+
+        self.assertTrue(ip_blocking.country_blocked(request, '1.2.3.4'))
+        self.assertFalse(ip_blocking.country_blocked(request, '5.6.7.8'))
+        self.assertTrue(ip_blocking.country_blocked(request, '1.2.3.4'))
+
+        # the database is opened once and every address looked up once
+        mock_geoip.assert_called_once_with(cache=settings.GEOIP_CACHE)
+        self.assertEqual(mock_geoip.return_value.country_code.call_count, 2)
+
+
+@override_settings(ENV=settings.ENV_DEV)
+class ScreeningMiddlewareTests(TestCase):
+
+    url_signin = reverse('account:signin')
+
+    def setUp(self):
+        ip_blocking.verdicts.clear()
+
+    def tearDown(self):
+        ip_blocking.verdicts.clear()
+
+    def _post(self, url, ip_address, referer='http://dev.beamremit.com/'):
+        return self.client.post(url, {}, REMOTE_ADDR=ip_address, HTTP_REFERER=referer)
+
+    @patch('beam.utils.ip_blocking.is_tor_node', side_effect=lambda ip: ip == '5.6.7.8')
+    @patch('beam.utils.ip_blocking.get_country_code', side_effect=lambda ip: {'1.2.3.4': 'US'}.get(ip, 'DE'))
+    def test_screening(self, mock_country_code, mock_tor):
+        self.assertEqual(self._post(self.url_signin, '1.2.3.4').status_code, 451)
+        self.assertEqual(self._post(reverse('transaction:add'), '5.6.7.8').status_code, 451)
+        self.assertNotEqual(self._post(self.url_signin, '9.9.9.9').status_code, 451)
+
+        # verdicts are cached
+        self.assertEqual(self._post(self.url_signin, '1.2.3.4').status_code, 451)
+        self.assertEqual(mock_country_code.call_count, 3)
+
+        # separately for each blacklist, US is allowed on Bitcoin Against Ebola
+        response = self._post(self.url_signin, '1.2.3.4', 'http://dev.bitcoinagainstebola.org/')
+        self.assertNotEqual(response.status_code, 451)
+
+        # other urls are not screened
+        self.assertNotEqual(self._post(reverse('account:signout'), '1.2.3.4').status_code, 451)
+        self.assertEqual(mock_country_code.call_count, 4)
+
+    @patch('beam.utils.ip_blocking.is_tor_node', return_value=False)
+    @patch('beam.utils.ip_blocking.get_country_code', return_value='US')
+    def test_ip_ranges(self, mock_country_code, mock_tor):
+        ranges = (IPRangeSet(['1.2.3.4', '2001:db8::/32']), IPRangeSet(['5.6.0.0/16', '2001::/16']))
+
+        with patch('beam.utils.ip_blocking._ip_ranges', ranges):
+            # allowed addresses pass the country check
+            self.assertEqual(self._post(self.url_signin, '9.9.9.9').status_code, 451)
+            self.assertNotEqual(self._post(self.url_signin, '1.2.3.4').status_code, 451)
+
+            mock_country_code.return_value = 'DE'
+            self.assertEqual(self._post(self.url_signin, '5.6.7.8', 'http://dev.bitcoinagainstebola.org/').status_code, 451)
+            self.assertEqual(self._post(self.url_signin, '2001:db9::1').status_code, 451)
+            self.assertNotEqual(self._post(self.url_signin, '2001:db8::1').status_code, 451)
+
+    @override_settings(SCREENING_TIMEOUT=0.05)
+    @patch('beam.utils.ip_blocking.get_country_code')
+    @patch('beam.utils.ip_blocking.is_tor_node', side_effect=lambda ip: time.sleep(0.2))
+    def test_timeout(self, mock_tor, mock_country_code):
+        metrics.reset()
+
+        # a check blocking the client does not wait for the others
+        mock_country_code.return_value = 'US'
+        self.assertEqual(self._post(self.url_signin, '1.2.3.4').status_code, 451)
+
+        # inconclusive screening lets clients through or blocks them, but is not cached
+        mock_country_code.return_value = 'DE'
+        self.assertNotEqual(self._post(self.url_signin, '5.6.7.8').status_code, 451)
+        with override_settings(SCREENING_TOR_FAIL_CLOSED=True):
+            self.assertEqual(self._post(self.url_signin, '5.6.7.8').status_code, 451)
+
+        # failed country checks block by default
+        mock_country_code.side_effect = ValueError
+        mock_tor.side_effect = None
+        mock_tor.return_value = False
+        self.assertEqual(self._post(self.url_signin, '9.9.9.9').status_code, 451)
+        with override_settings(SCREENING_COUNTRY_FAIL_CLOSED=False):
+            self.assertNotEqual(self._post(self.url_signin, '9.9.9.9').status_code, 451)
+
+        self.assertEqual(metrics.get_counter('screening.blocked'), 1)
+        self.assertEqual(metrics.get_counter('screening.inconclusive'), 4)
+        self.assertEqual(metrics.get_counter('screening.timeouts'), 2)
+        self.assertEqual(metrics.get_timing('screening.latency')[0], 5)
+        self.assertLess(metrics.get_timing('screening.latency')[2], 0.2)
+
+
+class RunChecksTests(TestCase):
+
+    def test_checks_skipped_after_deadline(self):
+        metrics.reset()
+        started = []
+
+        def slow_check():
+            started.append(True)
+            time.sleep(0.2)
+            return False
+
+        pool = ThreadPool(2)
+        self.addCleanup(pool.terminate)
+
+        # occupy all threads of the pool, the last check is only queued
+        checks = ((slow_check, False), (slow_check, False), (lambda: started.append(True), True))
+        with patch('beam.utils.ip_blocking.get_pool', return_value=pool):
+            with self.assertRaises(ip_blocking.ScreeningInconclusive) as cm:
+                ip_blocking.run_checks(checks, 0.05)
+        self.assertTrue(cm.exception.blocked)
+
+        # the queued check does not run once its time is up
+        time.sleep(0.3)
+        self.assertEqual(len(started), 2)
+        self.assertEqual(metrics.get_counter('screening.skipped'), 1)
+
+
+class IPRangeSetTests(TestCase):
+
+    def test_contains(self):
+        ranges = IPRangeSet(['10.0.0.0/8', '192.168.1.0/25', '172.16.5.4', '100.64.0.0/10', '2001:db8::/32', '::1'])
+
+        for address in ('10.255.0.1', '192.168.1.0', '192.168.1.127', '172.16.5.4', '100.127.255.255',
+                        '2001:db8::1', '2001:db8:ffff::', '::1', '0:0:0:0:0:0:0:1'):
+            self.assertIn(address, ranges)
+
+        for address in ('11.0.0.1', '192.168.1.128', '172.16.5.5', '100.128.0.0', '2001:db9::1', '::2',
+                        'invalid', '', None):
+            self.assertNotIn(address, ranges)
+
+        self.assertEqual(len(ranges), 6)
+
+    def test_ipv4_mapped(self):
+        ranges = IPRangeSet(['10.0.0.0/8', '192.168.1.0/25'])
+        for address in ('::ffff:10.1.2.3', '::FFFF:192.168.1.5', '::ffff:a01:203'):
+            self.assertIn(address, ranges)
+        for address in ('::ffff:11.0.0.1', '::10.1.2.3', '64:ff9b::10.1.2.3'):
+            self.assertNotIn(address, ranges)
+
+        self.assertIn('::ffff:8.8.8.8', IPRangeSet(['0.0.0.0/0']))
+
+    def test_default_route(self):
+        ranges = IPRangeSet(['0.0.0.0/0'])
+        self.assertIn('8.8.8.8', ranges)
+        self.assertNotIn('2001:db8::1', ranges)
+
+    def test_invalid(self):
+        ranges = IPRangeSet()
+        for network in ('10.0.0.0/33', '10.0.0.0/x', '10.0.0/8', '2001:db8::/129'):
+            self.assertRaises(ValueError, ranges.add, network)
+
+        # host bits are ignored
+        ranges.add('10.1.2.3/8')
+        self.assertIn('10.200.0.1', ranges)
+
+    def test_from_files(self):
+        handle, path = tempfile.mkstemp()
+        os.close(handle)
+        try:
+            with open(path, 'w') as networks:
+                networks.write('; Spamhaus DROP List\n1.10.16.0/20 ; SBL256894\n\n# hosting\n2a00:1450::/32\nfoo\n')
+            ranges = IPRangeSet.from_files([path])
+        finally:
+            os.remove(path)
+
+        self.assertEqual(len(ranges), 2)
+        self.assertIn('1.10.31.255', ranges)
+        self.assertIn('2a00:1450:4001::1', ranges)
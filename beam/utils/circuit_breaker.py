@@ -0,0 +1,59 @@
+import time
+
+from django.core.cache import cache
+
+from beam.utils import metrics
+from beam.utils.log import log_error
+
+'''
+Circuit breaker for calls to external services.
+
+After failure_threshold consecutive failures the breaker opens for
+reset_timeout seconds, during which callers are expected to fail fast instead
+of waiting for the service. Afterwards calls are let through again, but a
+single failure reopens the breaker, while a success closes it.
+
+State is kept in Django's cache backend. With the default local-memory
+backend every worker process has a breaker of its own, which opens after
+failure_threshold failures of its own calls. Workers only share the breaker
+if CACHES configures a shared backend such as memcached, which production
+has to do through CACHE_BACKEND and CACHE_LOCATION.
+'''
+
+# failures are only counted as consecutive if they occur within this many seconds
+FAILURE_COUNT_TIMEOUT = 24 * 60 * 60
+
+
+class CircuitBreaker(object):
+
+    def __init__(self, name, failure_threshold, reset_timeout):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures_key = 'circuit_breaker_{}_failures'.format(name)
+        self.open_until_key = 'circuit_breaker_{}_open_until'.format(name)
+
+    def is_open(self):
+        return cache.get(self.open_until_key, 0) > time.time()
+
+    def record_success(self):
+        cache.delete_many((self.failures_key, self.open_until_key))
+
+    def record_failure(self):
+        cache.add(self.failures_key, 0, FAILURE_COUNT_TIMEOUT)
+        try:
+            failures = cache.incr(self.failures_key)
+        except ValueError:
+            # key was evicted or deleted in the meantime
+            failures = 1
+            cache.set(self.failures_key, failures, FAILURE_COUNT_TIMEOUT)
+
+        if failures >= self.failure_threshold:
+            self.open()
+
+    def open(self):
+        cache.set(self.open_until_key, time.time() + self.reset_timeout, self.reset_timeout)
+        # let one failure after the cool down reopen the breaker
+        cache.set(self.failures_key, self.failure_threshold - 1, FAILURE_COUNT_TIMEOUT)
+        metrics.increment(self.name + '.circuit_opened')
+        log_error('ERROR - Circuit breaker {}: open for {} seconds'.format(self.name, self.reset_timeout))
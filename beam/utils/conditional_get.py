@@ -0,0 +1,109 @@
+import hashlib
+from calendar import timegm
+
+from django.conf import settings
+from django.http import HttpResponseNotModified
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils.http import http_date, parse_etags, parse_http_date_safe, quote_etag
+
+'''
+Conditional GET support for endpoints serving reference data (Pricing,
+ExchangeRate, Comparison, Limit, State). Those rows are never updated, a
+change always creates a new row, so id and start time of the current rows
+identify the representation.
+'''
+
+
+def generate_etag(*objects):
+    key = ';'.join(
+        '{}:{}:{}'.format(o.__class__.__name__, o.id, o.start.isoformat()) for o in objects)
+    return hashlib.md5(key).hexdigest()
+
+
+def get_last_modified(*objects):
+    return max(o.start for o in objects)
+
+
+def generate_variant_etag(etag, variant):
+    '''
+    ETag of a representation that temporarily deviates from the one
+    identified by etag, e.g. while a service is down.
+    '''
+    return hashlib.md5('{};{}'.format(etag, variant)).hexdigest()
+
+
+def is_not_modified(request, etag, last_modified):
+
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+
+    if if_none_match:
+        etags = parse_etags(if_none_match)
+        return etag in etags or '*' in etags
+
+    if last_modified is None:
+        return False
+
+    if_modified_since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE'))
+
+    if if_modified_since is not None:
+        return timegm(last_modified.utctimetuple()) <= if_modified_since
+
+    return False
+
+
+def set_validators(response, etag, last_modified, max_age=None):
+    '''
+    Without last_modified, only the ETag validates the response. max_age
+    defaults to CONDITIONAL_GET_MAX_AGE.
+    '''
+
+    if response.status_code not in (200, 304):
+        return response
+
+    response['ETag'] = quote_etag(etag)
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(timegm(last_modified.utctimetuple()))
+
+    # responses differ between the frontend sites, which are told apart by the Referer, so
+    # shared caches must not store them, they would keep a copy per referring page
+    patch_cache_control(
+        response, private=True, max_age=settings.CONDITIONAL_GET_MAX_AGE if max_age is None else max_age)
+
+    return response
+
+
+def not_modified_response(etag, last_modified, max_age=None):
+    return set_validators(HttpResponseNotModified(), etag, last_modified, max_age)
+
+
+class VaryOnRefererMixin(object):
+    '''
+    Adds Referer to the Vary header of the responses of a view. DRF sets Vary
+    when finalizing the response, replacing whatever the view set.
+    '''
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super(VaryOnRefererMixin, self).finalize_response(request, response, *args, **kwargs)
+        patch_vary_headers(response, ('Referer',))
+        return response
+
+
+class ConditionalRetrieveMixin(VaryOnRefererMixin):
+    '''
+    Answers GET with 304 Not Modified if the client already holds the current
+    representation. Views have to implement get_validator_objects(), returning
+    the rows the response is built from.
+    '''
+
+    def get(self, request, *args, **kwargs):
+
+        objects = self.get_validator_objects()
+        etag = generate_etag(*objects)
+        last_modified = get_last_modified(*objects)
+
+        if is_not_modified(request, etag, last_modified):
+            return not_modified_response(etag, last_modified)
+
+        response = super(ConditionalRetrieveMixin, self).get(request, *args, **kwargs)
+
+        return set_validators(response, etag, last_modified)
@@ -0,0 +1,182 @@
+import errno
+import httplib
+import random
+import select
+import socket
+import threading
+import time
+import urlparse
+
+from beam.utils import metrics
+
+'''
+HTTP client for calls to external APIs, built on httplib.
+
+Connections are kept alive and reused per thread, so consecutive calls to the
+same host skip the TCP and TLS handshakes. Connections idle for longer than
+max_idle seconds or closed by the server are dropped before they are reused.
+Idempotent requests are retried on network errors and 5xx responses with
+jittered exponential backoff, everything else is sent once.
+
+A reused connection can still turn out to be closed by the server while the
+request is sent. If writing the request failed, it is sent once more on a
+fresh connection whatever its method. If no response arrived, the server may
+have processed the request nonetheless, so only idempotent requests are sent
+once more.
+The latency of every attempt is recorded as metric <name>.latency.
+'''
+
+
+class HTTPClientError(Exception):
+    pass
+
+
+class HTTPError(HTTPClientError):
+
+    def __init__(self, code, reason, body):
+        super(HTTPError, self).__init__('{} {}'.format(code, reason))
+        self.code = code
+        self.reason = reason
+        self.body = body
+
+
+def _closed_by_server(error):
+    '''
+    Whether error means the server closed the connection before sending any
+    part of a response, rather than it failed while handling the request.
+    '''
+    if isinstance(error, httplib.BadStatusLine):
+        # depending on the Python version, a missing status line is reported
+        # as "''" or with an explanation
+        return error.line in ('', "''") or error.line.startswith('No status line received')
+    return getattr(error, 'errno', None) in (errno.ECONNRESET, errno.EPIPE, errno.ECONNABORTED)
+
+
+def _is_dropped(connection):
+    '''
+    Whether the server closed an idle connection, which then is readable.
+    '''
+    try:
+        return bool(select.select([connection.sock], [], [], 0)[0])
+    except (select.error, socket.error, ValueError):
+        return True
+
+
+class HTTPClient(object):
+
+    IDEMPOTENT_METHODS = ('GET', 'HEAD')
+
+    def __init__(self, name, connect_timeout, read_timeout, max_retries=0, backoff=0.1, max_idle=30,
+                 jitter=random.uniform):
+        '''
+        The delay before retry n is jitter(0, backoff * 2 ** n) seconds.
+        '''
+        self.name = name
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_idle = max_idle
+        self.jitter = jitter
+        self._local = threading.local()
+
+    def _get_pool(self):
+        if not hasattr(self._local, 'connections'):
+            self._local.connections = {}
+        return self._local.connections
+
+    def _get_connection(self, scheme, netloc):
+        '''
+        Return a connection and whether it was used before.
+        '''
+        pool = self._get_pool()
+        entry = pool.get((scheme, netloc))
+
+        if entry is not None:
+            connection, last_used = entry
+            if time.time() - last_used < self.max_idle and not _is_dropped(connection):
+                return connection, True
+            connection.close()
+
+        if scheme == 'https':
+            connection = httplib.HTTPSConnection(netloc, timeout=self.connect_timeout)
+        else:
+            connection = httplib.HTTPConnection(netloc, timeout=self.connect_timeout)
+
+        connection.connect()
+        connection.sock.settimeout(self.read_timeout)
+
+        pool[(scheme, netloc)] = (connection, time.time())
+        return connection, False
+
+    def _discard_connection(self, scheme, netloc):
+        entry = self._get_pool().pop((scheme, netloc), None)
+        if entry is not None:
+            entry[0].close()
+
+    def _send(self, method, url, body, headers):
+        connection, reused = self._get_connection(url.scheme, url.netloc)
+
+        path = url.path
+        if url.query:
+            path += '?' + url.query
+
+        sent = False
+
+        try:
+            connection.request(method, path, body, headers)
+            sent = True
+            response = connection.getresponse()
+        except (socket.error, httplib.BadStatusLine) as e:
+            if not reused or not _closed_by_server(e) or (sent and method not in self.IDEMPOTENT_METHODS):
+                raise
+            metrics.increment(self.name + '.stale_connections')
+            self._discard_connection(url.scheme, url.netloc)
+            connection, _ = self._get_connection(url.scheme, url.netloc)
+            connection.request(method, path, body, headers)
+            response = connection.getresponse()
+
+        data = response.read()
+
+        if response.will_close:
+            self._discard_connection(url.scheme, url.netloc)
+        else:
+            self._get_pool()[(url.scheme, url.netloc)] = (connection, time.time())
+
+        return response.status, response.reason, data
+
+    def request(self, method, url, body=None, headers=None):
+        '''
+        Return the body of the response, raise HTTPError for 4xx and 5xx
+        responses and HTTPClientError if no response was received.
+        '''
+        url = urlparse.urlsplit(url)
+        retries = self.max_retries if method in self.IDEMPOTENT_METHODS else 0
+        attempt = 0
+
+        while True:
+            start = time.time()
+
+            try:
+                code, reason, data = self._send(method, url, body, headers or {})
+                error = None
+            except (socket.error, httplib.HTTPException) as e:
+                self._discard_connection(url.scheme, url.netloc)
+                error = HTTPClientError('{}: {}'.format(e.__class__.__name__, e))
+            else:
+                if code >= 400:
+                    error = HTTPError(code, reason, data)
+
+            metrics.record_timing(self.name + '.latency', time.time() - start)
+
+            if error is None:
+                return data
+
+            metrics.increment(self.name + '.errors')
+
+            # client errors will not go away by retrying
+            if attempt >= retries or (isinstance(error, HTTPError) and error.code < 500):
+                raise error
+
+            attempt += 1
+            time.sleep(self.jitter(0, self.backoff * 2 ** attempt))
@@ -1,13 +1,61 @@
+import os
+import Queue
+import re
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
 import DNS
 
 from django.conf import settings
 from django.contrib.gis.geoip import GeoIP
+from django.http import HttpResponse
 
+from beam.utils import metrics
 from beam.utils.log import log_error
 from beam.utils.angular_requests import get_country_blacklist_by_request
+from beam.utils.ip_ranges import IPRangeSet, is_ipv4
+from beam.utils.lru_cache import LRUCache
+from beam.utils.tor_exit_list import TorExitList
 
 HTTP_451_UNAVAILABLE_FOR_LEGAL_REASONS = 451
 
+tor_exit_nodes = TorExitList(settings.TOR_EXIT_LIST_URL, settings.TOR_EXIT_LIST_REFRESH_INTERVAL)
+
+country_codes = LRUCache('geoip', settings.GEOIP_CACHE_SIZE)
+
+verdicts = LRUCache('screening', settings.SCREENING_CACHE_SIZE, timeout=settings.SCREENING_VERDICT_TIMEOUT)
+
+_geoip = None
+_geoip_lock = threading.Lock()
+
+_ip_ranges = None
+_ip_ranges_lock = threading.Lock()
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+class ScreeningInconclusive(Exception):
+
+    def __init__(self, reason, blocked):
+        super(ScreeningInconclusive, self).__init__(reason)
+        # verdict for the client, depending on whether the failed checks fail closed
+        self.blocked = blocked
+
+
+def load_screening_data():
+    '''
+    Start loading the data clients are screened against, so that it is
+    ready before the first request.
+    '''
+    if settings.ENV != settings.ENV_LOCAL:
+        get_geoip()
+        get_ip_ranges()
+        get_pool()
+        tor_exit_nodes.start()
+
 
 def get_client_ip(request):
 
@@ -19,6 +67,43 @@ def get_client_ip(request):
     return ip
 
 
+def get_geoip():
+    '''
+    GeoIP reader shared by all threads of the process. The database is opened
+    once with GEOIP_CACHE, which should be a mode that is safe for concurrent
+    lookups, like the default GEOIP_MEMORY_CACHE.
+    '''
+    global _geoip
+
+    if _geoip is None:
+        with _geoip_lock:
+            if _geoip is None:
+                _geoip = GeoIP(cache=settings.GEOIP_CACHE)
+
+    return _geoip
+
+
+def get_ip_ranges():
+    '''
+    Networks from IP_ALLOW_LISTS and IP_DENY_LISTS, read once per process.
+    '''
+    global _ip_ranges
+
+    if _ip_ranges is None:
+        with _ip_ranges_lock:
+            if _ip_ranges is None:
+                _ip_ranges = (
+                    IPRangeSet.from_files(settings.IP_ALLOW_LISTS),
+                    IPRangeSet.from_files(settings.IP_DENY_LISTS)
+                )
+
+    return _ip_ranges
+
+
+def get_country_code(ip_address):
+    return country_codes.get(ip_address, lambda: get_geoip().country_code(ip_address))
+
+
 def country_blocked(request, ip_address):
 
     if settings.ENV == settings.ENV_LOCAL:
@@ -26,9 +111,140 @@ def country_blocked(request, ip_address):
 
     blocked_countries = get_country_blacklist_by_request(request)
 
-    g = GeoIP()
+    return get_country_code(ip_address) in blocked_countries
+
+
+def get_pool():
+    '''
+    Thread pool running screening checks, shared by all threads of the
+    process. Forked workers create their own.
+    '''
+    global _pool, _pool_pid
+
+    if _pool_pid != os.getpid():
+        with _pool_lock:
+            if _pool_pid != os.getpid():
+                _pool = ThreadPool(settings.SCREENING_THREADS)
+                _pool_pid = os.getpid()
+
+    return _pool
+
+
+def run_checks(checks, timeout):
+    '''
+    Run checks, pairs of a function and whether it fails closed,
+    concurrently. Return True as soon as one of them returns True and False
+    once all of them returned False. Raise ScreeningInconclusive if a check
+    fails or they take longer than timeout seconds, blocking the client if
+    that check fails closed.
+
+    Checks that have not started by the deadline are skipped, so that slow
+    checks do not leave a backlog in the pool. Running checks cannot be
+    stopped, they have to bound their own duration to timeout.
+    '''
+    results = Queue.Queue()
+    deadline = time.time() + timeout
+
+    def run(check, fail_closed):
+        if time.time() >= deadline:
+            metrics.increment('screening.skipped')
+            return
+        try:
+            results.put((bool(check()), fail_closed))
+        except Exception as e:
+            log_error('ERROR Screening - Check failed: {}'.format(e))
+            results.put((None, fail_closed))
 
-    return g.country(ip_address)['country_code'] in blocked_countries
+    pool = get_pool()
+    for check, fail_closed in checks:
+        pool.apply_async(run, (check, fail_closed))
+
+    pending = [fail_closed for _, fail_closed in checks]
+    failed = []
+
+    while pending:
+        try:
+            result, fail_closed = results.get(timeout=max(0, deadline - time.time()))
+        except Queue.Empty:
+            metrics.increment('screening.timeouts')
+            raise ScreeningInconclusive(
+                'Checks took longer than {} seconds'.format(timeout), any(pending + failed))
+        if result:
+            return True
+        pending.remove(fail_closed)
+        if result is None:
+            failed.append(fail_closed)
+
+    if failed:
+        raise ScreeningInconclusive('A check failed', any(failed))
+
+    return False
+
+
+def ip_blocked(ip_address, blocked_countries):
+    '''
+    Addresses in IP_ALLOW_LISTS are never blocked, addresses in IP_DENY_LISTS,
+    blocked countries and Tor exit nodes always. Country and Tor are checked
+    concurrently within SCREENING_TIMEOUT seconds, failing closed as set by
+    SCREENING_COUNTRY_FAIL_CLOSED and SCREENING_TOR_FAIL_CLOSED.
+    '''
+    allowed, denied = get_ip_ranges()
+
+    if ip_address in allowed:
+        return False
+
+    if ip_address in denied:
+        return True
+
+    return run_checks(
+        (
+            (lambda: get_country_code(ip_address) in blocked_countries, settings.SCREENING_COUNTRY_FAIL_CLOSED),
+            (lambda: is_tor_node(ip_address), settings.SCREENING_TOR_FAIL_CLOSED)
+        ),
+        settings.SCREENING_TIMEOUT
+    )
+
+
+def client_blocked(request):
+    '''
+    Whether the client is denied, in a country we are not licensed to
+    operate in or uses Tor. Verdicts are cached per ip address and country
+    blacklist, except for inconclusive ones.
+    '''
+    if settings.ENV == settings.ENV_LOCAL:
+        return False
+
+    client_ip = get_client_ip(request)
+    blocked_countries = tuple(get_country_blacklist_by_request(request))
+    start = time.time()
+
+    try:
+        blocked = verdicts.get((client_ip, blocked_countries), lambda: ip_blocked(client_ip, blocked_countries))
+        outcome = 'blocked' if blocked else 'allowed'
+    except ScreeningInconclusive as e:
+        blocked = e.blocked
+        outcome = 'inconclusive'
+        log_error('ERROR Screening - Inconclusive for {}, {}: {}'.format(
+            client_ip, 'blocked' if blocked else 'allowed', e))
+
+    metrics.increment('screening.' + outcome)
+    metrics.record_timing('screening.latency', time.time() - start)
+
+    return blocked
+
+
+class ScreeningMiddleware(object):
+    '''
+    Answers requests to SCREENED_URLS by blocked clients with 451 before the
+    request reaches the view.
+    '''
+
+    def process_request(self, request):
+        if any(re.match(pattern, request.path_info) for pattern in settings.SCREENED_URLS):
+            if client_blocked(request):
+                response = HttpResponse(status=HTTP_451_UNAVAILABLE_FOR_LEGAL_REASONS)
+                response.reason_phrase = 'UNAVAILABLE FOR LEGAL REASONS'
+                return response
 
 
 def is_tor_node(ip_address):
@@ -36,7 +252,16 @@ def is_tor_node(ip_address):
     if settings.ENV == settings.ENV_LOCAL:
         return False
 
-    return is_using_tor(ip_address)
+    tor_exit_nodes.start()
+
+    if tor_exit_nodes.loaded:
+        return ip_address in tor_exit_nodes
+
+    # exit list has not been loaded yet
+    if settings.TOR_DNS_FALLBACK:
+        return is_using_tor(ip_address)
+
+    return False
 
 
 def is_using_tor(clientIp, ELPort='80'):
@@ -47,6 +272,10 @@ def is_using_tor(clientIp, ELPort='80'):
     See also https://check.torproject.org/
     '''
 
+    # the exit list can only be queried for IPv4 addresses
+    if not is_ipv4(clientIp):
+        return False
+
     DNS.DiscoverNameServers()
 
     # Put user ip in right format
@@ -54,19 +283,25 @@ def is_using_tor(clientIp, ELPort='80'):
     splitIp.reverse()
     ELExitNode = '.'.join(splitIp)
 
-    # get beam's current ip address
-    name = settings.ENV_SITE_MAPPING[settings.ENV][settings.SITE_USER]
-    ElTarget = DNS.dnslookup(name, 'A')
-
     # ExitList DNS server we want to query
     ELHost = 'ip-port.exitlist.torproject.org'
 
-    # Prepare the question as an A record (i.e. a 32-bit IPv4 address) request
-    ELQuestion = ELExitNode + "." + ELPort + "." + ElTarget[1] + "." + ELHost
-    request = DNS.DnsRequest(name=ELQuestion, qtype='A', timeout=settings.TOR_TIMEOUT)
-
-    # Ask the question and load the data into our answer
     try:
+        # get beam's current ip address, like DNS.dnslookup but within TOR_TIMEOUT
+        name = settings.ENV_SITE_MAPPING[settings.ENV][settings.SITE_USER]
+        target = DNS.DnsRequest(name=name, qtype='A', timeout=settings.TOR_TIMEOUT).req()
+        # the answer may start with CNAME records, or hold a single A record
+        ElTarget = [a['data'] for a in target.answers if a['typename'] == 'A']
+
+        if not ElTarget:
+            log_error('ERROR Tor - No ip address found for {}'.format(name))
+            return False
+
+        # Prepare the question as an A record (i.e. a 32-bit IPv4 address) request
+        ELQuestion = ELExitNode + "." + ELPort + "." + ElTarget[0] + "." + ELHost
+        request = DNS.DnsRequest(name=ELQuestion, qtype='A', timeout=settings.TOR_TIMEOUT)
+
+        # Ask the question and load the data into our answer
         answer = request.req()
     except DNS.DNSError as e:
         log_error('ERROR Tor - Failed to query ip address: {}'.format(e[0]))
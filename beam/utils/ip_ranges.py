@@ -0,0 +1,142 @@
+import socket
+
+from beam.utils.log import log_error
+
+'''
+Sets of IPv4 and IPv6 networks in CIDR notation, for allow and deny lists
+with many entries.
+
+Networks are kept in a trie per address family that branches on one byte of
+the address per level. Prefixes that do not end on a byte boundary are
+expanded into all bytes they cover on their last level. A lookup therefore
+takes at most 4 dictionary lookups for IPv4 and 16 for IPv6 addresses, no
+matter how many networks the set holds.
+'''
+
+FAMILIES = (socket.AF_INET, socket.AF_INET6)
+
+# prefix of IPv4-mapped IPv6 addresses (::ffff:a.b.c.d)
+IPV4_MAPPED_PREFIX = bytearray(10 * b'\x00' + b'\xff\xff')
+
+
+def parse_address(address):
+    '''
+    Return address family and packed bytes of an IP address, raise ValueError
+    if it is none.
+    '''
+    for family in FAMILIES:
+        try:
+            return family, bytearray(socket.inet_pton(family, address))
+        except (socket.error, ValueError, TypeError):
+            pass
+    raise ValueError('Invalid IP address: {}'.format(address))
+
+
+def is_ipv4(address):
+    try:
+        return parse_address(address)[0] == socket.AF_INET
+    except ValueError:
+        return False
+
+
+class _Node(object):
+
+    __slots__ = ('covered', 'children')
+
+    def __init__(self):
+        # bytes at this level covered entirely by a network
+        self.covered = set()
+        self.children = {}
+
+
+class IPRangeSet(object):
+
+    def __init__(self, networks=()):
+        self._roots = dict((family, _Node()) for family in FAMILIES)
+        # families containing a /0 network
+        self._all = set()
+        self.size = 0
+        for network in networks:
+            self.add(network)
+
+    def __len__(self):
+        return self.size
+
+    def add(self, network):
+        '''
+        Add a network like 10.0.0.0/8 or 2001:db8::/32, a single address counts
+        as a network of its own. Raise ValueError if it is invalid.
+        '''
+        address, _, prefix = network.strip().partition('/')
+        family, packed = parse_address(address)
+
+        try:
+            length = int(prefix) if prefix else len(packed) * 8
+        except ValueError:
+            raise ValueError('Invalid prefix length: {}'.format(network))
+        if not 0 <= length <= len(packed) * 8:
+            raise ValueError('Invalid prefix length: {}'.format(network))
+
+        self.size += 1
+
+        if length == 0:
+            self._all.add(family)
+            return
+
+        # descend to the level of the last byte of the prefix
+        level = (length - 1) // 8
+        node = self._roots[family]
+        for byte in packed[:level]:
+            node = node.children.setdefault(byte, _Node())
+
+        bits = length - level * 8
+        first = packed[level] & (0xff << (8 - bits)) & 0xff
+        node.covered.update(xrange(first, first + 2 ** (8 - bits)))
+
+    def __contains__(self, address):
+        try:
+            family, packed = parse_address(address)
+        except ValueError:
+            return False
+
+        # dual-stack sockets report IPv4 clients as IPv4-mapped IPv6 addresses
+        if family == socket.AF_INET6 and packed[:12] == IPV4_MAPPED_PREFIX:
+            family, packed = socket.AF_INET, packed[12:]
+
+        if family in self._all:
+            return True
+
+        node = self._roots[family]
+        for byte in packed:
+            if byte in node.covered:
+                return True
+            node = node.children.get(byte)
+            if node is None:
+                return False
+
+        return False
+
+    @classmethod
+    def from_files(cls, paths):
+        '''
+        Networks listed one per line in the given files. Empty lines and
+        comments starting with # or ; are skipped, as are invalid entries,
+        which are logged.
+        '''
+        ranges = cls()
+
+        for path in paths:
+            invalid = 0
+            with open(path) as networks:
+                for line in networks:
+                    network = line.split('#')[0].split(';')[0].strip()
+                    if not network:
+                        continue
+                    try:
+                        ranges.add(network)
+                    except ValueError:
+                        invalid += 1
+            if invalid:
+                log_error('ERROR IP Ranges - Skipped {} invalid entries in {}'.format(invalid, path))
+
+        return ranges
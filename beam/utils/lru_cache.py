@@ -0,0 +1,58 @@
+import threading
+import time
+from collections import OrderedDict
+
+from beam.utils import metrics
+
+'''
+Bounded, thread-safe, process-local cache that evicts the least recently used
+entry once it holds max_size entries. With a timeout, entries additionally
+expire that many seconds after they were computed. Hits and misses are
+counted as metrics <name>.cache_hits and <name>.cache_misses.
+'''
+
+_missing = object()
+
+
+class LRUCache(object):
+
+    def __init__(self, name, max_size, timeout=None):
+        self.name = name
+        self.max_size = max_size
+        self.timeout = timeout
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, loader):
+        '''
+        Return the cached value for key or call loader to compute it. Exceptions
+        raised by loader propagate and nothing is cached.
+        '''
+        with self._lock:
+            expires_at, value = self._entries.pop(key, (None, _missing))
+            if expires_at is not None and expires_at <= time.time():
+                value = _missing
+            if value is not _missing:
+                # re-insert as most recently used
+                self._entries[key] = (expires_at, value)
+
+        if value is not _missing:
+            metrics.increment(self.name + '.cache_hits')
+            return value
+
+        metrics.increment(self.name + '.cache_misses')
+        value = loader()
+
+        with self._lock:
+            self._entries[key] = (time.time() + self.timeout if self.timeout is not None else None, value)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
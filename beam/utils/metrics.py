@@ -0,0 +1,51 @@
+import threading
+from collections import defaultdict
+
+try:
+    import newrelic.agent
+except ImportError:
+    newrelic = None
+
+'''
+Process-local counters and timings. Values are additionally reported as
+custom metrics to New Relic, if the agent is installed.
+'''
+
+_lock = threading.Lock()
+_counters = defaultdict(int)
+_timings = {}
+
+
+def _report(name, value):
+    if newrelic is not None:
+        newrelic.agent.record_custom_metric('Custom/' + name, value)
+
+
+def increment(name, value=1):
+    with _lock:
+        _counters[name] += value
+    _report(name, value)
+
+
+def record_timing(name, seconds):
+    with _lock:
+        count, total, maximum = _timings.get(name, (0, 0.0, 0.0))
+        _timings[name] = (count + 1, total + seconds, max(maximum, seconds))
+    _report(name, seconds)
+
+
+def get_counter(name):
+    return _counters[name]
+
+
+def get_timing(name):
+    '''
+    Return (count, total seconds, maximum seconds) recorded for name.
+    '''
+    return _timings.get(name, (0, 0.0, 0.0))
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _timings.clear()
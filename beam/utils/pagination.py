@@ -0,0 +1,92 @@
+import base64
+
+from django.utils.dateparse import parse_datetime
+from django.utils.http import urlencode
+
+from rest_framework import status
+from rest_framework.response import Response
+
+'''
+Keyset pagination for list views ordered by a timestamp, newest first.
+
+Instead of an offset, the client passes back an opaque cursor naming the last
+row it has seen and the next page is fetched with a range condition on
+(timestamp, id). Every page thus costs the same, no matter how deep into the
+history it lies. The total count is only computed if explicitly requested.
+'''
+
+CURSOR_PARAM = 'cursor'
+COUNT_PARAM = 'count'
+
+
+def encode_cursor(timestamp, pk):
+    return base64.urlsafe_b64encode('{}|{}'.format(timestamp.isoformat(), pk))
+
+
+def decode_cursor(cursor):
+    '''
+    Return (timestamp, pk) encoded in cursor, raise ValueError if it is malformed.
+    '''
+    try:
+        timestamp, pk = base64.urlsafe_b64decode(str(cursor)).split('|')
+    except (TypeError, ValueError):
+        raise ValueError('Invalid cursor')
+
+    timestamp = parse_datetime(timestamp)
+
+    if timestamp is None:
+        raise ValueError('Invalid cursor')
+
+    return timestamp, int(pk)
+
+
+class KeysetPaginationMixin(object):
+    '''
+    Serves pages by cursor for ListAPIView subclasses if the request carries
+    the cursor parameter (empty for the first page). Requests without it fall
+    back to the regular offset pagination of the view.
+    '''
+
+    # field the queryset is ordered by (descending), ties are broken by id
+    cursor_field = None
+    invalid_cursor_error = None
+
+    def list(self, request, *args, **kwargs):
+
+        if CURSOR_PARAM not in request.QUERY_PARAMS:
+            return super(KeysetPaginationMixin, self).list(request, *args, **kwargs)
+
+        queryset = self.filter_queryset(self.get_queryset())
+        page_size = self.get_paginate_by()
+
+        data = {}
+
+        if request.QUERY_PARAMS.get(COUNT_PARAM):
+            data['count'] = queryset.count()
+
+        cursor = request.QUERY_PARAMS.get(CURSOR_PARAM)
+
+        if cursor:
+            try:
+                timestamp, pk = decode_cursor(cursor)
+            except ValueError:
+                return Response({'detail': self.invalid_cursor_error}, status=status.HTTP_400_BAD_REQUEST)
+
+            queryset = queryset.filter(**{'{}__lte'.format(self.cursor_field): timestamp}).exclude(
+                **{self.cursor_field: timestamp, 'id__gte': pk})
+
+        # fetch one row more than needed to find out whether there is another page
+        page = list(queryset.order_by('-' + self.cursor_field, '-id')[:page_size + 1])
+
+        data['next'] = None
+
+        if len(page) > page_size:
+            page = page[:page_size]
+            last = page[-1]
+            params = request.QUERY_PARAMS.copy()
+            params[CURSOR_PARAM] = encode_cursor(getattr(last, self.cursor_field), last.id)
+            data['next'] = request.build_absolute_uri('?' + urlencode(params.items()))
+
+        data['results'] = self.get_serializer(page, many=True).data
+
+        return Response(data)
@@ -1,6 +1,13 @@
 import hmac
 import hashlib
 
+from django.utils.crypto import constant_time_compare
+
 
 def generate_signature(message, key):
     return hmac.new(key, message, hashlib.sha256).hexdigest()
+
+
+def verify_signature(message, signature, key):
+    # constant time, so the comparison does not reveal how much of a forged signature is right
+    return constant_time_compare(generate_signature(message, key), signature)
@@ -0,0 +1,70 @@
+import time
+
+from django.conf import settings
+from django.db.models import F
+
+'''
+Process-local cache for reference data that only changes when an admin adds a
+new row (Pricing, ExchangeRate, Limit, Comparison, State).
+
+Every entry is tagged with a version number stored in the database
+(pricing.SnapshotVersion), so it is shared by all workers. Invalidating bumps
+that version after the new row is saved. Within a transaction, as in the admin,
+the bump commits together with the row, so no worker can cache the old row
+under the new version. Entries additionally expire after
+SNAPSHOT_CACHE_TIMEOUT seconds.
+
+Workers re-read the version at most every SNAPSHOT_VERSION_TIMEOUT seconds,
+so between changes lookups run no queries at all, and other workers serve
+the old rows for at most that long after a change.
+'''
+
+_snapshots = {}
+
+# version of the snapshots and when it has to be read again
+_version = {'value': None, 'expires_at': 0}
+
+
+def _load_version():
+    # imported here, as pricing.models depends on this module
+    from pricing.models import SnapshotVersion
+    return SnapshotVersion.objects.filter(id=SnapshotVersion.ID).values_list('version', flat=True).first() or 0
+
+
+def _get_version(now):
+    if _version['value'] is None or _version['expires_at'] <= now:
+        _version['value'] = _load_version()
+        _version['expires_at'] = now + settings.SNAPSHOT_VERSION_TIMEOUT
+    return _version['value']
+
+
+def get_snapshot(key, loader):
+    '''
+    Return the cached value for key or call loader to fetch it. Exceptions
+    raised by loader propagate and nothing is cached.
+    '''
+    now = time.time()
+    version = _get_version(now)
+
+    entry = _snapshots.get(key)
+    if entry is not None:
+        entry_version, expires_at, value = entry
+        if entry_version == version and expires_at > now:
+            return value
+
+    value = loader()
+    _snapshots[key] = (version, now + settings.SNAPSHOT_CACHE_TIMEOUT, value)
+    return value
+
+
+def invalidate_snapshots():
+    '''
+    Call after saving a new row, in the same transaction if there is one.
+    '''
+    from pricing.models import SnapshotVersion
+
+    _snapshots.clear()
+    _version['value'] = None
+
+    if not SnapshotVersion.objects.filter(id=SnapshotVersion.ID).update(version=F('version') + 1):
+        SnapshotVersion.objects.create(id=SnapshotVersion.ID, version=1)
@@ -0,0 +1,119 @@
+import httplib
+import os
+import socket
+import threading
+import time
+import urllib2
+
+from beam.utils import metrics
+from beam.utils.log import log_error
+
+'''
+In-memory set of Tor exit node addresses, loaded from a bulk exit list such
+as https://check.torproject.org/torbulkexitlist and refreshed by a background
+thread. Lookups are set membership tests, so screening a client does not
+wait for DNS.
+
+The list is replaced as a whole on every refresh. If a refresh fails, the
+previous list stays in use.
+'''
+
+# seconds to wait for the exit list to download
+FETCH_TIMEOUT = 30
+
+# seconds to wait before retrying a failed refresh
+RETRY_INTERVAL = 60
+
+
+def is_ip_address(value):
+    for family in (socket.AF_INET, socket.AF_INET6):
+        try:
+            socket.inet_pton(family, value)
+            return True
+        except (socket.error, ValueError):
+            pass
+    return False
+
+
+class TorExitList(object):
+
+    def __init__(self, source, refresh_interval):
+        self.source = source
+        self.refresh_interval = refresh_interval
+        self._nodes = None
+        self._lock = threading.Lock()
+        self._pid = None
+
+    @property
+    def loaded(self):
+        return self._nodes is not None
+
+    def __contains__(self, ip_address):
+        return self._nodes is not None and ip_address in self._nodes
+
+    def __len__(self):
+        return len(self._nodes or ())
+
+    @staticmethod
+    def parse(data):
+        '''
+        Addresses in an exit list, either one per line as in torbulkexitlist
+        or on ExitAddress lines as in exit-addresses. Anything else is skipped.
+        '''
+        nodes = set()
+
+        for line in data.splitlines():
+            fields = line.split()
+            if len(fields) > 1 and fields[0] == 'ExitAddress':
+                fields = fields[1:2]
+            if len(fields) == 1 and is_ip_address(fields[0]):
+                nodes.add(fields[0])
+
+        return frozenset(nodes)
+
+    def _read(self):
+        if self.source.startswith(('http://', 'https://')):
+            return urllib2.urlopen(self.source, timeout=FETCH_TIMEOUT).read()
+        with open(self.source) as exit_list:
+            return exit_list.read()
+
+    def load(self):
+        '''
+        Replace the list with the current one from source, returns False if
+        that failed.
+        '''
+        try:
+            nodes = self.parse(self._read())
+        except (IOError, httplib.HTTPException) as e:
+            nodes = None
+            log_error('ERROR Tor - Failed to load exit list from {}: {}'.format(self.source, e))
+        else:
+            if not nodes:
+                log_error('ERROR Tor - Exit list from {} is empty'.format(self.source))
+
+        if not nodes:
+            metrics.increment('tor_exit_list.errors')
+            return False
+
+        self._nodes = nodes
+        return True
+
+    def _refresh(self):
+        while True:
+            interval = self.refresh_interval if self.load() else min(RETRY_INTERVAL, self.refresh_interval)
+            time.sleep(interval)
+
+    def start(self):
+        '''
+        Start loading and refreshing the list in a background thread, once per
+        process. Forked workers start their own thread.
+        '''
+        if self._pid == os.getpid():
+            return
+
+        with self._lock:
+            if self._pid != os.getpid():
+                thread = threading.Thread(target=self._refresh)
+                thread.daemon = True
+                thread.start()
+                self._pid = os.getpid()
@@ -1,4 +1,8 @@
 from django.core.wsgi import get_wsgi_application
 from dj_static import Cling
 
+from beam.utils.ip_blocking import load_screening_data
+
 application = Cling(get_wsgi_application())
+
+load_screening_data()
@@ -1,7 +1,7 @@
 from django.conf import settings
 from django.contrib import admin
 
-from btc_payment.models import GoCoinInvoice
+from btc_payment.models import GoCoinInvoice, GoCoinInvoiceJob
 
 
 class GoCoinInvoiceAdmin(admin.ModelAdmin):
@@ -24,3 +24,21 @@ class GoCoinInvoiceAdmin(admin.ModelAdmin):
     list_filter = ('state', )
 
 admin.site.register(GoCoinInvoice, GoCoinInvoiceAdmin)
+
+
+class GoCoinInvoiceJobAdmin(admin.ModelAdmin):
+
+    def transaction_url(self, obj):
+        path = settings.API_BASE_URL + '/admin/transaction/transaction'
+        return '<a href="{}/{}/">{}</a>'.format(path, obj.transaction.id, obj.transaction.id)
+    transaction_url.allow_tags = True
+    transaction_url.short_description = 'transaction'
+
+    readonly_fields = ('transaction_url', 'state', 'created_at', 'finished_at')
+    fields = readonly_fields
+
+    list_display = ('id', 'transaction_url', 'state', 'created_at', 'finished_at')
+
+    list_filter = ('state', )
+
+admin.site.register(GoCoinInvoiceJob, GoCoinInvoiceJobAdmin)
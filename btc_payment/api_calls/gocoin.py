@@ -1,15 +1,37 @@
 import json
-import urllib2
 
 from django.conf import settings
 
+from beam.utils.circuit_breaker import CircuitBreaker
+from beam.utils.http_client import HTTPClient, HTTPClientError, HTTPError
 from beam.utils.log import log_error
 from beam.utils.exceptions import APIException
 
+client = HTTPClient(
+    'gocoin',
+    connect_timeout=settings.GOCOIN_CONNECT_TIMEOUT,
+    read_timeout=settings.GOCOIN_READ_TIMEOUT,
+    max_retries=settings.GOCOIN_MAX_RETRIES,
+    backoff=settings.GOCOIN_RETRY_BACKOFF,
+    max_idle=settings.GOCOIN_KEEPALIVE_TIMEOUT
+)
+
+circuit_breaker = CircuitBreaker(
+    'gocoin',
+    failure_threshold=settings.GOCOIN_CIRCUIT_BREAKER_THRESHOLD,
+    reset_timeout=settings.GOCOIN_CIRCUIT_BREAKER_TIMEOUT
+)
+
+
+class ServiceUnavailable(APIException):
+    pass
 
-def make_request(url, body=None):
 
-    opener = urllib2.build_opener()
+def is_available():
+    return not circuit_breaker.is_open()
+
+
+def make_request(url, body=None):
 
     headers = {
         'Authorization': 'Bearer ' + settings.GOCOIN_API_KEY
@@ -17,15 +39,29 @@ def make_request(url, body=None):
 
     if body:
         headers.update({'Content-Type': 'application/json'})
-        req = urllib2.Request(url, data=body, headers=headers)
+        method = 'POST'
     else:
-        req = urllib2.Request(url, headers=headers)
+        method = 'GET'
+
+    if circuit_breaker.is_open():
+        raise ServiceUnavailable
 
     try:
-        return opener.open(req)
-    except urllib2.HTTPError as e:
+        response = client.request(method, url, body=body, headers=headers)
+    except HTTPError as e:
+        if e.code >= 500:
+            circuit_breaker.record_failure()
+        else:
+            circuit_breaker.record_success()
         log_error('ERROR - ' + 'GoCoin: Failed to send request ({}: {}). {}'.format(e.code, e.reason, body))
         raise APIException
+    except HTTPClientError as e:
+        circuit_breaker.record_failure()
+        log_error('ERROR - ' + 'GoCoin: Failed to send request ({}). {}'.format(e, body))
+        raise APIException
+
+    circuit_breaker.record_success()
+    return response
 
 
 def generate_invoice(price, reference_number, transaction_id, signature, currency, redirect_url):
@@ -45,4 +81,13 @@ def generate_invoice(price, reference_number, transaction_id, signature, currenc
 
     response = make_request(settings.GOCOIN_CREATE_INVOICE_URL, body=json.dumps(data))
 
-    return json.load(response)
+    return json.loads(response)
+
+
+def get_invoice(invoice_id):
+
+    # see http://help.gocoin.com/kb/api-invoices/get-an-invoice
+
+    response = make_request(settings.GOCOIN_INVOICE_URL.format(invoice_id))
+
+    return json.loads(response)
@@ -0,0 +1,273 @@
+import json
+import random
+import re
+import socket
+import struct
+import threading
+import time
+import urllib2
+import uuid
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+
+'''
+Minimal stand-in for the GoCoin invoice API, to exercise the API client and
+the payment flow without network access. It creates and returns invoices,
+keeps connections alive like the real API and can simulate latency,
+failures and connections reset after a request was processed.
+
+Paying an invoice, either through pay_invoice or POST /invoices/<id>/pay,
+fires the webhook GoCoin would send to the invoice's callback url. Like
+GoCoin, the webhook echoes user_defined_1 and user_defined_2, so it carries
+the signature created by GoCoinInvoice.initiate.
+'''
+
+CREATE_INVOICE_PATH = re.compile(r'^/merchants/(?P<merchant_id>[^/]+)/invoices$')
+INVOICE_PATH = re.compile(r'^/invoices/(?P<invoice_id>[^/]+)$')
+PAY_INVOICE_PATH = re.compile(r'^/invoices/(?P<invoice_id>[^/]+)/pay$')
+
+# webhook event sent for each invoice status
+WEBHOOK_EVENTS = {
+    'paid': 'invoice_payment_received',
+    'underpaid': 'invoice_payment_received',
+    'ready_to_ship': 'invoice_ready_to_ship',
+    'invalid': 'invoice_invalid',
+    'merchant_review': 'invoice_merchant_review'
+}
+
+
+class FakeGoCoinHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.server.fake.register_connection(self.connection)
+
+    def finish(self):
+        try:
+            BaseHTTPRequestHandler.finish(self)
+        finally:
+            self.server.fake.unregister_connection(self.connection)
+
+    def log_message(self, format, *args):
+        pass
+
+    def _respond(self, code, data=None):
+        if self.reset:
+            # the request got processed, but the client gets no response
+            self.connection.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+            self.close_connection = 1
+            return
+        body = json.dumps(data) if data is not None else ''
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _handle(self, handler):
+        fake = self.server.fake
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        fake.register_request(self.command, self.path, self.headers, body)
+        self.reset = fake.take_reset()
+
+        if fake.latency:
+            time.sleep(fake.latency)
+
+        if fake.take_failure():
+            return self._respond(503, {'error': 'Service Unavailable'})
+
+        if self.headers.get('Authorization') != 'Bearer ' + fake.api_key:
+            return self._respond(401, {'error': 'Unauthorized'})
+
+        handler(fake, body)
+
+    def do_POST(self):
+        def create_invoice(fake, body):
+            if not CREATE_INVOICE_PATH.match(self.path):
+                return self._respond(404, {'error': 'Not Found'})
+            self._respond(201, fake.create_invoice(json.loads(body)))
+
+        def pay_invoice(fake, body):
+            invoice_id = PAY_INVOICE_PATH.match(self.path).group('invoice_id')
+            invoice_status = json.loads(body).get('status', 'paid') if body else 'paid'
+            if invoice_id not in fake.invoices or invoice_status not in WEBHOOK_EVENTS:
+                return self._respond(404, {'error': 'Not Found'})
+            self._respond(200, fake.pay_invoice(invoice_id, invoice_status))
+
+        self._handle(pay_invoice if PAY_INVOICE_PATH.match(self.path) else create_invoice)
+
+    def do_GET(self):
+        def get_invoice(fake, body):
+            match = INVOICE_PATH.match(self.path)
+            invoice = match and fake.invoices.get(match.group('invoice_id'))
+            if not invoice:
+                return self._respond(404, {'error': 'Not Found'})
+            self._respond(200, invoice)
+
+        self._handle(get_invoice)
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class FakeGoCoinServer(object):
+    '''
+    error_rate is the share of API requests answered with 503, webhook_latency
+    the delay between paying an invoice and sending its webhook and
+    webhook_error_rate the share of webhooks that get lost. callback_url
+    overrides where webhooks are sent, the payload keeps the invoice's own.
+    '''
+
+    def __init__(self, api_key, host='127.0.0.1', port=0, latency=0, btc_price=0.004, error_rate=0,
+                 webhook_latency=0, webhook_error_rate=0, callback_url=None):
+        self.api_key = api_key
+        self.latency = latency
+        self.btc_price = btc_price
+        self.error_rate = error_rate
+        self.webhook_latency = webhook_latency
+        self.webhook_error_rate = webhook_error_rate
+        self.callback_url = callback_url
+        self.invoices = {}
+        self.requests = []
+        self.webhooks = []
+        self.connections = 0
+        self.failures = 0
+        self.resets = 0
+        self._open_connections = set()
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), FakeGoCoinHandler)
+        self._server.fake = self
+        self._thread = None
+
+    @property
+    def base_url(self):
+        return 'http://{}:{}/'.format(*self._server.server_address)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def fail_next(self, count):
+        '''
+        Answer the next count requests with 503 Service Unavailable.
+        '''
+        with self._lock:
+            self.failures = count
+
+    def take_failure(self):
+        with self._lock:
+            if self.failures > 0:
+                self.failures -= 1
+                return True
+        return random.random() < self.error_rate
+
+    def reset_next(self, count):
+        '''
+        Process the next count requests, but reset their connections instead
+        of responding.
+        '''
+        with self._lock:
+            self.resets = count
+
+    def take_reset(self):
+        with self._lock:
+            if self.resets > 0:
+                self.resets -= 1
+                return True
+        return False
+
+    def drop_connections(self):
+        '''
+        Close all open connections, like servers do with idle keep-alive
+        connections.
+        '''
+        with self._lock:
+            connections = list(self._open_connections)
+        for connection in connections:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+
+    def register_connection(self, connection):
+        with self._lock:
+            self.connections += 1
+            self._open_connections.add(connection)
+
+    def unregister_connection(self, connection):
+        with self._lock:
+            self._open_connections.discard(connection)
+
+    def register_request(self, method, path, headers, body):
+        with self._lock:
+            self.requests.append((method, path, body))
+
+    def create_invoice(self, data):
+        invoice_id = str(uuid.uuid4())
+        price = round(float(data['base_price']) * self.btc_price, 8)
+        invoice = dict(data, **{
+            'id': invoice_id,
+            'status': 'unpaid',
+            # GoCoin returns amounts as strings
+            'base_price': str(data['base_price']),
+            'payment_address': '1B2QvsNpY6bNsCmhLpBsdbz3SLRtyvFRFP',
+            'price': price,
+            'crypto_balance_due': price,
+            'inverse_spot_rate': round(1 / self.btc_price, 2),
+            'usd_spot_rate': 1.6
+        })
+        with self._lock:
+            self.invoices[invoice_id] = invoice
+        return invoice
+
+    def pay_invoice(self, invoice_id, invoice_status='paid'):
+        '''
+        Set the status of an invoice and send the corresponding webhook after
+        webhook_latency seconds.
+        '''
+        with self._lock:
+            invoice = self.invoices[invoice_id]
+            invoice['status'] = invoice_status
+            if invoice_status in ('paid', 'ready_to_ship'):
+                invoice['crypto_balance_due'] = 0.0
+            invoice = dict(invoice)
+
+        webhook = threading.Timer(self.webhook_latency, self.send_webhook, (WEBHOOK_EVENTS[invoice_status], invoice))
+        webhook.daemon = True
+        webhook.start()
+        return invoice
+
+    def send_webhook(self, event, invoice):
+        '''
+        POST a webhook for invoice, returns the status code of the response or
+        None if it got lost or could not be delivered.
+        '''
+        code = None
+
+        if random.random() >= self.webhook_error_rate:
+            request = urllib2.Request(
+                self.callback_url or invoice['callback_url'],
+                json.dumps({'event': event, 'payload': invoice}),
+                {'Content-Type': 'application/json'}
+            )
+            try:
+                code = urllib2.urlopen(request, timeout=30).getcode()
+            except urllib2.HTTPError as e:
+                code = e.code
+            except (urllib2.URLError, IOError):
+                pass
+
+        with self._lock:
+            self.webhooks.append((event, invoice['id'], code))
+        return code
@@ -0,0 +1,271 @@
+import json
+import math
+import time
+import uuid
+from collections import defaultdict
+from multiprocessing.pool import ThreadPool
+from optparse import make_option
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.sites.models import Site
+from django.core.exceptions import ObjectDoesNotExist
+from django.core.management.base import BaseCommand, CommandError
+
+from userena.models import UserenaSignup
+
+from rest_framework.authtoken.models import Token
+
+from beam.utils.http_client import HTTPClient, HTTPClientError, HTTPError
+
+from account.models import BeamProfile as Profile
+
+from pricing.models import get_current_pricing, get_current_exchange_rate
+
+from state.models import get_current_state
+
+from transaction.models import Transaction
+
+from btc_payment.fake_gocoin import FakeGoCoinServer
+from btc_payment.models import GoCoinInvoiceJob
+
+CREATE_PATH = '/api/v1/transaction/add/'
+TRANSACTION_PATH = '/api/v1/transaction/{}/'
+PAYMENT_PATH = '/api/v1/transaction/{}/payment/'
+
+# seconds between requests while waiting for an invoice or a payment
+POLL_INTERVAL = 0.1
+
+
+class LoadTestError(Exception):
+
+    def __init__(self, stage, reason):
+        super(LoadTestError, self).__init__(reason)
+        self.stage = stage
+        self.reason = reason
+
+
+def percentile(values, share):
+    '''
+    Nearest-rank percentile of a sorted list.
+    '''
+    return values[max(0, int(math.ceil(share * len(values))) - 1)]
+
+
+class Command(BaseCommand):
+
+    help = ('Runs concurrent senders through creating a transaction, paying its invoice and '
+            'waiting for the payment webhook against a running API server, and reports '
+            'throughput and latencies. Starts the fake GoCoin API, so the API server has to '
+            'be started with GOCOIN_BASE_URL=http://<gocoin-host>:<gocoin-port>/. Senders are '
+            'created in the database and deleted afterwards, only run this against a local setup.')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--url', dest='url', default=settings.API_BASE_URL, help='Base url of the API server'),
+        make_option('--senders', type='int', dest='senders', default=10, help='Number of concurrent senders'),
+        make_option('--transactions', type='int', dest='transactions', default=10,
+                    help='Transactions per sender, subject to the daily limit'),
+        make_option('--amount', type='float', dest='amount', default=10, help='Sent amount per transaction'),
+        make_option('--timeout', type='float', dest='timeout', default=30,
+                    help='Seconds to wait for an invoice or a payment'),
+        make_option('--gocoin-host', dest='gocoin_host', default='127.0.0.1',
+                    help='Interface the fake GoCoin API listens on'),
+        make_option('--gocoin-port', type='int', dest='gocoin_port', default=8010,
+                    help='Port the fake GoCoin API listens on'),
+        make_option('--latency', type='float', dest='latency', default=0,
+                    help='Seconds before each GoCoin API request is answered'),
+        make_option('--error-rate', type='float', dest='error_rate', default=0,
+                    help='Share of GoCoin API requests answered with 503'),
+        make_option('--webhook-latency', type='float', dest='webhook_latency', default=0,
+                    help='Seconds between paying an invoice and sending its webhook'),
+        make_option('--webhook-error-rate', type='float', dest='webhook_error_rate', default=0,
+                    help='Share of webhooks that are not sent'),
+        make_option('--callback-url', dest='callback_url', default=None,
+                    help='Send webhooks here instead of the callback url of the invoice'),
+    )
+
+    def create_senders(self, count):
+        '''
+        Verified senders with complete profiles, returns their tokens.
+        '''
+        tokens = []
+
+        for _ in xrange(count):
+            name = 'loadtest_' + uuid.uuid4().hex[:12]
+            user = UserenaSignup.objects.create_user(
+                username=name,
+                email=name + '@example.com',
+                password=uuid.uuid4().hex,
+                active=True,
+                send_email=False
+            )
+            user.first_name = 'Load'
+            user.last_name = 'Test'
+            user.save()
+
+            user.profile.country = 'DE'
+            user.profile.date_of_birth = '1985-10-04'
+            user.profile.city = 'Berlin'
+            user.profile.street = 'Platz der Vereinten Nationen 23'
+            user.profile.post_code = '10249'
+            user.profile.identification_state = Profile.VERIFIED
+            user.profile.proof_of_residence_state = Profile.VERIFIED
+            user.profile.save()
+
+            tokens.append(Token.objects.create(user=user).key)
+
+        return tokens
+
+    def request(self, method, path, token, data=None):
+        headers = {
+            'Authorization': 'Token ' + token,
+            'Referer': settings.USER_BASE_URL + '/'
+        }
+        body = None
+
+        if data is not None:
+            headers['Content-Type'] = 'application/json'
+            body = json.dumps(data)
+
+        return json.loads(self.client.request(method, self.url + path, body=body, headers=headers))
+
+    def poll(self, stage, path, token, done):
+        deadline = time.time() + self.timeout
+
+        while True:
+            data = self.request('GET', path, token)
+            if done(data):
+                return data
+            if time.time() > deadline:
+                raise LoadTestError(stage, 'timeout')
+            time.sleep(POLL_INTERVAL)
+
+    def create(self, token):
+        '''
+        Create a transaction, returns the id of its invoice.
+        '''
+        data = self.request('POST', CREATE_PATH, token, self.transaction_data)
+
+        # invoice is created in the background with ASYNC_PAYMENT_INITIATION
+        if 'transactionId' in data:
+            data = self.poll(
+                'create', PAYMENT_PATH.format(data['transactionId']), token,
+                lambda status: status['state'] != GoCoinInvoiceJob.PENDING
+            )
+
+        if not data.get('invoiceId'):
+            raise LoadTestError('create', 'no invoice')
+
+        return data['invoiceId']
+
+    def run_sender(self, token):
+        '''
+        Create and pay transactions one after the other, returns a list of
+        (create, confirm, total) latencies or LoadTestErrors.
+        '''
+        results = []
+
+        for _ in xrange(self.transactions):
+            start = time.time()
+            stage = 'create'
+
+            try:
+                invoice_id = self.create(token)
+                created = time.time()
+
+                stage = 'confirm'
+                invoice = self.fake.pay_invoice(invoice_id)
+                self.poll(
+                    stage, TRANSACTION_PATH.format(invoice['user_defined_1']), token,
+                    lambda transaction: transaction['state'] == Transaction.PAID
+                )
+                confirmed = time.time()
+
+                results.append((created - start, confirmed - created, confirmed - start))
+
+            except HTTPError as e:
+                results.append(LoadTestError(stage, 'HTTP {}'.format(e.code)))
+            except HTTPClientError as e:
+                results.append(LoadTestError(stage, str(e)))
+            except LoadTestError as e:
+                results.append(e)
+
+        return results
+
+    def report(self, results, duration):
+        latencies = [result for result in results if not isinstance(result, LoadTestError)]
+        errors = defaultdict(int)
+
+        for result in results:
+            if isinstance(result, LoadTestError):
+                errors[(result.stage, result.reason)] += 1
+
+        self.stdout.write('Completed {} of {} payments in {:.2f} seconds, {:.2f} payments per second.'.format(
+            len(latencies), len(results), duration, len(latencies) / duration))
+
+        if latencies:
+            for i, stage in enumerate(('create', 'confirm', 'total')):
+                values = sorted(latency[i] for latency in latencies)
+                self.stdout.write('{:8} p50 {:.3f}s  p90 {:.3f}s  p99 {:.3f}s  max {:.3f}s'.format(
+                    stage, percentile(values, 0.5), percentile(values, 0.9), percentile(values, 0.99), values[-1]))
+
+        for (stage, reason), count in sorted(errors.items()):
+            self.stdout.write('Failed at {} ({}): {}'.format(stage, reason, count))
+
+    def handle(self, *args, **options):
+
+        if not settings.GOCOIN_API_KEY:
+            raise CommandError('GOCOIN_API_KEY is not set.')
+
+        site = Site.objects.get(domain__iexact=settings.ENV_SITE_MAPPING[settings.ENV][settings.SITE_USER])
+
+        try:
+            pricing_id = get_current_pricing(site).id
+            exchange_rate_id = get_current_exchange_rate().id
+            get_current_state(site)
+        except ObjectDoesNotExist:
+            raise CommandError('Pricing, exchange rate and state have to be set up first.')
+
+        self.url = options['url'].rstrip('/')
+        self.timeout = options['timeout']
+        self.transactions = options['transactions']
+        self.client = HTTPClient('load_test', connect_timeout=5, read_timeout=self.timeout)
+        self.transaction_data = {
+            'pricingId': pricing_id,
+            'exchangeRateId': exchange_rate_id,
+            'sentAmount': options['amount'],
+            'sentCurrency': settings.SITE_SENDING_CURRENCY[site.id],
+            'receivingCountry': settings.SITE_RECEIVING_COUNTRY[site.id][0],
+            'recipient': {
+                'firstName': 'Load',
+                'lastName': 'Test',
+                'phoneNumber': '0245025019'
+            }
+        }
+
+        self.fake = FakeGoCoinServer(
+            api_key=settings.GOCOIN_API_KEY,
+            host=options['gocoin_host'],
+            port=options['gocoin_port'],
+            latency=options['latency'],
+            error_rate=options['error_rate'],
+            webhook_latency=options['webhook_latency'],
+            webhook_error_rate=options['webhook_error_rate'],
+            callback_url=options['callback_url']
+        ).start()
+
+        tokens = self.create_senders(options['senders'])
+        pool = ThreadPool(options['senders'])
+
+        try:
+            start = time.time()
+            results = pool.map(self.run_sender, tokens)
+            duration = time.time() - start
+        finally:
+            pool.close()
+            pool.join()
+            self.fake.stop()
+            # deletes their transactions along with them
+            User.objects.filter(auth_token__key__in=tokens).delete()
+
+        self.report([result for sender_results in results for result in sender_results], duration)
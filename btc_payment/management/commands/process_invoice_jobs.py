@@ -0,0 +1,61 @@
+import time
+from optparse import make_option
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from beam.utils.log import log_error
+
+from btc_payment.models import GoCoinInvoice, GoCoinInvoiceJob
+
+
+class Command(BaseCommand):
+
+    help = 'Creates GoCoin invoices for transactions enqueued by CreateTransaction.'
+
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--once',
+            action='store_true',
+            dest='once',
+            default=False,
+            help='Process pending jobs and exit instead of polling for new ones'
+        ),
+    )
+
+    def process_pending(self):
+
+        # leave jobs pending while GoCoin is known to be down
+        if not GoCoinInvoice.is_available():
+            return 0
+
+        GoCoinInvoiceJob.requeue_stale()
+
+        jobs = GoCoinInvoiceJob.objects.select_related('transaction__pricing').filter(
+            state=GoCoinInvoiceJob.PENDING)[:settings.GOCOIN_INVOICE_JOB_BATCH_SIZE]
+
+        processed = 0
+
+        for job in jobs:
+            if job.claim():
+                # a job that cannot even be marked as failed stays running and is requeued later
+                try:
+                    job.run()
+                except Exception as e:
+                    log_error('ERROR - GoCoin Invoice Job: job {} failed, {}: {}'.format(
+                        job.id, e.__class__.__name__, e))
+                processed += 1
+
+        return processed
+
+    def handle(self, *args, **options):
+
+        while True:
+            processed = self.process_pending()
+
+            if options['once']:
+                self.stdout.write('Processed {} invoice jobs.'.format(processed))
+                return
+
+            if not processed:
+                time.sleep(settings.GOCOIN_INVOICE_JOB_POLL_INTERVAL)
@@ -0,0 +1,96 @@
+import threading
+import time
+from collections import OrderedDict
+from optparse import make_option
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from beam.utils.log import log_error
+
+from btc_payment.models import GoCoinWebhookDelivery
+
+
+class Command(BaseCommand):
+
+    help = ('Applies GoCoin webhook deliveries stored by ConfirmGoCoinPayment. Deliveries '
+            'of the same invoice are applied in the order they were received.')
+
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--once',
+            action='store_true',
+            dest='once',
+            default=False,
+            help='Process pending deliveries and exit instead of polling for new ones'
+        ),
+        make_option(
+            '--workers',
+            type='int',
+            dest='workers',
+            default=settings.GOCOIN_WEBHOOK_WORKERS,
+            help='Number of threads applying deliveries'
+        ),
+    )
+
+    @staticmethod
+    def run_deliveries(deliveries, close_connection=False):
+        try:
+            for delivery in deliveries:
+                if delivery.claim():
+                    # a delivery that cannot even be marked as failed stays running and is requeued later
+                    try:
+                        delivery.run()
+                    except Exception as e:
+                        log_error('ERROR - GoCoin Callback: delivery {} failed, {}: {}'.format(
+                            delivery.id, e.__class__.__name__, e))
+        finally:
+            # threads get their own database connection
+            if close_connection:
+                connection.close()
+
+    def process_pending(self, workers):
+        GoCoinWebhookDelivery.requeue_stale()
+
+        deliveries = GoCoinWebhookDelivery.objects.filter(
+            state=GoCoinWebhookDelivery.PENDING).order_by('id')[:settings.GOCOIN_WEBHOOK_BATCH_SIZE]
+
+        # all deliveries of an invoice go to the same worker, which preserves their order
+        partitions = [[] for _ in xrange(workers)]
+        invoices = OrderedDict()
+
+        for delivery in deliveries:
+            invoices.setdefault(delivery.invoice_id, []).append(delivery)
+
+        for i, invoice_deliveries in enumerate(invoices.itervalues()):
+            partitions[i % workers].extend(invoice_deliveries)
+
+        if workers == 1:
+            self.run_deliveries(partitions[0])
+        else:
+            threads = [
+                threading.Thread(target=self.run_deliveries, args=(partition, True))
+                for partition in partitions if partition
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        return sum(len(partition) for partition in partitions)
+
+    def handle(self, *args, **options):
+
+        total = 0
+
+        while True:
+            processed = self.process_pending(options['workers'])
+            total += processed
+
+            if not processed:
+                if options['once']:
+                    self.stdout.write('Processed {} webhook deliveries.'.format(total))
+                    return
+
+                time.sleep(settings.GOCOIN_WEBHOOK_POLL_INTERVAL)
@@ -0,0 +1,142 @@
+from collections import defaultdict
+from datetime import timedelta
+from multiprocessing.pool import ThreadPool
+from optparse import make_option
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction as dbtransaction
+from django.utils import timezone
+
+from beam.utils.exceptions import APIException
+
+from transaction.models import Transaction
+
+from btc_payment.api_calls import gocoin
+from btc_payment.models import GoCoinInvoice
+
+
+def fetch_invoice(invoice_id):
+    try:
+        return gocoin.get_invoice(invoice_id)
+    except APIException:
+        return None
+
+
+def get_balance_due(invoice, data):
+    try:
+        return float(data['crypto_balance_due'])
+    except (KeyError, TypeError, ValueError):
+        return invoice.balance_due
+
+
+class Command(BaseCommand):
+
+    help = ('Polls GoCoin for invoices of transactions that have not been paid for a while, '
+            'in case their webhooks got lost, and applies their current state. This includes '
+            'expired transactions, which can still be paid until their invoice is final.')
+
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--workers',
+            type='int',
+            dest='workers',
+            default=settings.GOCOIN_RECONCILE_WORKERS,
+            help='Number of concurrent requests to GoCoin'
+        ),
+    )
+
+    # invoice state and the transaction state it implies for each GoCoin status
+    TRANSITIONS = {
+        'paid': (GoCoinInvoice.PAID, Transaction.PAID),
+        'ready_to_ship': (GoCoinInvoice.READY_TO_SHIP, Transaction.PAID),
+        'underpaid': (GoCoinInvoice.UNDERPAID, None),
+        'invalid': (GoCoinInvoice.INVALID, Transaction.INVALID),
+        'merchant_review': (GoCoinInvoice.MERCHANT_REVIEW, Transaction.INVALID)
+    }
+
+    def apply(self, invoices, fetched):
+        '''
+        Apply the fetched invoices with one UPDATE per resulting state, plus one
+        per changed balance. Returns the transactions that were paid or set
+        invalid.
+        '''
+        invoice_ids = defaultdict(list)
+        transaction_ids = defaultdict(list)
+        balances = {}
+
+        for invoice, data in zip(invoices, fetched):
+            if data is None:
+                continue
+
+            invoice_status = data.get('status')
+            if invoice_status in self.TRANSITIONS:
+                invoice_state, transaction_state = self.TRANSITIONS[invoice_status]
+                if invoice_state != invoice.state:
+                    invoice_ids[invoice_state].append(invoice.id)
+                if transaction_state is not None:
+                    transaction_ids[transaction_state].append(invoice.transaction_id)
+
+            balance_due = get_balance_due(invoice, data)
+            if balance_due != invoice.balance_due:
+                balances[invoice.id] = balance_due
+
+        now = timezone.now()
+
+        with dbtransaction.atomic():
+            for invoice_state, ids in invoice_ids.items():
+                GoCoinInvoice.objects.filter(
+                    id__in=ids, state__in=(GoCoinInvoice.UNPAID, GoCoinInvoice.UNDERPAID)
+                ).update(state=invoice_state)
+
+            for invoice_id, balance_due in balances.items():
+                GoCoinInvoice.objects.filter(id=invoice_id).update(balance_due=balance_due)
+
+            # late payments for expired transactions count, as with webhooks
+            paid = Transaction.bulk_transition(
+                transaction_ids[Transaction.PAID], Transaction.PAID,
+                (Transaction.INIT, Transaction.INVALID), paid_at=now)
+
+            invalid = Transaction.bulk_transition(
+                transaction_ids[Transaction.INVALID], Transaction.INVALID, (Transaction.INIT,), invalidated_at=now)
+
+        return paid, invalid
+
+    def handle(self, *args, **options):
+
+        # invoices are final once GoCoin reports anything but unpaid or underpaid
+        stale = GoCoinInvoice.objects.filter(
+            state__in=(GoCoinInvoice.UNPAID, GoCoinInvoice.UNDERPAID),
+            transaction__state__in=(Transaction.INIT, Transaction.INVALID),
+            transaction__initialized_at__lt=timezone.now() - timedelta(seconds=settings.GOCOIN_RECONCILE_AFTER)
+        ).order_by('id')
+
+        pool = ThreadPool(options['workers'])
+        last_id = 0
+        checked = paid_count = invalid_count = 0
+
+        try:
+            while True:
+                invoices = list(stale.filter(id__gt=last_id)[:settings.GOCOIN_RECONCILE_BATCH_SIZE])
+
+                if not invoices:
+                    break
+
+                last_id = invoices[-1].id
+                fetched = pool.map(fetch_invoice, [invoice.invoice_id for invoice in invoices])
+
+                paid, invalid = self.apply(invoices, fetched)
+
+                for transaction in paid:
+                    transaction.post_paid()
+                for transaction in invalid:
+                    transaction.post_paid_problem()
+
+                checked += len(invoices)
+                paid_count += len(paid)
+                invalid_count += len(invalid)
+        finally:
+            pool.close()
+            pool.join()
+
+        self.stdout.write('Checked {} invoices, {} paid, {} invalid.'.format(checked, paid_count, invalid_count))
@@ -0,0 +1,55 @@
+import time
+from optparse import make_option
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from btc_payment.fake_gocoin import FakeGoCoinServer
+
+
+class Command(BaseCommand):
+
+    help = ('Runs a local stand-in for the GoCoin API. Start the API server with '
+            'GOCOIN_BASE_URL=http://<host>:<port>/ to create invoices there, and pay them '
+            'with POST /invoices/<id>/pay to receive the webhook.')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--host', dest='host', default='127.0.0.1', help='Interface to listen on'),
+        make_option('--port', type='int', dest='port', default=8010, help='Port to listen on'),
+        make_option('--latency', type='float', dest='latency', default=0,
+                    help='Seconds before each API request is answered'),
+        make_option('--error-rate', type='float', dest='error_rate', default=0,
+                    help='Share of API requests answered with 503'),
+        make_option('--webhook-latency', type='float', dest='webhook_latency', default=0,
+                    help='Seconds between paying an invoice and sending its webhook'),
+        make_option('--webhook-error-rate', type='float', dest='webhook_error_rate', default=0,
+                    help='Share of webhooks that are not sent'),
+        make_option('--callback-url', dest='callback_url', default=None,
+                    help='Send webhooks here instead of the callback url of the invoice'),
+    )
+
+    def handle(self, *args, **options):
+
+        if not settings.GOCOIN_API_KEY:
+            raise CommandError('GOCOIN_API_KEY is not set.')
+
+        server = FakeGoCoinServer(
+            api_key=settings.GOCOIN_API_KEY,
+            host=options['host'],
+            port=options['port'],
+            latency=options['latency'],
+            error_rate=options['error_rate'],
+            webhook_latency=options['webhook_latency'],
+            webhook_error_rate=options['webhook_error_rate'],
+            callback_url=options['callback_url']
+        ).start()
+
+        self.stdout.write('Fake GoCoin API listening on {}'.format(server.base_url))
+
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.stop()
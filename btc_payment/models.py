@@ -1,9 +1,14 @@
+import json
+from datetime import timedelta
+
 from django.conf import settings
 from django.db import models
 from django.db import transaction as dbtransaction
+from django.utils import timezone
 
 from transaction.models import Transaction
 
+from beam.utils.exceptions import APIException
 from beam.utils.log import log_error
 from beam.utils.security import generate_signature
 
@@ -102,8 +107,7 @@ class GoCoinInvoice(models.Model):
             transaction.amount_btc = result['price']
 
             with dbtransaction.atomic():
-                gocoin_invoice.save()
-                transaction.gocoin_invoice = GoCoinInvoice.objects.get(id=gocoin_invoice.id)
+                gocoin_invoice.save(force_insert=True)
                 transaction.save()
 
             return gocoin_invoice.invoice_id
@@ -111,3 +115,335 @@ class GoCoinInvoice(models.Model):
         except KeyError as e:
             message = 'ERROR - GoCoin Create Invoice: received invalid response, {}, {}'
             log_error(message.format(e, result))
+
+    @staticmethod
+    def is_available():
+        return gocoin.is_available()
+
+    @staticmethod
+    def enqueue(transaction):
+        GoCoinInvoiceJob.objects.create(transaction=transaction)
+
+    @staticmethod
+    def get_initiation_status(transaction):
+        '''
+        Return state of the invoice creation for transaction and the invoice id, if it exists.
+        '''
+        try:
+            return GoCoinInvoiceJob.DONE, transaction.gocoin_invoice.invoice_id
+        except GoCoinInvoice.DoesNotExist:
+            pass
+
+        try:
+            if transaction.gocoin_invoice_job.state != GoCoinInvoiceJob.FAILED:
+                return GoCoinInvoiceJob.PENDING, None
+        except GoCoinInvoiceJob.DoesNotExist:
+            pass
+
+        return GoCoinInvoiceJob.FAILED, None
+
+
+class GoCoinInvoiceJob(models.Model):
+    '''
+    Invoice creation deferred to ./manage.py process_invoice_jobs, so that
+    requests to GoCoin do not block a web worker (see ASYNC_PAYMENT_INITIATION).
+    '''
+
+    class Meta:
+        ordering = ['created_at']
+
+    PENDING = 'PEND'
+    RUNNING = 'RUNG'
+    DONE = 'DONE'
+    FAILED = 'FAIL'
+
+    JOB_STATES = (
+        (PENDING, 'pending'),
+        (RUNNING, 'running'),
+        (DONE, 'done'),
+        (FAILED, 'failed')
+    )
+
+    transaction = models.OneToOneField(
+        Transaction,
+        related_name='gocoin_invoice_job',
+        help_text='Transaction to create an invoice for'
+    )
+
+    state = models.CharField(
+        'State',
+        max_length=4,
+        choices=JOB_STATES,
+        default=PENDING,
+        db_index=True,
+        help_text='State of the job'
+    )
+
+    created_at = models.DateTimeField(
+        'Created at',
+        auto_now_add=True,
+        help_text='Time at which the job was enqueued'
+    )
+
+    started_at = models.DateTimeField(
+        'Started at',
+        null=True,
+        blank=True,
+        help_text='Time at which a worker started creating the invoice'
+    )
+
+    finished_at = models.DateTimeField(
+        'Finished at',
+        null=True,
+        blank=True,
+        help_text='Time at which the invoice was created or creating it failed'
+    )
+
+    @staticmethod
+    def requeue_stale():
+        '''
+        Jobs still running GOCOIN_INVOICE_JOB_TIMEOUT seconds after they were
+        claimed belong to a worker that died. They are marked done if their
+        invoice got saved and pending otherwise, returns the number of jobs
+        pending again.
+        '''
+        now = timezone.now()
+        stale = GoCoinInvoiceJob.objects.filter(
+            state=GoCoinInvoiceJob.RUNNING,
+            started_at__lt=now - timedelta(seconds=settings.GOCOIN_INVOICE_JOB_TIMEOUT)
+        )
+
+        stale.filter(transaction__gocoin_invoice__isnull=False).update(
+            state=GoCoinInvoiceJob.DONE, finished_at=now)
+
+        return stale.filter(transaction__gocoin_invoice__isnull=True).update(
+            state=GoCoinInvoiceJob.PENDING, started_at=None)
+
+    def claim(self):
+        '''
+        Mark a pending job as running, returns False if another worker got it first.
+        '''
+        return GoCoinInvoiceJob.objects.filter(id=self.id, state=GoCoinInvoiceJob.PENDING).update(
+            state=GoCoinInvoiceJob.RUNNING, started_at=timezone.now()) == 1
+
+    def run(self):
+        try:
+            invoice_id = GoCoinInvoice.initiate(self.transaction)
+        except APIException:
+            invoice_id = None
+        except Exception as e:
+            message = 'ERROR - GoCoin Invoice Job: failed to create invoice for transaction {}, {}: {}'
+            log_error(message.format(self.transaction_id, e.__class__.__name__, e))
+            invoice_id = None
+
+        if invoice_id is None:
+            self.state = GoCoinInvoiceJob.FAILED
+            self.transaction.set_invalid()
+        else:
+            self.state = GoCoinInvoiceJob.DONE
+
+        self.finished_at = timezone.now()
+        self.save()
+
+
+class GoCoinWebhookDelivery(models.Model):
+    '''
+    Webhook deliveries received so far. GoCoin retries deliveries, repeated
+    ones are recognized by the unique key and acknowledged without side effects.
+    With ASYNC_PAYMENT_WEBHOOKS, deliveries are only stored by the webhook and
+    applied by ./manage.py process_webhook_deliveries.
+    '''
+
+    class Meta:
+        unique_together = (('invoice_id', 'event', 'status'),)
+
+    PENDING = 'PEND'
+    RUNNING = 'RUNG'
+    DONE = 'DONE'
+    FAILED = 'FAIL'
+
+    DELIVERY_STATES = (
+        (PENDING, 'pending'),
+        (RUNNING, 'running'),
+        (DONE, 'done'),
+        (FAILED, 'failed')
+    )
+
+    invoice_id = models.CharField(
+        'Invoice ID',
+        max_length=36,
+        help_text='UUID identifying the invoice'
+    )
+
+    event = models.CharField(
+        'Event',
+        max_length=30,
+        help_text='Event that triggered the webhook'
+    )
+
+    status = models.CharField(
+        'Status',
+        max_length=20,
+        help_text='Status of the invoice reported with the event'
+    )
+
+    payload = models.TextField(
+        'Payload',
+        blank=True,
+        help_text='Verified payload of the delivery as JSON'
+    )
+
+    state = models.CharField(
+        'State',
+        max_length=4,
+        choices=DELIVERY_STATES,
+        default=DONE,
+        db_index=True,
+        help_text='State of processing the delivery'
+    )
+
+    received_at = models.DateTimeField(
+        'Received at',
+        auto_now_add=True,
+        help_text='Time at which the delivery was first received'
+    )
+
+    started_at = models.DateTimeField(
+        'Started at',
+        null=True,
+        blank=True,
+        help_text='Time at which a worker started applying the delivery'
+    )
+
+    processed_at = models.DateTimeField(
+        'Processed at',
+        null=True,
+        blank=True,
+        help_text='Time at which the delivery was applied or found to be invalid'
+    )
+
+    def apply(self, payload):
+        '''
+        Apply the delivery to the transaction and its invoice, see
+        http://help.gocoin.com/kb/api-notifications/invoice-event-webhooks and
+        http://help.gocoin.com/kb/api-invoices/invoice-states
+        Returns the notification to send once the changes are committed, if any.
+        '''
+
+        # retrieve transaction associated with this callback
+        transaction = Transaction.objects.select_related('gocoin_invoice').get(
+            id=int(payload['user_defined_1']),
+            gocoin_invoice__invoice_id=payload['id']
+        )
+        invoice = transaction.gocoin_invoice
+
+        if self.event == 'invoice_created':
+            pass
+
+        elif self.event == 'invoice_payment_received':
+
+            invoice.balance_due = payload['crypto_balance_due']
+
+            # full payment received, this includes overpaid
+            if payload['status'] == 'paid':
+
+                invoice.state = GoCoinInvoice.PAID
+                invoice.save(update_fields=('state', 'balance_due'))
+
+                if transaction.transition(
+                        Transaction.PAID, (Transaction.INIT, Transaction.INVALID), paid_at=timezone.now()):
+                    return transaction.post_paid
+
+            # payment received, but does not fulfill the required amount
+            elif payload['status'] == 'underpaid':
+
+                invoice.state = GoCoinInvoice.UNDERPAID
+                invoice.save(update_fields=('state', 'balance_due'))
+
+            else:
+                raise APIException
+
+        # transaction has been confirmed
+        elif self.event == 'invoice_ready_to_ship' and payload['status'] == 'ready_to_ship':
+
+            # special case payment was received late, but is confirmed now
+            if transaction.state != Transaction.INVALID:
+                invoice.state = GoCoinInvoice.READY_TO_SHIP
+                invoice.save(update_fields=('state',))
+
+        # transaction requires manual intervention
+        elif self.event == 'invoice_merchant_review' or self.event == 'invoice_invalid':
+
+            if payload['status'] == 'invalid':
+                invoice.state = GoCoinInvoice.INVALID
+            elif payload['status'] == 'merchant_review':
+                invoice.state = GoCoinInvoice.MERCHANT_REVIEW
+            else:
+                raise APIException
+
+            invoice.save(update_fields=('state',))
+
+            if transaction.transition(
+                    Transaction.INVALID,
+                    (Transaction.INIT, Transaction.PAID, Transaction.PROCESSED, Transaction.CANCELLED),
+                    invalidated_at=timezone.now()):
+                return transaction.post_paid_problem
+
+        else:
+            raise APIException
+
+    @staticmethod
+    def requeue_failed(invoice_id, event, status, payload):
+        '''
+        Make a failed delivery pending again when GoCoin repeats it, returns
+        False if there is none.
+        '''
+        return GoCoinWebhookDelivery.objects.filter(
+            invoice_id=invoice_id, event=event, status=status, state=GoCoinWebhookDelivery.FAILED
+        ).update(state=GoCoinWebhookDelivery.PENDING, payload=payload, started_at=None, processed_at=None) == 1
+
+    @staticmethod
+    def requeue_stale():
+        '''
+        Deliveries still running GOCOIN_WEBHOOK_TIMEOUT seconds after they were
+        claimed belong to a worker that died before committing them, they are
+        made pending again. Returns their number.
+        '''
+        return GoCoinWebhookDelivery.objects.filter(
+            state=GoCoinWebhookDelivery.RUNNING,
+            started_at__lt=timezone.now() - timedelta(seconds=settings.GOCOIN_WEBHOOK_TIMEOUT)
+        ).update(state=GoCoinWebhookDelivery.PENDING, started_at=None)
+
+    def claim(self):
+        '''
+        Mark a pending delivery as running, returns False if another worker got it first.
+        '''
+        return GoCoinWebhookDelivery.objects.filter(id=self.id, state=GoCoinWebhookDelivery.PENDING).update(
+            state=GoCoinWebhookDelivery.RUNNING, started_at=timezone.now()) == 1
+
+    def run(self):
+        '''
+        Apply a stored delivery and send notifications.
+        '''
+        try:
+            with dbtransaction.atomic():
+                notification = self.apply(json.loads(self.payload))
+                self.state = GoCoinWebhookDelivery.DONE
+                self.processed_at = timezone.now()
+                self.save()
+
+        except Exception as e:
+            message = 'ERROR - GoCoin Callback: could not apply payment notification, {}: {}, {}'
+            log_error(message.format(e.__class__.__name__, e, self.payload))
+            self.state = GoCoinWebhookDelivery.FAILED
+            self.processed_at = timezone.now()
+            self.save()
+            return
+
+        # the delivery is applied already, failing to notify does not undo it
+        if notification is not None:
+            try:
+                notification()
+            except Exception as e:
+                message = 'ERROR - GoCoin Callback: could not send notification for delivery {}, {}: {}'
+                log_error(message.format(self.id, e.__class__.__name__, e))
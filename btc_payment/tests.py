@@ -1,3 +1,483 @@
-from django.test import TestCase
+import json
+import socket
+import time
+from datetime import timedelta
+from smtplib import SMTPException
+from StringIO import StringIO
+
+from django.contrib.sites.models import Site
+from django.core import mail as mailbox
+from django.core.management import call_command
+from django.core.urlresolvers import reverse
+from django.db import DatabaseError
+from django.test import LiveServerTestCase, TestCase
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from userena.models import UserenaSignup
+
+from mock import patch
+
+from beam.tests import TestUtils
+from beam.utils import metrics
+from beam.utils.exceptions import APIException
+from beam.utils.security import generate_signature
+
+from transaction.models import Transaction, DailyVolume
+
+from btc_payment.api_calls import gocoin
+from btc_payment.fake_gocoin import FakeGoCoinServer
+from btc_payment.models import GoCoinInvoice, GoCoinWebhookDelivery
+from btc_payment.views import ConfirmGoCoinPayment
+
+
+class GoCoinAPITests(TestCase):
+
+    api_key = 'secret'
+
+    def setUp(self):
+        self.server = FakeGoCoinServer(api_key=self.api_key).start()
+        self.settings_override = override_settings(
+            GOCOIN_API_KEY=self.api_key,
+            GOCOIN_CREATE_INVOICE_URL=self.server.base_url + 'merchants/1234/invoices',
+            GOCOIN_INVOICE_URL=self.server.base_url + 'invoices/{}'
+        )
+        self.settings_override.enable()
+        metrics.reset()
+        gocoin.circuit_breaker.record_success()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        self.server.stop()
+
+    def _generate_invoice(self):
+        return gocoin.generate_invoice(
+            price=10.0,
+            reference_number='123456',
+            transaction_id=1,
+            signature='signature',
+            currency='GBP',
+            redirect_url='http://dev.beamremit.com/'
+        )
+
+    def test_connection_reused(self):
+        invoice = self._generate_invoice()
+        self.assertEqual(invoice['user_defined_1'], 1)
+        self.assertEqual(gocoin.get_invoice(invoice['id'])['id'], invoice['id'])
+        self._generate_invoice()
+
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertEqual(self.server.connections, 1)
+        self.assertEqual(metrics.get_timing('gocoin.latency')[0], 3)
+
+    @patch.object(gocoin.client, 'jitter', return_value=0)
+    def test_reads_retried(self, mock_backoff):
+        invoice = self._generate_invoice()
+
+        self.server.fail_next(2)
+        self.assertEqual(gocoin.get_invoice(invoice['id'])['id'], invoice['id'])
+        self.assertEqual(mock_backoff.call_count, 2)
+        self.assertEqual(metrics.get_counter('gocoin.errors'), 2)
+
+        self.server.fail_next(3)
+        self.assertRaises(APIException, gocoin.get_invoice, invoice['id'])
+
+        # client errors are not retried
+        mock_backoff.reset_mock()
+        self.assertRaises(APIException, gocoin.get_invoice, 'unknown')
+        self.assertFalse(mock_backoff.called)
+
+    def test_invoice_creation_not_retried(self):
+        self.server.fail_next(1)
+        self.assertRaises(APIException, self._generate_invoice)
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertEqual(len(self.server.invoices), 0)
+
+    def test_closed_connection_not_reused(self):
+        self._generate_invoice()
+        self.server.drop_connections()
+        time.sleep(0.05)
+
+        self._generate_invoice()
+        self.assertEqual(len(self.server.invoices), 2)
+        self.assertEqual(self.server.connections, 2)
+        self.assertEqual(metrics.get_counter('gocoin.stale_connections'), 0)
+        self.assertEqual(metrics.get_counter('gocoin.errors'), 0)
+
+    def test_stale_connection_read_resent(self):
+        invoice = self._generate_invoice()
+        self.server.reset_next(1)
+
+        self.assertEqual(gocoin.get_invoice(invoice['id'])['id'], invoice['id'])
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertEqual(self.server.connections, 2)
+        self.assertEqual(metrics.get_counter('gocoin.stale_connections'), 1)
+
+    def test_stale_connection_invoice_creation_not_resent(self):
+        self._generate_invoice()
+        self.server.reset_next(1)
+
+        # the invoice got created, sending the request again would create another one
+        self.assertRaises(APIException, self._generate_invoice)
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertEqual(len(self.server.invoices), 2)
+        self.assertEqual(metrics.get_counter('gocoin.stale_connections'), 0)
+
+    @patch.object(gocoin.client, 'read_timeout', 0.05)
+    def test_timeout(self):
+        self.server.latency = 0.5
+        self.assertRaises(APIException, self._generate_invoice)
+
+        # connection timed out is not reused
+        self.server.latency = 0
+        self._generate_invoice()
+        self.assertEqual(self.server.connections, 2)
+
+    @patch.object(gocoin.circuit_breaker, 'failure_threshold', 2)
+    def test_circuit_breaker(self):
+        self.server.fail_next(1)
+        self.assertRaises(APIException, self._generate_invoice)
+        self._generate_invoice()
+
+        # only consecutive failures open the breaker
+        self.server.fail_next(2)
+        self.assertRaises(APIException, self._generate_invoice)
+        self.assertTrue(gocoin.is_available())
+        self.assertRaises(APIException, self._generate_invoice)
+        self.assertFalse(gocoin.is_available())
+
+        self.assertRaises(gocoin.ServiceUnavailable, self._generate_invoice)
+        self.assertEqual(len(self.server.requests), 4)
+
+        # after the cool down a single failure reopens the breaker, a success closes it
+        cool_down_over = time.time() + gocoin.circuit_breaker.reset_timeout + 1
+        with patch('beam.utils.circuit_breaker.time.time', return_value=cool_down_over):
+            self.server.fail_next(1)
+            self.assertRaises(APIException, self._generate_invoice)
+            self.assertFalse(gocoin.is_available())
+
+        cool_down_over += gocoin.circuit_breaker.reset_timeout + 1
+        with patch('beam.utils.circuit_breaker.time.time', return_value=cool_down_over):
+            self._generate_invoice()
+            self.server.fail_next(1)
+            self.assertRaises(APIException, self._generate_invoice)
+            self.assertTrue(gocoin.is_available())
+
+    @patch('btc_payment.fake_gocoin.urllib2.urlopen')
+    def test_webhook(self, mock_urlopen):
+        mock_urlopen.return_value.getcode.return_value = 200
+        signature = generate_signature('1' + '10.0' + 'http://dev.beamremit.com/', self.api_key)
+        invoice = gocoin.generate_invoice(
+            price=10.0,
+            reference_number='123456',
+            transaction_id=1,
+            signature=signature,
+            currency='GBP',
+            redirect_url='http://dev.beamremit.com/'
+        )
+        invoice['callback_url'] = 'http://dev.beamremit.com/'
+        invoice['status'] = 'paid'
+
+        self.assertEqual(self.server.send_webhook('invoice_payment_received', invoice), 200)
+
+        # the webhook passes verification by ConfirmGoCoinPayment
+        request = mock_urlopen.call_args[0][0]
+        self.assertEqual(request.get_full_url(), 'http://dev.beamremit.com/')
+        event, payload = ConfirmGoCoinPayment.verify(json.loads(request.get_data()))
+        self.assertEqual(event, 'invoice_payment_received')
+        self.assertEqual(payload['id'], invoice['id'])
+        self.assertEqual(self.server.webhooks, [('invoice_payment_received', invoice['id'], 200)])
+
+        # lost webhooks are not sent
+        self.server.webhook_error_rate = 1
+        self.assertIsNone(self.server.send_webhook('invoice_payment_received', invoice))
+        self.assertEqual(mock_urlopen.call_count, 1)
+
+
+@override_settings(GOCOIN_API_KEY='secret')
+class GoCoinWebhookTests(APITestCase, TestUtils):
+
+    url_webhook = reverse('btc_payment:gocoin')
+
+    @classmethod
+    def setUpClass(cls):
+        UserenaSignup.objects.check_permissions()
+
+    def setUp(self):
+        self.transaction = self._create_default_transaction(self._create_user_with_profile())
+        self.transaction.state = Transaction.INIT
+        self.transaction.paid_at = None
+        self.transaction.save()
+        self.invoice = GoCoinInvoice(
+            transaction=self.transaction,
+            invoice_id='e2ca5f0c-9fa4-4f8c-8bfd-1cd41e0ae1e5',
+            btc_address='1B2QvsNpY6bNsCmhLpBsdbz3SLRtyvFRFP'
+        )
+        self.invoice.save()
+
+    def _post_event(self, event, invoice_status, signature=None):
+        payload = {
+            'id': self.invoice.invoice_id,
+            'status': invoice_status,
+            'base_price': '10.00',
+            'callback_url': 'https://dev-api.beamremit.com/api/v1/btc_payment/gocoin/',
+            'user_defined_1': str(self.transaction.id),
+            'crypto_balance_due': '0.0'
+        }
+        payload['user_defined_2'] = signature or generate_signature(
+            payload['user_defined_1'] + payload['base_price'] + payload['callback_url'], 'secret')
+
+        response = self.client.post(self.url_webhook, {'event': event, 'payload': payload}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def _volume(self):
+        return DailyVolume.objects.get(user=self.transaction.sender, site=Site.objects.get(id=0)).amount
+
+    def test_payment_received_once(self):
+        self._post_event('invoice_payment_received', 'paid')
+
+        transaction = Transaction.objects.get(id=self.transaction.id)
+        self.assertEqual(transaction.state, Transaction.PAID)
+        self.assertIsNotNone(transaction.paid_at)
+        self.assertEqual(GoCoinInvoice.objects.get(id=self.invoice.id).state, GoCoinInvoice.PAID)
+        self.assertEqual(self._volume(), 10)
+        mails_sent = len(mailbox.outbox)
+
+        # repeated delivery is acknowledged without side effects
+        with self.assertNumQueries(3):
+            self._post_event('invoice_payment_received', 'paid')
+
+        self.assertEqual(Transaction.objects.get(id=self.transaction.id).paid_at, transaction.paid_at)
+        self.assertEqual(self._volume(), 10)
+        self.assertEqual(len(mailbox.outbox), mails_sent)
+        self.assertEqual(GoCoinWebhookDelivery.objects.count(), 1)
+
+    def test_invalid_after_paid(self):
+        self._post_event('invoice_payment_received', 'paid')
+        self._post_event('invoice_merchant_review', 'merchant_review')
+
+        self.assertEqual(Transaction.objects.get(id=self.transaction.id).state, Transaction.INVALID)
+        self.assertEqual(GoCoinInvoice.objects.get(id=self.invoice.id).state, GoCoinInvoice.MERCHANT_REVIEW)
+        self.assertEqual(self._volume(), 0)
+        mails_sent = len(mailbox.outbox)
+
+        # already invalid, the invoice state is still recorded
+        self._post_event('invoice_invalid', 'invalid')
+        self.assertEqual(GoCoinInvoice.objects.get(id=self.invoice.id).state, GoCoinInvoice.INVALID)
+        self.assertEqual(len(mailbox.outbox), mails_sent)
+
+    def test_invalid_signature(self):
+        metrics.reset()
+
+        with self.assertNumQueries(0):
+            self._post_event('invoice_payment_received', 'paid', signature='forged')
+            response = self.client.post(self.url_webhook, {'event': 'invoice_created'}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        self.assertEqual(metrics.get_counter('gocoin.webhook_rejected'), 2)
+
+        self.assertEqual(Transaction.objects.get(id=self.transaction.id).state, Transaction.INIT)
+        self.assertFalse(GoCoinWebhookDelivery.objects.exists())
+
+    @override_settings(ASYNC_PAYMENT_WEBHOOKS=True)
+    def test_async_deliveries(self):
+        self._post_event('invoice_payment_received', 'paid')
+        self._post_event('invoice_merchant_review', 'merchant_review')
+        self._post_event('invoice_payment_received', 'paid')
+
+        self.assertEqual(Transaction.objects.get(id=self.transaction.id).state, Transaction.INIT)
+        self.assertEqual(GoCoinWebhookDelivery.objects.filter(state=GoCoinWebhookDelivery.PENDING).count(), 2)
+
+        call_command('process_webhook_deliveries', once=True, workers=1, stdout=StringIO())
+
+        # deliveries are applied in the order they were received
+        self.assertEqual(Transaction.objects.get(id=self.transaction.id).state, Transaction.INVALID)
+        self.assertEqual(GoCoinInvoice.objects.get(id=self.invoice.id).state, GoCoinInvoice.MERCHANT_REVIEW)
+        self.assertEqual(self._volume(), 0)
+        self.assertEqual(GoCoinWebhookDelivery.objects.filter(state=GoCoinWebhookDelivery.DONE).count(), 2)
+
+    @override_settings(ASYNC_PAYMENT_WEBHOOKS=True)
+    def test_async_delivery_failed(self):
+        self._post_event('invoice_payment_received', 'unknown')
+
+        call_command('process_webhook_deliveries', once=True, workers=1, stdout=StringIO())
+
+        self.assertEqual(GoCoinWebhookDelivery.objects.get().state, GoCoinWebhookDelivery.FAILED)
+        self.assertEqual(Transaction.objects.get(id=self.transaction.id).state, Transaction.INIT)
+
+    @override_settings(ASYNC_PAYMENT_WEBHOOKS=True)
+    def test_async_delivery_repeated_after_failure(self):
+        self._post_event('invoice_payment_received', 'paid')
+
+        with patch.object(Transaction, 'transition', side_effect=DatabaseError('connection lost')):
+            call_command('process_webhook_deliveries', once=True, workers=1, stdout=StringIO())
+        self.assertEqual(GoCoinWebhookDelivery.objects.get().state, GoCoinWebhookDelivery.FAILED)
+
+        # applied again when GoCoin repeats it
+        self._post_event('invoice_payment_received', 'paid')
+        call_command('process_webhook_deliveries', once=True, workers=1, stdout=StringIO())
+
+        self.assertEqual(GoCoinWebhookDelivery.objects.get().state, GoCoinWebhookDelivery.DONE)
+        self.assertEqual(Transaction.objects.get(id=self.transaction.id).state, Transaction.PAID)
+
+    @override_settings(ASYNC_PAYMENT_WEBHOOKS=True)
+    def test_async_delivery_notification_failed(self):
+        self._post_event('invoice_payment_received', 'paid')
+
+        with patch.object(Transaction, 'post_paid', side_effect=SMTPException):
+            call_command('process_webhook_deliveries', once=True, workers=1, stdout=StringIO())
+
+        self.assertEqual(GoCoinWebhookDelivery.objects.get().state, GoCoinWebhookDelivery.DONE)
+        self.assertEqual(Transaction.objects.get(id=self.transaction.id).state, Transaction.PAID)
+
+    @override_settings(ASYNC_PAYMENT_WEBHOOKS=True, GOCOIN_WEBHOOK_TIMEOUT=60)
+    def test_async_delivery_requeued(self):
+        self._post_event('invoice_payment_received', 'paid')
+        delivery = GoCoinWebhookDelivery.objects.get()
+        self.assertTrue(delivery.claim())
+
+        # the worker that claimed the delivery is still within its time
+        call_command('process_webhook_deliveries', once=True, workers=1, stdout=StringIO())
+        self.assertEqual(GoCoinWebhookDelivery.objects.get().state, GoCoinWebhookDelivery.RUNNING)
+
+        GoCoinWebhookDelivery.objects.update(started_at=timezone.now() - timedelta(seconds=61))
+        call_command('process_webhook_deliveries', once=True, workers=1, stdout=StringIO())
+
+        self.assertEqual(GoCoinWebhookDelivery.objects.get().state, GoCoinWebhookDelivery.DONE)
+        self.assertEqual(Transaction.objects.get(id=self.transaction.id).state, Transaction.PAID)
+
+
+class ReconcileInvoicesTests(TestCase, TestUtils):
+
+    api_key = 'secret'
+
+    @classmethod
+    def setUpClass(cls):
+        UserenaSignup.objects.check_permissions()
+
+    def setUp(self):
+        self.server = FakeGoCoinServer(api_key=self.api_key).start()
+        self.settings_override = override_settings(
+            GOCOIN_API_KEY=self.api_key,
+            GOCOIN_INVOICE_URL=self.server.base_url + 'invoices/{}',
+            GOCOIN_RECONCILE_BATCH_SIZE=2
+        )
+        self.settings_override.enable()
+        self.user = self._create_user_with_profile()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        self.server.stop()
+        gocoin.circuit_breaker.record_success()
+
+    def _create_open_transaction(self, gocoin_status, age=timedelta(hours=1), state=Transaction.INIT):
+        transaction = self._create_default_transaction(self.user)
+        transaction.state = state
+        transaction.paid_at = None
+        transaction.save()
+        Transaction.objects.filter(id=transaction.id).update(initialized_at=timezone.now() - age)
+
+        invoice = self.server.create_invoice({'base_price': transaction.sent_amount})
+        invoice['status'] = gocoin_status
+        if gocoin_status in ('paid', 'ready_to_ship'):
+            invoice['crypto_balance_due'] = 0.0
+        elif gocoin_status == 'underpaid':
+            invoice['crypto_balance_due'] = 0.01
+        GoCoinInvoice(
+            transaction=transaction,
+            invoice_id=invoice['id'],
+            btc_address=invoice['payment_address']
+        ).save()
+        return transaction
+
+    def _state(self, transaction):
+        return Transaction.objects.select_related('gocoin_invoice').get(id=transaction.id)
+
+    def test_reconcile(self):
+        paid = self._create_open_transaction('paid')
+        shipped = self._create_open_transaction('ready_to_ship')
+        unpaid = self._create_open_transaction('unpaid')
+        underpaid = self._create_open_transaction('underpaid')
+        invalid = self._create_open_transaction('invalid')
+        recent = self._create_open_transaction('paid', age=timedelta(minutes=1))
+        expired_paid = self._create_open_transaction('paid', state=Transaction.INVALID)
+        expired_invalid = self._create_open_transaction('invalid', state=Transaction.INVALID)
+
+        out = StringIO()
+        call_command('reconcile_invoices', workers=3, stdout=out)
+        self.assertEqual(out.getvalue().strip(), 'Checked 7 invoices, 3 paid, 1 invalid.')
+
+        self.assertEqual(self._state(paid).state, Transaction.PAID)
+        self.assertIsNotNone(self._state(paid).paid_at)
+        self.assertEqual(self._state(paid).gocoin_invoice.state, GoCoinInvoice.PAID)
+        self.assertEqual(self._state(shipped).state, Transaction.PAID)
+        self.assertEqual(self._state(shipped).gocoin_invoice.state, GoCoinInvoice.READY_TO_SHIP)
+        self.assertEqual(self._state(unpaid).state, Transaction.INIT)
+        self.assertEqual(self._state(underpaid).state, Transaction.INIT)
+        self.assertEqual(self._state(underpaid).gocoin_invoice.state, GoCoinInvoice.UNDERPAID)
+        self.assertEqual(self._state(underpaid).gocoin_invoice.balance_due, 0.01)
+        self.assertEqual(self._state(paid).gocoin_invoice.balance_due, 0)
+        self.assertEqual(self._state(invalid).state, Transaction.INVALID)
+        self.assertEqual(self._state(invalid).gocoin_invoice.state, GoCoinInvoice.INVALID)
+        self.assertEqual(self._state(recent).state, Transaction.INIT)
+
+        # expired transactions are paid late or their invoice becomes final
+        self.assertEqual(self._state(expired_paid).state, Transaction.PAID)
+        self.assertEqual(self._state(expired_invalid).state, Transaction.INVALID)
+        self.assertEqual(self._state(expired_invalid).gocoin_invoice.state, GoCoinInvoice.INVALID)
+
+        # paid transactions count towards the sender's limit
+        volume = DailyVolume.objects.get(user=self.user, site=Site.objects.get(id=0))
+        self.assertEqual(volume.amount, 3 * paid.sent_amount)
+
+        # failed requests leave invoices untouched
+        self.server.fail_next(100)
+        out = StringIO()
+        with patch.object(gocoin.client, 'jitter', return_value=0):
+            call_command('reconcile_invoices', workers=3, stdout=out)
+        self.assertEqual(out.getvalue().strip(), 'Checked 2 invoices, 0 paid, 0 invalid.')
+
+
+class PaymentLoadTests(LiveServerTestCase, TestUtils):
+
+    @classmethod
+    def setUpClass(cls):
+        super(PaymentLoadTests, cls).setUpClass()
+        UserenaSignup.objects.check_permissions()
+
+    def setUp(self):
+        self._create_default_pricing_beam()
+        self._create_default_exchange_rate()
+        self._create_default_limit_beam()
+        self._create_state()
+        gocoin.circuit_breaker.record_success()
+
+        # free port for the fake GoCoin API started by the command
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        self.gocoin_port = sock.getsockname()[1]
+        sock.close()
+
+    def test_load_test_payments(self):
+        gocoin_url = 'http://127.0.0.1:{}/'.format(self.gocoin_port)
+        out = StringIO()
+
+        with override_settings(
+                GOCOIN_API_KEY='secret',
+                GOCOIN_CREATE_INVOICE_URL=gocoin_url + 'merchants/1234/invoices',
+                GOCOIN_INVOICE_CALLBACK_URL=self.live_server_url + reverse('btc_payment:gocoin')):
+            call_command(
+                'load_test_payments', url=self.live_server_url, senders=2, transactions=2,
+                gocoin_port=self.gocoin_port, timeout=10, stdout=out)
+
+        output = out.getvalue()
+        self.assertIn('Completed 4 of 4 payments', output)
+        self.assertIn('confirm', output)
+        self.assertNotIn('Failed', output)
+
+        # senders are removed along with their transactions
+        self.assertFalse(Transaction.objects.exists())
 
-# Create your tests here.
@@ -1,5 +1,6 @@
 import json
 
+from django.db import IntegrityError
 from django.db import transaction as db_transaction
 from django.conf import settings
 
@@ -7,17 +8,38 @@ from rest_framework import status
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
+from beam.utils import metrics
 from beam.utils.exceptions import APIException
 from beam.utils.log import log_error
-from beam.utils.security import generate_signature
+from beam.utils.security import verify_signature
 
 from transaction.models import Transaction
 
-from btc_payment.models import GoCoinInvoice
+from btc_payment.models import GoCoinWebhookDelivery
 
 
 class ConfirmGoCoinPayment(APIView):
 
+    @staticmethod
+    def verify(data):
+        '''
+        Return event and payload of a delivery, raise APIException if it is
+        malformed or its signature does not match.
+        see http://help.gocoin.com/kb/setup-integration/verify-webhook-authenticity-create-a-signature
+        '''
+        try:
+            payload = data['payload']
+            message = str(payload['user_defined_1']) + payload['base_price'] + payload['callback_url']
+            valid = verify_signature(message, payload['user_defined_2'], settings.GOCOIN_API_KEY)
+            event = data['event']
+        except (KeyError, TypeError, ValueError, UnicodeError):
+            raise APIException
+
+        if not valid:
+            raise APIException
+
+        return event, payload
+
     def post(self, request):
         '''
         Payment callback from GoCoin, as described invoice_id
@@ -25,79 +47,46 @@ class ConfirmGoCoinPayment(APIView):
         http://help.gocoin.com/kb/api-invoices/invoice-states
         '''
 
-        # retrieve transaction associated with this callback
+        # reject forged and malformed deliveries before querying the database
         try:
-            transaction = Transaction.objects.get(
-                id=int(request.DATA.get('payload')['user_defined_1']),
-                gocoin_invoice__invoice_id=request.DATA.get('payload')['id']
-            )
-
-            # check signature in webhook
-            # see http://help.gocoin.com/kb/setup-integration/verify-webhook-authenticity-create-a-signature
-            message = str(request.DATA.get('payload')['user_defined_1']) +\
-                request.DATA.get('payload')['base_price'] + request.DATA.get('payload')['callback_url']
-            signature = generate_signature(message, settings.GOCOIN_API_KEY)
-
-            if request.DATA.get('payload')['user_defined_2'] != signature:
-                raise APIException
-
-            if request.DATA.get('event') == 'invoice_created':
-                pass
-
-            elif request.DATA.get('event') == 'invoice_payment_received':
-
-                transaction.gocoin_invoice.balance_due = request.DATA.get('payload')['crypto_balance_due']
-
-                # full payment received, this includes overpaid
-                if request.DATA.get('payload')['status'] == 'paid':
+            event, payload = self.verify(request.DATA)
+        except APIException:
+            metrics.increment('gocoin.webhook_rejected')
+            log_error('ERROR - GoCoin Callback: rejected payment notification, {}'.format(request.DATA))
+            return Response(status=status.HTTP_200_OK)
 
-                    transaction.gocoin_invoice.state = GoCoinInvoice.PAID
+        try:
+            delivery = GoCoinWebhookDelivery(
+                invoice_id=payload['id'],
+                event=event,
+                status=payload.get('status', ''),
+                payload=json.dumps(payload)
+            )
 
+            # only store the delivery, it is applied by process_webhook_deliveries
+            if settings.ASYNC_PAYMENT_WEBHOOKS:
+                delivery.state = GoCoinWebhookDelivery.PENDING
+                try:
                     with db_transaction.atomic():
-                        transaction.gocoin_invoice.save()
-                        transaction.set_paid()
-
-                    transaction.post_paid()
-
-                # payment received, but does not fulfill the required amount
-                elif request.DATA.get('payload')['status'] == 'underpaid':
-
-                    transaction.gocoin_invoice.state = GoCoinInvoice.UNDERPAID
-                    transaction.gocoin_invoice.save()
-
-                else:
-                    raise APIException
-
-            # transaction has been confirmed
-            elif request.DATA.get('event') == 'invoice_ready_to_ship'\
-                    and request.DATA.get('payload')['status'] == 'ready_to_ship':
-
-                # special case payment was received late, but is confirmed now
-                if transaction.state != Transaction.INVALID:
-                    transaction.gocoin_invoice.state = GoCoinInvoice.READY_TO_SHIP
-                    transaction.gocoin_invoice.save()
-
-            # transaction requires manual intervention
-            elif request.DATA.get('event') == 'invoice_merchant_review' or\
-                    request.DATA.get('event') == 'invoice_invalid':
-
-                if request.DATA.get('payload')['status'] == 'invalid':
-                    transaction.gocoin_invoice.state = GoCoinInvoice.INVALID
-                elif request.DATA.get('payload')['status'] == 'merchant_review':
-                    transaction.gocoin_invoice.state = GoCoinInvoice.MERCHANT_REVIEW
-                else:
-                    raise APIException
-
-                transaction.state = Transaction.INVALID
-
+                        delivery.save()
+                except IntegrityError:
+                    # repeated delivery, applied again if it failed before
+                    GoCoinWebhookDelivery.requeue_failed(
+                        delivery.invoice_id, delivery.event, delivery.status, delivery.payload)
+                return Response(status=status.HTTP_200_OK)
+
+            try:
                 with db_transaction.atomic():
-                    transaction.gocoin_invoice.save()
-                    transaction.set_invalid()
+                    # fails for deliveries that have been processed before
+                    delivery.save()
+                    notification = delivery.apply(payload)
 
-                transaction.post_paid_problem()
+            except IntegrityError:
+                # acknowledge repeated delivery
+                return Response(status=status.HTTP_200_OK)
 
-            else:
-                raise APIException
+            if notification is not None:
+                notification()
 
         except Transaction.DoesNotExist:
             message = 'ERROR - GoCoin Callback: no transaction found for transaction id. {}'
@@ -5,6 +5,8 @@ from pricing.models import Pricing, ExchangeRate, Comparison, Limit,\
 
 from pricing import forms
 
+from beam.utils.snapshot_cache import invalidate_snapshots
+
 
 class DoNotDeleteModelAdmin(admin.ModelAdmin):
 
@@ -33,6 +35,7 @@ class PricingAdmin(DoNotDeleteModelAdmin):
         if not obj.id:
             end_previous_object_by_site(Pricing, obj.site)
             obj.save()
+            invalidate_snapshots()
 
     list_filter = ('site',)
 
@@ -55,6 +58,7 @@ class ExchangeRateAdmin(DoNotDeleteModelAdmin):
         if not obj.id:
             end_previous_object(ExchangeRate)
             obj.save()
+            invalidate_snapshots()
 
 admin.site.register(ExchangeRate, ExchangeRateAdmin)
 
@@ -73,6 +77,7 @@ class ComparisonAdmin(DoNotDeleteModelAdmin):
         if not obj.id:
             end_previous_object(Comparison)
             obj.save()
+            invalidate_snapshots()
 
 admin.site.register(Comparison, ComparisonAdmin)
 
@@ -102,6 +107,7 @@ class LimitAdmin(DoNotDeleteModelAdmin):
         if not obj.id:
             end_previous_object_by_site(Limit, obj.site)
             obj.save()
+            invalidate_snapshots()
 
     list_filter = ('site',)
 
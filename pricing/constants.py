@@ -0,0 +1,6 @@
+# Error Status Codes
+QUOTE_AMOUNTS_MISSING = '0'
+QUOTE_INVALID_AMOUNT = '1'
+QUOTE_INVALID_RANGE = '2'
+QUOTE_TOO_MANY_AMOUNTS = '3'
+COUNTRY_NOT_SUPPORTED = '4'
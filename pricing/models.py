@@ -6,15 +6,28 @@ from django.conf import settings
 from django.contrib.sites.models import Site
 from django.db import models
 from django.utils import timezone
+from django.utils.functional import cached_property
 
 from jsonfield import JSONField
 
+from beam.utils.conditional_get import generate_etag, get_last_modified
 from beam.utils.log import log_error
+from beam.utils.snapshot_cache import get_snapshot
+
+from state.models import get_current_state
+
+PricingSnapshot = collections.namedtuple('PricingSnapshot', (
+    'pricing_id', 'exchange_rate_id', 'rate', 'fee', 'fee_currency',
+    'comparison', 'comparison_retrieved', 'operation_mode', 'etag', 'last_modified'
+))
 
 
 def get_current_object(cls):
     try:
-        return cls.objects.get(end__isnull=True)
+        return get_snapshot(
+            (cls.__name__, None),
+            lambda: cls.objects.get(end__isnull=True)
+        )
     except ObjectDoesNotExist:
         log_error('ERROR {} - No pricing object found.'.format(cls))
         raise ObjectDoesNotExist
@@ -33,7 +46,10 @@ def end_previous_object(cls):
 
 def get_current_object_by_site(cls, site):
     try:
-        return cls.objects.get(end__isnull=True, site=site)
+        return get_snapshot(
+            (cls.__name__, site.id),
+            lambda: cls.objects.get(end__isnull=True, site=site)
+        )
     except ObjectDoesNotExist:
         log_error('ERROR {} - No pricing object found.'.format(cls))
         raise ObjectDoesNotExist
@@ -62,10 +78,60 @@ def get_current_exchange_rate():
     return get_current_object(ExchangeRate)
 
 
+def get_exchange_rate(exchange_rate_id):
+    '''
+    Rates are never changed once created, so past exchange rates are served
+    from the snapshots as well. Their end time may be outdated.
+    '''
+    return get_snapshot(
+        ('ExchangeRate', exchange_rate_id),
+        lambda: ExchangeRate.objects.get(id=exchange_rate_id)
+    )
+
+
 def get_current_comparison():
     return get_current_object(Comparison)
 
 
+def calculate_received_amounts(rate, sent_amounts, country):
+    '''
+    Received amounts for a sequence of sent amounts at the given rate.
+    Country-specific rounding as in Pricing.calculate_received_amount.
+    '''
+    if country == settings.SIERRA_LEONE:
+        return [math.ceil(a * rate / 10) * 10 for a in sent_amounts]
+    else:
+        return [math.ceil(a * rate * 10) / 10 for a in sent_amounts]
+
+
+def _load_pricing_snapshot(site):
+    pricing = get_current_pricing(site)
+    exchange_rate = get_current_exchange_rate()
+    comparison = get_current_comparison()
+    state = get_current_state(site)
+
+    return PricingSnapshot(
+        pricing_id=pricing.id,
+        exchange_rate_id=exchange_rate.id,
+        rate=exchange_rate.exchange_rate(site) * (1 - pricing.markup),
+        fee=pricing.fee,
+        fee_currency=settings.SITE_SENDING_CURRENCY[site.id],
+        comparison=comparison.price_comparison,
+        comparison_retrieved=comparison.start,
+        operation_mode=state.state,
+        etag=generate_etag(pricing, exchange_rate, comparison, state),
+        last_modified=get_last_modified(pricing, exchange_rate, comparison, state)
+    )
+
+
+def get_current_pricing_snapshot(site):
+    '''
+    Everything the pricing endpoint shows for a site, as one immutable
+    value that is cached until any of its parts changes.
+    '''
+    return get_snapshot(('PricingSnapshot', site.id), lambda: _load_pricing_snapshot(site))
+
+
 class Pricing(models.Model):
 
     start = models.DateTimeField(
@@ -110,14 +176,7 @@ class Pricing(models.Model):
         return settings.SITE_SENDING_CURRENCY[self.site.id]
 
     def calculate_received_amount(self, sent_amount, country):
-
-        unrounded_amount = sent_amount * self.exchange_rate
-
-        # do country-specific rounding
-        if country == settings.SIERRA_LEONE:
-            return math.ceil(unrounded_amount / 10) * 10
-        else:
-            return math.ceil(unrounded_amount * 10) / 10
+        return calculate_received_amounts(self.exchange_rate, (sent_amount,), country)[0]
 
 
 class ExchangeRate(models.Model):
@@ -128,6 +187,10 @@ class ExchangeRate(models.Model):
         settings.LEONE: 'gbp_sll',
     }
 
+    # order of rows and columns in rate_matrix
+    CURRENCIES = (settings.GBP,) + tuple(sorted(CURRENCY_FXR))
+    CURRENCY_INDEX = dict((c, i) for i, c in enumerate(CURRENCIES))
+
     start = models.DateTimeField(
         'Start Time',
         auto_now_add=True,
@@ -162,14 +225,25 @@ class ExchangeRate(models.Model):
             return 1
         return getattr(self, self.CURRENCY_FXR[currency])
 
+    @cached_property
+    def rate_matrix(self):
+        '''
+        Cross rates between all currencies, triangulated through GBP once per row.
+        rate_matrix[i][j] converts CURRENCIES[i] into CURRENCIES[j].
+        '''
+        gbp_to_currency = [self._get_gbp_to_currency(c) for c in self.CURRENCIES]
+        return [[to_rate / from_rate for to_rate in gbp_to_currency] for from_rate in gbp_to_currency]
+
     def _get_exchange_rate(self, sending_currency, receiving_currency):
-        gbp_to_sending_currency = self._get_gbp_to_currency(sending_currency)
-        gbp_to_receiving_currency = self._get_gbp_to_currency(receiving_currency)
-        return gbp_to_receiving_currency / gbp_to_sending_currency
+        return self.rate_matrix[self.CURRENCY_INDEX[sending_currency]][self.CURRENCY_INDEX[receiving_currency]]
 
     def exchange_amount(self, amount, sending_currency, receiving_currency):
         return amount * self._get_exchange_rate(sending_currency, receiving_currency)
 
+    def exchange_amounts(self, amounts, sending_currency, receiving_currency):
+        rate = self._get_exchange_rate(sending_currency, receiving_currency)
+        return [a * rate for a in amounts]
+
     def exchange_rate(self, site):
         sending_currency = settings.SITE_SENDING_CURRENCY[site.id]
         receiving_currency = settings.SITE_RECEIVING_CURRENCY[site.id]
@@ -256,3 +330,15 @@ class Comparison(models.Model):
         help_text='Time at which comparison ended. If null, it represents the current comparison. ' +
                   'Only one row in this table can have a null value for this column.'
     )
+
+
+class SnapshotVersion(models.Model):
+
+    # the only row
+    ID = 1
+
+    version = models.PositiveIntegerField(
+        'Version',
+        default=0,
+        help_text='Bumped whenever reference data changes, to invalidate cached snapshots in all workers'
+    )
@@ -1,5 +1,11 @@
+import math
+
+from django.conf import settings
+
 from rest_framework import serializers
+from rest_framework import fields
 
+from pricing import constants
 from pricing import models
 
 
@@ -24,3 +30,70 @@ class LimitSerializer(serializers.ModelSerializer):
         )
 
         fields = read_only_fields + calculated_fields
+
+
+def is_finite(value):
+    return not (math.isnan(value) or math.isinf(value))
+
+
+class QuoteSerializer(serializers.Serializer):
+    '''
+    Sent amounts to quote, either as a list of amounts or as a range
+    given by start, stop (inclusive) and step.
+    '''
+
+    receiving_country = fields.CharField()
+    amounts = fields.WritableField(required=False)
+    start = fields.FloatField(required=False)
+    stop = fields.FloatField(required=False)
+    step = fields.FloatField(required=False)
+
+    def __init__(self, site, *args, **kwargs):
+        self.site = site
+        super(QuoteSerializer, self).__init__(*args, **kwargs)
+
+    def validate_receiving_country(self, attrs, source):
+        if attrs[source] not in settings.SITE_RECEIVING_COUNTRY[self.site.id]:
+            raise serializers.ValidationError(constants.COUNTRY_NOT_SUPPORTED)
+        return attrs
+
+    def validate_amounts(self, attrs, source):
+        amounts = attrs.get(source)
+        if amounts is None:
+            return attrs
+        if not isinstance(amounts, list):
+            raise serializers.ValidationError(constants.QUOTE_INVALID_AMOUNT)
+        try:
+            attrs[source] = [float(a) for a in amounts]
+        except (TypeError, ValueError):
+            raise serializers.ValidationError(constants.QUOTE_INVALID_AMOUNT)
+        if any(a < 0 or not is_finite(a) for a in attrs[source]):
+            raise serializers.ValidationError(constants.QUOTE_INVALID_AMOUNT)
+        return attrs
+
+    def validate(self, attrs):
+
+        if attrs.get('amounts') is not None:
+            sent_amounts = attrs['amounts']
+
+        elif None not in (attrs.get('start'), attrs.get('stop'), attrs.get('step')):
+            start, stop, step = attrs['start'], attrs['stop'], attrs['step']
+
+            if not all(map(is_finite, (start, stop, step))) or start < 0 or step <= 0 or stop < start:
+                raise serializers.ValidationError(constants.QUOTE_INVALID_RANGE)
+
+            # check the size before building the list
+            count = int((stop - start) / step + 1e-9) + 1
+            if count > settings.QUOTE_MAX_AMOUNTS:
+                raise serializers.ValidationError(constants.QUOTE_TOO_MANY_AMOUNTS)
+
+            sent_amounts = [round(start + i * step, 2) for i in xrange(count)]
+
+        else:
+            raise serializers.ValidationError(constants.QUOTE_AMOUNTS_MISSING)
+
+        if len(sent_amounts) > settings.QUOTE_MAX_AMOUNTS:
+            raise serializers.ValidationError(constants.QUOTE_TOO_MANY_AMOUNTS)
+
+        attrs['sent_amounts'] = sent_amounts
+        return attrs
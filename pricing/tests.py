@@ -1,16 +1,26 @@
 import copy
+import json
+import time
 
+from django.conf import settings
 from django.core.urlresolvers import reverse
 from django.contrib.sites.models import Site
+from django.db.models import F
 
 from django.test import TestCase
+from mock import patch
 from rest_framework import status
 from rest_framework.test import APITestCase
 
 from beam.tests import TestUtils
 
-from pricing.models import Pricing, ExchangeRate, Comparison, Limit,\
-    get_current_object, get_current_object_by_site
+from btc_payment.api_calls import gocoin
+
+from pricing.models import Pricing, ExchangeRate, Comparison, Limit, SnapshotVersion,\
+    get_current_object, get_current_object_by_site, get_current_pricing,\
+    get_current_limit, calculate_received_amounts
+
+from state.models import State
 
 # from unittest import skip
 
@@ -180,6 +190,141 @@ class PricingAPITests(APITestCase, TestUtils):
         self.assertEqual(response.data['operation_mode'], state.state)
 
 
+    def test_get_current_pricing_cached(self):
+
+        self._create_default_pricing_beam()
+        self._create_default_exchange_rate()
+        self._create_comparison()
+        self._create_state(site_id=0)
+
+        self.client.get(self.url_get_current, {}, HTTP_REFERER='http://dev.beamremit.com/')
+
+        # only the site lookup remains
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url_get_current, {}, HTTP_REFERER='http://dev.beamremit.com/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['rate'], 5.141)
+
+
+    def test_get_current_pricing_not_modified(self):
+
+        self._create_default_pricing_beam()
+        self._create_default_exchange_rate()
+        self._create_comparison()
+        self._create_state(site_id=0)
+
+        response = self.client.get(self.url_get_current, {}, HTTP_REFERER='http://dev.beamremit.com/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response['ETag']
+
+        # only browsers may cache, responses depend on the Referer
+        self.assertIn('private', response['Cache-Control'])
+        self.assertNotIn('public', response['Cache-Control'])
+        self.assertIn('Referer', response['Vary'])
+
+        response = self.client.get(
+            self.url_get_current, {}, HTTP_REFERER='http://dev.beamremit.com/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+        self.assertIn('Referer', response['Vary'])
+
+        self._create_default_exchange_rate()
+        response = self.client.get(
+            self.url_get_current, {}, HTTP_REFERER='http://dev.beamremit.com/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_get_current_pricing_payment_unavailable(self):
+
+        self._create_default_pricing_beam()
+        self._create_default_exchange_rate()
+        self._create_comparison()
+        self._create_state(site_id=0)
+
+        response = self.client.get(self.url_get_current, {}, HTTP_REFERER='http://dev.beamremit.com/')
+        etag = response['ETag']
+        last_modified = response['Last-Modified']
+
+        gocoin.circuit_breaker.open()
+        self.addCleanup(gocoin.circuit_breaker.record_success)
+
+        response = self.client.get(
+            self.url_get_current, {}, HTTP_REFERER='http://dev.beamremit.com/',
+            HTTP_IF_NONE_MATCH=etag, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['operation_mode'], State.PAYMENT_UNAVAILABLE)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertFalse(response.has_header('Last-Modified'))
+
+        response = self.client.get(
+            self.url_get_current, {}, HTTP_REFERER='http://dev.beamremit.com/',
+            HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        # the regular representation is valid again once the processor is back
+        gocoin.circuit_breaker.record_success()
+        response = self.client.get(
+            self.url_get_current, {}, HTTP_REFERER='http://dev.beamremit.com/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+
+class PricingQuoteAPITests(APITestCase, TestUtils):
+
+    url_quote = reverse('pricing:quote')
+
+    def setUp(self):
+        self._create_default_pricing_beam()
+        self._create_default_pricing_bae()
+        self._create_default_exchange_rate()
+        self._create_comparison()
+        self._create_state(site_id=0)
+        self._create_state(site_id=1)
+
+    def test_quote_amounts(self):
+        response = self.client.post(
+            self.url_quote, {'receiving_country': 'GH', 'amounts': [10, 20.5]},
+            HTTP_REFERER='http://dev.beamremit.com/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        quotes = json.loads(response.content)['quotes']
+        self.assertEqual(response.data['received_currency'], 'GHS')
+        self.assertEqual(quotes[0]['sentAmount'], 10)
+        self.assertEqual(quotes[0]['receivedAmount'], 51.5)
+        self.assertEqual(quotes[1]['receivedAmount'], 105.4)
+
+    def test_quote_range(self):
+        response = self.client.post(
+            self.url_quote, {'receiving_country': 'SL', 'start': 15, 'stop': 17, 'step': 0.5},
+            HTTP_REFERER='http://dev.bitcoinagainstebola.org/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        quotes = json.loads(response.content)['quotes']
+        self.assertEqual(response.data['received_currency'], 'SLL')
+        self.assertEqual([q['sentAmount'] for q in quotes], [15, 15.5, 16, 16.5, 17])
+        self.assertEqual(quotes[4]['receivedAmount'], 74060)
+
+    def test_quote_invalid(self):
+        response = self.client.post(
+            self.url_quote, {'receiving_country': 'GH'}, HTTP_REFERER='http://dev.beamremit.com/')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.client.post(
+            self.url_quote, {'receiving_country': 'SL', 'amounts': [10]},
+            HTTP_REFERER='http://dev.beamremit.com/')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.client.post(
+            self.url_quote, {'receiving_country': 'GH', 'start': 1, 'stop': 100000, 'step': 1},
+            HTTP_REFERER='http://dev.beamremit.com/')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_quote_not_finite(self):
+        for data in ({'amounts': ['nan']}, {'amounts': [10, 'Infinity']},
+                     {'start': 1, 'stop': 'Infinity', 'step': 1}, {'start': 'nan', 'stop': 10, 'step': 1},
+                     {'start': 1, 'stop': 10, 'step': 'nan'}):
+            data['receiving_country'] = 'GH'
+            response = self.client.post(self.url_quote, data, HTTP_REFERER='http://dev.beamremit.com/')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
 class LimitAPITests(APITestCase, TestUtils):
 
     url_get_current = reverse('pricing:limit')
@@ -200,6 +345,15 @@ class LimitAPITests(APITestCase, TestUtils):
         self.assertEqual(response.data['transaction_min_receiving'], 10.282)
         self.assertEqual(response.data['transaction_max_receiving'], 5141)
 
+    def test_get_limit_not_modified(self):
+        self._create_default_pricing_beam()
+        self._create_default_limit_beam()
+        response = self.client.get(self.url_get_current, {}, HTTP_REFERER='http://dev.beamremit.com/')
+        response = self.client.get(
+            self.url_get_current, {}, HTTP_REFERER='http://dev.beamremit.com/',
+            HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
     def test_get_limit_bae(self):
         self._create_default_pricing_bae()
         self._create_default_limit_bae()
@@ -246,3 +400,67 @@ class PricingConversionTests(TestCase, TestUtils):
         self.assertEqual(self.exchange_rate.exchange_amount(15, 'USD', 'GBP'), 9.375)
         self.assertEqual(self.exchange_rate.exchange_amount(16, 'USD', 'SLL'), 70400)
         self.assertTrue(abs(self.exchange_rate.exchange_amount(17, 'USD', 'GHS') - 56.3125) < 0.00001)
+
+    def test_rate_matrix(self):
+        currencies = ExchangeRate.CURRENCIES
+        self.assertEqual(len(self.exchange_rate.rate_matrix), len(currencies))
+        for i, sending_currency in enumerate(currencies):
+            self.assertEqual(self.exchange_rate.rate_matrix[i][i], 1)
+            for j, receiving_currency in enumerate(currencies):
+                self.assertEqual(
+                    self.exchange_rate.rate_matrix[i][j],
+                    self.exchange_rate._get_gbp_to_currency(receiving_currency) /
+                    self.exchange_rate._get_gbp_to_currency(sending_currency)
+                )
+
+    def test_exchange_amounts(self):
+        self.assertEqual(self.exchange_rate.exchange_amounts([13, 14], 'GBP', 'SLL'), [91520, 98560])
+        self.assertEqual(self.exchange_rate.exchange_amounts([15, 16], 'USD', 'GBP'), [9.375, 10])
+
+    def test_calculate_received_amounts(self):
+        amounts = [0.5, 1, 9.99, 10, 17, 123.45]
+        for pricing, country in ((self.pricing_beam, 'GH'), (self.pricing_bae, 'SL')):
+            self.assertEqual(
+                calculate_received_amounts(pricing.exchange_rate, amounts, country),
+                [pricing.calculate_received_amount(a, country) for a in amounts]
+            )
+
+
+class CurrentObjectCacheTests(TestCase, TestUtils):
+
+    def setUp(self):
+        self.site = Site.objects.get(id=0)
+
+    def test_current_pricing_cached(self):
+        pricing = self._create_default_pricing_beam()
+        self.assertEqual(get_current_pricing(self.site).id, pricing.id)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_current_pricing(self.site).id, pricing.id)
+
+    def test_new_pricing_invalidates_cache(self):
+        self._create_default_pricing_beam()
+        get_current_pricing(self.site)
+        pricing = self._create_default_pricing_beam()
+        self.assertEqual(get_current_pricing(self.site).id, pricing.id)
+
+    def test_version_bump_invalidates_cache(self):
+        pricing = self._create_default_pricing_beam()
+        get_current_pricing(self.site)
+        # as done by another worker
+        Pricing.objects.filter(id=pricing.id).update(markup=0.05)
+        SnapshotVersion.objects.filter(id=SnapshotVersion.ID).update(version=F('version') + 1)
+
+        # the version is read again once it timed out
+        self.assertEqual(get_current_pricing(self.site).markup, pricing.markup)
+        later = time.time() + settings.SNAPSHOT_VERSION_TIMEOUT
+        with patch('beam.utils.snapshot_cache.time.time', return_value=later):
+            self.assertEqual(get_current_pricing(self.site).markup, 0.05)
+
+    def test_admin_save_invalidates_cache(self):
+        admin = self._create_admin_user()
+        self.client.login(username=admin.username, password=self.default_password)
+        self._create_limit(1, 10, 5, 50, site_id=0)
+        self.assertEqual(get_current_limit(self.site).user_limit_basic, 5)
+        self.client.post(reverse('admin:pricing_limit_add'), data=self.default_beam_limit)
+        self.assertEqual(get_current_limit(self.site).user_limit_basic, 40)
+        self.client.logout()
@@ -12,6 +12,11 @@ urlpatterns = patterns(
         views.PricingCurrent.as_view(),
         name='current'
     ),
+    url(
+        r'^quote/$',
+        views.PricingQuote.as_view(),
+        name='quote'
+    ),
     url(
         r'^limit/$',
         views.LimitCurrent.as_view(),
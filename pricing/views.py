@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.core.exceptions import ObjectDoesNotExist
 
 from rest_framework.generics import RetrieveAPIView
@@ -6,28 +7,34 @@ from rest_framework.response import Response
 from rest_framework import status
 
 from beam.utils.angular_requests import get_site_by_request
+from beam.utils.conditional_get import ConditionalRetrieveMixin, VaryOnRefererMixin,\
+    generate_variant_etag, is_not_modified, not_modified_response, set_validators
 
 from pricing import serializers
 
-from state.models import get_current_state
-from pricing.models import get_current_pricing, get_current_exchange_rate,\
-    get_current_comparison, get_current_limit
+from pricing.models import get_current_pricing_snapshot, get_current_limit,\
+    get_current_pricing, get_current_exchange_rate, calculate_received_amounts
 
+from state.models import State
 
-class PricingCurrent(APIView):
+mod = __import__('btc_payment.models', fromlist=[settings.PAYMENT_PROCESSOR])
+payment_class = getattr(mod, settings.PAYMENT_PROCESSOR)
+
+
+class PricingCurrent(VaryOnRefererMixin, APIView):
 
     def _serialize(self):
 
         response_dict = {}
 
-        response_dict['pricing_id'] = self.pricing.id
-        response_dict['exchange_rate_id'] = self.exchange_rate.id
-        response_dict['rate'] = self.pricing.exchange_rate
-        response_dict['fee'] = self.pricing.fee
-        response_dict['fee_currency'] = self.pricing.fee_currency
-        response_dict['comparison'] = self.comparison.price_comparison
-        response_dict['comparison_retrieved'] = self.comparison.start
-        response_dict['operation_mode'] = self.state
+        response_dict['pricing_id'] = self.snapshot.pricing_id
+        response_dict['exchange_rate_id'] = self.snapshot.exchange_rate_id
+        response_dict['rate'] = self.snapshot.rate
+        response_dict['fee'] = self.snapshot.fee
+        response_dict['fee_currency'] = self.snapshot.fee_currency
+        response_dict['comparison'] = self.snapshot.comparison
+        response_dict['comparison_retrieved'] = self.snapshot.comparison_retrieved
+        response_dict['operation_mode'] = self.operation_mode
 
         return response_dict
 
@@ -35,20 +42,74 @@ class PricingCurrent(APIView):
 
         try:
             site = get_site_by_request(request)
-            self.pricing = get_current_pricing(site)
-            self.exchange_rate = get_current_exchange_rate()
-            self.comparison = get_current_comparison()
-            self.state = get_current_state(site).state
+            self.snapshot = get_current_pricing_snapshot(site)
+        except ObjectDoesNotExist:
+            return Response(status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        etag = self.snapshot.etag
+        last_modified = self.snapshot.last_modified
+        max_age = None
+        self.operation_mode = self.snapshot.operation_mode
+
+        # reported as in GetState while the processor is down, with an ETag of its own and
+        # without Last-Modified, which does not change when the processor goes down
+        if not payment_class.is_available():
+            self.operation_mode = State.PAYMENT_UNAVAILABLE
+            etag = generate_variant_etag(etag, self.operation_mode)
+            last_modified = None
+            max_age = 0
+
+        if is_not_modified(request, etag, last_modified):
+            return not_modified_response(etag, last_modified, max_age)
+
+        return set_validators(Response(self._serialize()), etag, last_modified, max_age)
+
+
+class PricingQuote(APIView):
+
+    serializer_class = serializers.QuoteSerializer
+
+    def post(self, request, *args, **kwargs):
+
+        site = get_site_by_request(request)
+
+        serializer = self.serializer_class(site=site, data=request.DATA)
+
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            snapshot = get_current_pricing_snapshot(site)
         except ObjectDoesNotExist:
             return Response(status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-        return Response(self._serialize())
+        country = serializer.object['receiving_country']
+        sent_amounts = serializer.object['sent_amounts']
+
+        received_amounts = calculate_received_amounts(snapshot.rate, sent_amounts, country)
 
+        return Response({
+            'pricing_id': snapshot.pricing_id,
+            'exchange_rate_id': snapshot.exchange_rate_id,
+            'fee': snapshot.fee,
+            'fee_currency': snapshot.fee_currency,
+            'received_currency': settings.COUNTRY_CURRENCY[country],
+            'quotes': [
+                {'sent_amount': s, 'received_amount': r}
+                for s, r in zip(sent_amounts, received_amounts)
+            ]
+        })
 
-class LimitCurrent(RetrieveAPIView):
+
+class LimitCurrent(ConditionalRetrieveMixin, RetrieveAPIView):
 
     serializer_class = serializers.LimitSerializer
 
+    def get_validator_objects(self):
+        self.site = get_site_by_request(self.request)
+        # receiving amounts depend on the current pricing and exchange rate
+        return (get_current_limit(self.site), get_current_pricing(self.site),
+                get_current_exchange_rate())
+
     def get_object(self, queryset=None):
-        site = get_site_by_request(self.request)
-        return get_current_limit(site)
+        return get_current_limit(self.site)
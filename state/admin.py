@@ -3,6 +3,7 @@ from django.core.exceptions import ObjectDoesNotExist
 from django.utils import timezone
 
 from beam.utils.log import log_error
+from beam.utils.snapshot_cache import invalidate_snapshots
 
 from state.models import State
 
@@ -34,6 +35,7 @@ class StateAdmin(admin.ModelAdmin):
                 log_error('ERROR State - Failed to end previous state.')
 
         obj.save()
+        invalidate_snapshots()
 
 
 admin.site.register(State, StateAdmin)
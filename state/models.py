@@ -3,6 +3,7 @@ from django.core.exceptions import ObjectDoesNotExist
 from django.db import models
 
 from beam.utils.log import log_error
+from beam.utils.snapshot_cache import get_snapshot
 
 
 class State(models.Model):
@@ -11,6 +12,9 @@ class State(models.Model):
     OUT_OF_CASH = 'DRY'
     OUTSIDE_BIZ_HOURS = 'OBH'
 
+    # reported instead of the current state while payments cannot be initiated, never stored
+    PAYMENT_UNAVAILABLE = 'PAY'
+
     APP_STATES = (
         (RUNNING, 'running'),
         (OUT_OF_CASH, 'out of cash'),
@@ -46,7 +50,10 @@ class State(models.Model):
 
 def get_current_state(site):
     try:
-        return State.objects.get(end__isnull=True, site=site)
+        return get_snapshot(
+            ('State', site.id),
+            lambda: State.objects.get(end__isnull=True, site=site)
+        )
     except ObjectDoesNotExist:
         log_error('ERROR State - No state object found.')
         raise ObjectDoesNotExist
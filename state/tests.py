@@ -7,6 +7,8 @@ from rest_framework.test import APITestCase
 
 from beam.tests import TestUtils
 
+from btc_payment.api_calls import gocoin
+
 from state.models import State, get_current_state
 
 # from unittest import skip
@@ -57,3 +59,27 @@ class StatusAPITests(APITestCase, TestUtils):
             response = self.client.get(reverse('state:current'))
             self.assertEqual(response.status_code, status.HTTP_200_OK)
             self.assertEqual(response.data['state'], s)
+
+    def test_get_status_not_modified(self):
+        self._create_state(State.RUNNING)
+        response = self.client.get(reverse('state:current'))
+        etag = response['ETag']
+        response = self.client.get(reverse('state:current'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        self._create_state(State.OUT_OF_CASH)
+        response = self.client.get(reverse('state:current'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['state'], State.OUT_OF_CASH)
+
+    def test_get_status_payment_unavailable(self):
+        self._create_state(State.RUNNING)
+        response = self.client.get(reverse('state:current'))
+        etag = response['ETag']
+
+        gocoin.circuit_breaker.open()
+        self.addCleanup(gocoin.circuit_breaker.record_success)
+
+        response = self.client.get(reverse('state:current'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['state'], State.PAYMENT_UNAVAILABLE)
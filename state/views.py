@@ -1,16 +1,31 @@
+from django.conf import settings
+
 from rest_framework.generics import RetrieveAPIView
+from rest_framework.response import Response
 
 from state import serializers
-from state.models import get_current_state
+from state.models import State, get_current_state
 
 from beam.utils.angular_requests import get_site_by_request
+from beam.utils.conditional_get import ConditionalRetrieveMixin
+
+mod = __import__('btc_payment.models', fromlist=[settings.PAYMENT_PROCESSOR])
+payment_class = getattr(mod, settings.PAYMENT_PROCESSOR)
 
 
-class GetState(RetrieveAPIView):
+class GetState(ConditionalRetrieveMixin, RetrieveAPIView):
 
     serializer_class = serializers.StateSerializer
 
+    def get_validator_objects(self):
+        self.site = get_site_by_request(self.request)
+        return (get_current_state(self.site),)
+
     def get_object(self):
-        site = get_site_by_request(self.request)
-        return get_current_state(site)
+        return get_current_state(self.site)
 
+    def get(self, request, *args, **kwargs):
+        # not cacheable, the current state is reported again once the processor is back
+        if not payment_class.is_available():
+            return Response({'state': State.PAYMENT_UNAVAILABLE})
+        return super(GetState, self).get(request, *args, **kwargs)
@@ -5,3 +5,5 @@ DOCUMENTS_NOT_VERIFIED = '3'
 TRANSACTION_LIMIT_EXCEEDED = '4'
 COUNTRY_NOT_SUPPORTED = '5'
 SENT_CURRENCY_NOT_SUPPORTED = '6'
+INVALID_CURSOR = '7'
+PAYMENT_PROCESSOR_UNAVAILABLE = '8'
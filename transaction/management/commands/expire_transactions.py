@@ -0,0 +1,164 @@
+from datetime import timedelta
+from optparse import make_option
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction as dbtransaction
+from django.db.models import Q
+from django.utils import timezone
+
+from transaction.models import ArchivedTransaction, Recipient, Transaction
+
+from btc_payment.models import GoCoinInvoice, GoCoinInvoiceJob
+
+
+class Command(BaseCommand):
+
+    help = ('Sets transactions that have not been paid within TRANSACTION_EXPIRY seconds invalid, '
+            'notifying admins about underpaid ones. '
+            'With --archive, moves transactions that expired more than TRANSACTION_ARCHIVE_AFTER '
+            'seconds ago to the archive, if their invoice is invalid or was created more than '
+            'GOCOIN_INVOICE_LIFETIME seconds ago, so it can no longer be paid.')
+
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--archive',
+            action='store_true',
+            dest='archive',
+            default=False,
+            help='Move long expired transactions to the archive'
+        ),
+    )
+
+    @staticmethod
+    def chunks(queryset):
+        '''
+        Lists of ids of rows in queryset, TRANSACTION_SWEEP_CHUNK_SIZE at a time.
+        '''
+        last_id = 0
+        while True:
+            ids = list(queryset.filter(id__gt=last_id).order_by('id').values_list(
+                'id', flat=True)[:settings.TRANSACTION_SWEEP_CHUNK_SIZE])
+            if not ids:
+                return
+            last_id = ids[-1]
+            yield ids
+
+    def expire(self, now):
+        '''
+        Invoices are not asked for their own expiry time, as that would take a
+        request to GoCoin per transaction, and GoCoin does not notify us when
+        an invoice expires. TRANSACTION_EXPIRY therefore has to exceed the
+        lifetime of GoCoin invoices. Payments received later still mark
+        transactions paid.
+        '''
+        expired = 0
+
+        stale = Transaction.objects.filter(
+            state=Transaction.INIT,
+            initialized_at__lt=now - timedelta(seconds=settings.TRANSACTION_EXPIRY)
+        ).exclude(gocoin_invoice__state=GoCoinInvoice.UNDERPAID)
+
+        for ids in self.chunks(stale):
+
+            with dbtransaction.atomic():
+                ids = list(Transaction.objects.select_for_update().filter(
+                    id__in=ids, state=Transaction.INIT).values_list('id', flat=True))
+
+                expired += Transaction.objects.filter(id__in=ids).update(
+                    state=Transaction.INVALID, invalidated_at=now)
+
+                # no invoices are created for expired transactions
+                GoCoinInvoiceJob.objects.filter(transaction__in=ids, state=GoCoinInvoiceJob.PENDING).update(
+                    state=GoCoinInvoiceJob.FAILED, finished_at=now)
+
+        return expired
+
+    def expire_underpaid(self, now):
+        '''
+        Transactions for which some money has been received are set invalid one
+        by one, notifying admins like other payment problems.
+        '''
+        expired = 0
+
+        underpaid = Transaction.objects.select_related('gocoin_invoice').filter(
+            state=Transaction.INIT,
+            initialized_at__lt=now - timedelta(seconds=settings.TRANSACTION_EXPIRY),
+            gocoin_invoice__state=GoCoinInvoice.UNDERPAID
+        )
+
+        for transaction in underpaid:
+            if transaction.transition(Transaction.INVALID, (Transaction.INIT,), invalidated_at=now):
+                transaction.post_paid_problem()
+                expired += 1
+
+        return expired
+
+    def archive(self, now):
+        archived = 0
+
+        # invalid transactions for which no money has been received and nobody has left a note, late
+        # payments are accepted until their invoice is final or expired, see reconcile_invoices
+        abandoned = Transaction.objects.filter(
+            Q(gocoin_invoice__isnull=True) |
+            Q(gocoin_invoice__state=GoCoinInvoice.INVALID) |
+            Q(gocoin_invoice__state=GoCoinInvoice.UNPAID,
+              initialized_at__lt=now - timedelta(seconds=settings.GOCOIN_INVOICE_LIFETIME)),
+            state=Transaction.INVALID,
+            paid_at__isnull=True,
+            comments='',
+            invalidated_at__lt=now - timedelta(seconds=settings.TRANSACTION_ARCHIVE_AFTER)
+        )
+
+        for ids in self.chunks(abandoned):
+
+            with dbtransaction.atomic():
+                # lock the rows against late payments, skip those that came in meanwhile
+                ids = list(Transaction.objects.select_for_update().filter(
+                    id__in=ids, state=Transaction.INVALID, paid_at__isnull=True).values_list('id', flat=True))
+
+                transactions = list(Transaction.objects.filter(id__in=ids).values(
+                    'id', 'sender', 'pricing', 'exchange_rate', 'sent_amount', 'sent_currency',
+                    'received_amount', 'receiving_country', 'reference_number', 'initialized_at',
+                    'invalidated_at', 'recipient', 'recipient__first_name', 'recipient__last_name',
+                    'recipient__phone_number', 'gocoin_invoice__invoice_id'
+                ))
+
+                ArchivedTransaction.objects.bulk_create(
+                    ArchivedTransaction(
+                        transaction_id=t['id'],
+                        sender_id=t['sender'],
+                        recipient_first_name=t['recipient__first_name'],
+                        recipient_last_name=t['recipient__last_name'],
+                        recipient_phone_number=t['recipient__phone_number'],
+                        pricing_id=t['pricing'],
+                        exchange_rate_id=t['exchange_rate'],
+                        sent_amount=t['sent_amount'],
+                        sent_currency=t['sent_currency'],
+                        received_amount=t['received_amount'],
+                        receiving_country=t['receiving_country'],
+                        reference_number=t['reference_number'],
+                        invoice_id=t['gocoin_invoice__invoice_id'] or '',
+                        initialized_at=t['initialized_at'],
+                        invalidated_at=t['invalidated_at']
+                    ) for t in transactions
+                )
+
+                # deletes invoices and invoice jobs along with the transactions
+                Transaction.objects.filter(id__in=ids).delete()
+                Recipient.objects.filter(
+                    id__in=[t['recipient'] for t in transactions], transactions__isnull=True).delete()
+
+            archived += len(transactions)
+
+        return archived
+
+    def handle(self, *args, **options):
+
+        now = timezone.now()
+
+        self.stdout.write('Expired {} transactions.'.format(self.expire(now)))
+        self.stdout.write('Expired {} underpaid transactions.'.format(self.expire_underpaid(now)))
+
+        if options['archive']:
+            self.stdout.write('Archived {} transactions.'.format(self.archive(now)))
@@ -0,0 +1,60 @@
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction as dbtransaction
+from django.utils.timezone import utc
+
+from pricing.models import get_exchange_rate
+
+from transaction.models import Transaction, DailyVolume
+
+
+class Command(BaseCommand):
+
+    help = 'Recomputes the daily volume ledger of all senders from their transactions.'
+
+    def _rebuild(self, sender_id):
+
+        # the lock keeps transactions of this sender from changing its entries
+        # between reading the transactions and replacing the entries
+        DailyVolume.lock_sender(sender_id)
+
+        transactions = Transaction.objects.filter(
+            sender=sender_id,
+            state__in=Transaction.VOLUME_STATES,
+            paid_at__isnull=False
+        ).order_by().values_list('paid_at', 'sent_amount', 'sent_currency', 'exchange_rate')
+
+        totals = defaultdict(float)
+
+        for paid_at, sent_amount, sent_currency, exchange_rate_id in transactions:
+            day = paid_at.astimezone(utc).date()
+            for site_id, sending_currency in settings.SITE_SENDING_CURRENCY.items():
+                # rounded like in DailyVolume.add
+                amount = round(get_exchange_rate(exchange_rate_id).exchange_amount(
+                    sent_amount, sent_currency, sending_currency), 2)
+                totals[(site_id, day)] = round(totals[(site_id, day)] + amount, 2)
+
+        DailyVolume.objects.filter(user=sender_id).delete()
+        DailyVolume.objects.bulk_create(
+            DailyVolume(user_id=sender_id, site_id=site_id, day=day, amount=amount)
+            for (site_id, day), amount in totals.iteritems()
+        )
+
+        return len(totals)
+
+    def handle(self, *args, **options):
+
+        sender_ids = set(
+            Transaction.objects.filter(state__in=Transaction.VOLUME_STATES)
+            .order_by().values_list('sender', flat=True).distinct())
+        sender_ids.update(DailyVolume.objects.order_by().values_list('user', flat=True).distinct())
+
+        entries = 0
+
+        for sender_id in sender_ids:
+            with dbtransaction.atomic():
+                entries += self._rebuild(sender_id)
+
+        self.stdout.write('Rebuilt {} daily volume entries.'.format(entries))
@@ -5,13 +5,17 @@ from django.conf import settings
 from django.contrib.auth.models import User
 from django.contrib.sites.models import Site
 from django.db import models
+from django.db import transaction as dbtransaction
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
 from django.utils import timezone
+from django.utils.timezone import utc
 
 from django_countries.fields import CountryField
 
 from beam.utils import mails
 
-from pricing.models import Pricing, ExchangeRate
+from pricing.models import Pricing, ExchangeRate, get_exchange_rate
 
 
 class Recipient(models.Model):
@@ -40,6 +44,14 @@ class Transaction(models.Model):
 
     class Meta:
         ordering = ['-initialized_at']
+        index_together = [
+            # paid transactions of a sender, read by rebuild_daily_volume
+            ['sender', 'state', 'paid_at'],
+            # transaction history of a sender
+            ['sender', 'state', 'initialized_at'],
+            # expiry of transactions that were never paid
+            ['state', 'initialized_at'],
+        ]
 
     # Constants
     INIT = 'INIT'
@@ -56,6 +68,9 @@ class Transaction(models.Model):
         (INVALID, 'invalid')
     )
 
+    # states counting towards a sender's daily limit
+    VOLUME_STATES = (PAID, PROCESSED)
+
     SENT_CURRENCIES = (
         (settings.GBP, 'British Pound'),
         (settings.USD, 'US Dollar')
@@ -179,14 +194,128 @@ class Transaction(models.Model):
     def __unicode__(self):
         return '{}'.format(self.id)
 
+    def __init__(self, *args, **kwargs):
+        super(Transaction, self).__init__(*args, **kwargs)
+        self._loaded_values = self._field_values()
+
+    def _field_values(self):
+        # deferred fields are not in __dict__ until they are accessed
+        return dict(
+            (f.attname, self.__dict__[f.attname])
+            for f in self._meta.concrete_fields if f.attname in self.__dict__
+        )
+
+    def get_changed_fields(self):
+        '''
+        Fields whose value differs from when the instance was loaded or last saved.
+        '''
+        return [
+            attname for attname, value in self._field_values().items()
+            if attname not in self._loaded_values or self._loaded_values[attname] != value
+        ]
+
+    @staticmethod
+    def _volume_entry(values):
+        '''
+        Contribution of a transaction with the given field values to the sender's
+        daily volume, None if it does not count towards the limit.
+        '''
+        if values.get('state') not in Transaction.VOLUME_STATES or values.get('paid_at') is None:
+            return None
+        return (values['sender_id'], values['paid_at'].astimezone(utc).date(),
+                values['sent_amount'], values['sent_currency'])
+
     def save(self, *args, **kwargs):
-        if self.pk:
-            original = Transaction.objects.get(pk=self.pk)
-            if original.pricing != self.pricing:
+        previous_volume_entry = None
+        if self.pk and not kwargs.get('force_insert') and self._state.adding:
+            # built with an explicit pk rather than loaded, so compare with the stored row, if any
+            self._loaded_values = Transaction.objects.filter(pk=self.pk).values().first() or {}
+        if self.pk and not kwargs.get('force_insert') and self._loaded_values:
+            changed_fields = self.get_changed_fields()
+            if 'pricing_id' in changed_fields:
                 raise ValidationError('Pricing cannot be changed after initialization')
-            if original.exchange_rate != self.exchange_rate:
+            if 'exchange_rate_id' in changed_fields:
                 raise ValidationError('Exchange Rate cannot be changed after initialization')
-        super(Transaction, self).save(*args, **kwargs)
+            previous_volume_entry = self._volume_entry(self._loaded_values)
+            # only write what has changed
+            kwargs.setdefault('update_fields', changed_fields)
+            if not kwargs['update_fields']:
+                return
+
+        volume_entry = self._volume_entry(self.__dict__)
+
+        with dbtransaction.atomic(savepoint=False):
+            super(Transaction, self).save(*args, **kwargs)
+            self._update_daily_volume(previous_volume_entry, volume_entry)
+
+        self._loaded_values = self._field_values()
+
+    def _get_exchange_rate(self):
+        # cannot change after initialization, so it is only read if not loaded yet
+        if Transaction.exchange_rate.is_cached(self):
+            return self.exchange_rate
+        return get_exchange_rate(self.exchange_rate_id)
+
+    def _update_daily_volume(self, previous_volume_entry, volume_entry):
+        if previous_volume_entry != volume_entry:
+            exchange_rate = self._get_exchange_rate()
+            if previous_volume_entry is not None:
+                DailyVolume.add(exchange_rate, *previous_volume_entry, sign=-1)
+            if volume_entry is not None:
+                DailyVolume.add(exchange_rate, *volume_entry)
+
+    def transition(self, state, from_states, **values):
+        '''
+        Change state and the given field values with a conditional UPDATE, which
+        only applies if the row is still in one of from_states. Returns whether
+        it did, so concurrent callers cannot both apply the same transition.
+        The daily volume ledger is adjusted assuming the other fields still
+        hold the values they were loaded with.
+        '''
+        values['state'] = state
+
+        with dbtransaction.atomic(savepoint=False):
+            if not Transaction.objects.filter(id=self.id, state__in=from_states).update(**values):
+                return False
+
+            self._update_daily_volume(
+                self._volume_entry(self._loaded_values),
+                self._volume_entry(dict(self._loaded_values, **values))
+            )
+
+        for attname, value in values.items():
+            setattr(self, attname, value)
+        self._loaded_values.update(values)
+        return True
+
+    @staticmethod
+    def bulk_transition(ids, state, from_states, **values):
+        '''
+        Counterpart of transition for many transactions at once. The rows still
+        in one of from_states are locked and changed with a single UPDATE.
+        Returns the transactions that were changed.
+        '''
+        values['state'] = state
+
+        with dbtransaction.atomic():
+            transactions = list(
+                Transaction.objects.select_for_update().filter(id__in=ids, state__in=from_states))
+
+            if not transactions:
+                return []
+
+            Transaction.objects.filter(id__in=[t.id for t in transactions]).update(**values)
+
+            for t in transactions:
+                t._update_daily_volume(
+                    t._volume_entry(t._loaded_values),
+                    t._volume_entry(dict(t._loaded_values, **values))
+                )
+                for attname, value in values.items():
+                    setattr(t, attname, value)
+                t._loaded_values.update(values)
+
+        return transactions
 
     def set_invalid(self, commit=True):
         self.state = Transaction.INVALID
@@ -295,3 +424,150 @@ class Transaction(models.Model):
                 to_email=self.sender.email,
                 html_email_template_name=settings.MAIL_TRANSACTION_COMPLETE_HTML
             )
+
+
+class DailyVolume(models.Model):
+    '''
+    Running total of a sender's PAID and PROCESSED transactions per day
+    (by payment time), in the sending currency of each site. Kept up to date
+    by Transaction.save, rebuilt from history by ./manage.py rebuild_daily_volume.
+    '''
+
+    class Meta:
+        unique_together = (('user', 'site', 'day'),)
+
+    user = models.ForeignKey(
+        User,
+        related_name='daily_volumes',
+        help_text='Sender whose transactions are added up'
+    )
+
+    site = models.ForeignKey(
+        Site,
+        related_name='daily_volumes',
+        help_text='Site whose sending currency the amount is denominated in'
+    )
+
+    day = models.DateField(
+        'Day',
+        help_text='Day (UTC) the transactions were paid'
+    )
+
+    amount = models.FloatField(
+        'Amount',
+        default=0,
+        help_text='Total amount sent in the sending currency of the site'
+    )
+
+    @staticmethod
+    def lock_sender(user_id):
+        '''
+        Lock the sender's user row until the end of the transaction. Every
+        change of a sender's entries holds it, so they do not interleave with
+        rebuild_daily_volume.
+        '''
+        list(User.objects.select_for_update().filter(id=user_id).values_list('id', flat=True))
+
+    @staticmethod
+    def add(exchange_rate, user_id, day, amount, currency, sign=1):
+        with dbtransaction.atomic(savepoint=False):
+            DailyVolume.lock_sender(user_id)
+            for site_id, sending_currency in settings.SITE_SENDING_CURRENCY.items():
+                # rounded to cents on every write, so floats do not drift from the rebuilt totals
+                change = sign * round(exchange_rate.exchange_amount(amount, currency, sending_currency), 2)
+                volume = DailyVolume.objects.filter(user_id=user_id, site_id=site_id, day=day).first()
+                if volume is not None:
+                    volume.amount = round(volume.amount + change, 2)
+                    volume.save(update_fields=['amount'])
+                # nothing to subtract from if the entries have been deleted along with the sender
+                elif sign > 0:
+                    DailyVolume.objects.create(user_id=user_id, site_id=site_id, day=day, amount=change)
+
+
+@receiver(post_delete, sender=Transaction)
+def remove_daily_volume(sender, instance, **kwargs):
+    '''
+    Deleted transactions no longer count towards the limit, whether deleted
+    one by one or with a queryset.
+    '''
+    volume_entry = instance._volume_entry(instance._loaded_values)
+    if volume_entry is not None:
+        DailyVolume.add(instance._get_exchange_rate(), *volume_entry, sign=-1)
+
+
+class ArchivedTransaction(models.Model):
+    '''
+    Transactions that expired without ever being paid, moved out of the
+    transaction and recipient tables by ./manage.py expire_transactions --archive.
+    '''
+
+    class Meta:
+        ordering = ['-initialized_at']
+
+    transaction_id = models.IntegerField(
+        'Transaction ID',
+        unique=True,
+        help_text='ID of the transaction before it was archived'
+    )
+
+    sender = models.ForeignKey(
+        User,
+        related_name='archived_transactions',
+        help_text='Sender associated with that transaction'
+    )
+
+    recipient_first_name = models.CharField(
+        'Recipient First Name',
+        max_length=50
+    )
+    recipient_last_name = models.CharField(
+        'Recipient Last Name',
+        max_length=50
+    )
+    recipient_phone_number = models.CharField(
+        'Recipient Mobile Money Phone Number',
+        max_length=15
+    )
+
+    pricing_id = models.IntegerField(
+        'Pricing ID'
+    )
+    exchange_rate_id = models.IntegerField(
+        'Exchange Rate ID'
+    )
+
+    sent_amount = models.FloatField(
+        'Sent remittance amount'
+    )
+    sent_currency = models.CharField(
+        'Sent currency',
+        max_length=4
+    )
+    received_amount = models.FloatField(
+        'Remittance amount in received currency'
+    )
+    receiving_country = CountryField(
+        'Receiving Country'
+    )
+    reference_number = models.CharField(
+        'Reference Number',
+        max_length=6
+    )
+    invoice_id = models.CharField(
+        'Invoice ID',
+        max_length=36,
+        blank=True,
+        help_text='UUID of the invoice generated by the payment processor, if any'
+    )
+
+    initialized_at = models.DateTimeField(
+        'Initialized at'
+    )
+    invalidated_at = models.DateTimeField(
+        'Invalidated at',
+        null=True
+    )
+    archived_at = models.DateTimeField(
+        'Archived at',
+        auto_now_add=True
+    )
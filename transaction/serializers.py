@@ -1,5 +1,6 @@
 from django.conf import settings
 from django.db import transaction as dbtransaction
+from django.utils.datastructures import SortedDict
 
 from rest_framework import serializers
 from rest_framework import fields
@@ -9,18 +10,56 @@ from transaction import models, constants
 from pricing.models import get_current_pricing, get_current_exchange_rate
 
 
-class TransactionSerializer(serializers.ModelSerializer):
+class FieldMapMixin(object):
+    '''
+    Turns instances into primitives through a map of (key, attribute, field)
+    built once per serializer class, instead of resolving each field's source
+    on every row. Only for serializers whose fields read plain attributes and
+    have no transform_<field> methods, the output is the same.
+    '''
 
+    def get_field_map(self):
+        cls = self.__class__
+        if '_field_map' not in cls.__dict__:
+            cls._field_map = tuple(
+                (self.get_field_key(name), field.source or name, field) for name, field in self.fields.items()
+            )
+        return cls._field_map
+
+    def to_native(self, obj):
+        if obj is None:
+            return super(FieldMapMixin, self).to_native(obj)
+
+        ret = SortedDict()
+        for key, attname, field in self.get_field_map():
+            value = getattr(obj, attname)
+            ret[key] = None if value is None else field.to_native(value)
+        return ret
+
+
+class RecipientSerializer(FieldMapMixin, serializers.ModelSerializer):
+
+    class Meta:
+        model = models.Recipient
+        fields = ('id', 'first_name', 'last_name', 'phone_number')
+
+
+class TransactionSerializer(FieldMapMixin, serializers.ModelSerializer):
+    '''
+    Nested recipient is declared explicitly instead of using depth, querysets
+    passed in are expected to select_related('recipient').
+    '''
+
+    recipient = RecipientSerializer(read_only=True)
     received_currency = fields.FloatField()
 
     class Meta:
         model = models.Transaction
-        depth = 1
         read_only_fields = (
-            'id', 'recipient', 'sent_amount', 'sent_currency', 'amount_btc', 'received_amount',
+            'id', 'sent_amount', 'sent_currency', 'amount_btc', 'received_amount',
             'reference_number', 'state', 'initialized_at', 'paid_at', 'processed_at'
         )
-        fields = read_only_fields + ('received_currency',)
+        fields = read_only_fields + ('recipient', 'received_currency',)
 
 
 class CreateTransactionSerializer(serializers.ModelSerializer):
@@ -71,6 +110,7 @@ class CreateTransactionSerializer(serializers.ModelSerializer):
             self.object.received_amount = self.object.pricing.calculate_received_amount(
                 self.object.sent_amount, self.object.receiving_country)
             self.object.recipient.save()
-            self.object.recipient = models.Recipient.objects.get(id=self.object.recipient.id)
-            self.object.save()
-        return models.Transaction.objects.get(id=self.object.id)
+            # the recipient had no primary key yet when it was assigned
+            self.object.recipient_id = self.object.recipient.id
+            self.object.save(*args, **kwargs)
+        return self.object
@@ -1,16 +1,31 @@
+import json
+from datetime import timedelta
+from StringIO import StringIO
+
+from django.contrib.sites.models import Site
 from django.core import mail as mailbox
+from django.core.management import call_command
+from django.core.exceptions import ValidationError
 from django.core.urlresolvers import reverse
+from django.db import DatabaseError, connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
 
 from rest_framework import status
+from rest_framework.serializers import ModelSerializer
 from rest_framework.test import APITestCase
 
 from userena.models import UserenaSignup
 
 from beam.tests import TestUtils
+from beam.utils.exceptions import APIException
+
+from transaction import constants, serializers
+from transaction.models import ArchivedTransaction, DailyVolume, Recipient, Transaction
 
-from transaction import constants
-from transaction.models import Transaction
+from btc_payment.api_calls import gocoin
+from btc_payment.models import GoCoinInvoice, GoCoinInvoiceJob
 
 from mock import patch
 
@@ -114,6 +129,69 @@ class ViewTransactions(TransactionTests):
         self.assertEqual(response.data['count'], 2)
 
 
+    def test_view_transactions_queries(self):
+        user = self._create_fully_verified_user()
+        token = self._create_token(user)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token)
+
+        def count_queries(params):
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.get(self.url_view_transactions, params)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            return len(context.captured_queries)
+
+        self._create_default_transaction(user)
+        queries_offset = count_queries({})
+        queries_cursor = count_queries({'cursor': ''})
+
+        for _ in xrange(9):
+            self._create_default_transaction(user)
+
+        self.assertEqual(count_queries({}), queries_offset)
+        self.assertEqual(count_queries({'cursor': ''}), queries_cursor)
+
+    def test_transaction_serializer_field_map(self):
+        transaction = Transaction.objects.select_related('recipient').get(
+            id=self._create_default_transaction(self._create_fully_verified_user()).id)
+        serializer = serializers.TransactionSerializer(transaction)
+
+        # same output as resolving every field on its own
+        expected = ModelSerializer.to_native(serializer, transaction)
+        expected['recipient'] = ModelSerializer.to_native(serializer.fields['recipient'], transaction.recipient)
+        self.assertEqual(serializer.data, expected)
+        self.assertEqual(serializer.data['received_currency'], 'GHS')
+
+    @patch('transaction.views.ViewTransactions.paginate_by', 2)
+    def test_view_transactions_cursor(self):
+        user = self._create_fully_verified_user()
+        token = self._create_token(user)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token)
+
+        ids = [self._create_default_transaction(user).id for _ in xrange(5)]
+        ids.reverse()
+        # rows with identical timestamps are ordered by id
+        Transaction.objects.filter(id__in=ids[1:4]).update(initialized_at=timezone.now())
+
+        response = self.client.get(self.url_view_transactions, {'cursor': ''})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = json.loads(response.content)
+        self.assertNotIn('count', data)
+
+        seen = [t['id'] for t in data['results']]
+        while data['next']:
+            data = json.loads(self.client.get(data['next']).content)
+            seen.extend(t['id'] for t in data['results'])
+
+        self.assertEqual(
+            seen, list(Transaction.objects.filter(id__in=ids).order_by('-initialized_at', '-id').values_list('id', flat=True)))
+
+        response = self.client.get(self.url_view_transactions, {'cursor': '', 'count': 1})
+        self.assertEqual(response.data['count'], 5)
+
+        response = self.client.get(self.url_view_transactions, {'cursor': 'invalid'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['detail'], constants.INVALID_CURSOR)
+
 class CreateTransaction(TransactionTests):
 
     @patch('transaction.views.CreateTransaction.post_save')
@@ -398,6 +476,191 @@ class CreateTransaction(TransactionTests):
         self.assertEqual(response.data['operation_mode'], 'UP')
 
 
+    @override_settings(GOCOIN_API_KEY='secret')
+    @patch('btc_payment.models.gocoin.generate_invoice')
+    def test_transaction_create_queries(self, mock_generate_invoice):
+        user = self._create_user_with_profile()
+        token = self._create_token(user)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token)
+        self._create_default_limit_beam()
+        self._create_state(site_id=0)
+        pricing = self._create_default_pricing_beam()
+        exchange_rate = self._create_default_exchange_rate()
+        mock_generate_invoice.return_value = {
+            'id': 'e2ca5f0c-9fa4-4f8c-8bfd-1cd41e0ae1e5',
+            'payment_address': '1B2QvsNpY6bNsCmhLpBsdbz3SLRtyvFRFP',
+            'inverse_spot_rate': 380.0,
+            'usd_spot_rate': 1.6,
+            'price': 0.04
+        }
+
+        data = {
+            'pricing_id': pricing.id,
+            'exchange_rate_id': exchange_rate.id,
+            'sent_amount': 10,
+            'sent_currency': 'GBP',
+            'receiving_country': 'GH',
+            'recipient': {
+                'first_name': 'Nikunj',
+                'last_name': 'Handa',
+                'phone_number': '0509392087'
+            }
+        }
+
+        # warm up the reference data snapshots
+        self.client.post(self.url_create_transaction, data, HTTP_REFERER='http://dev.beamremit.com/')
+
+        # token, user, site, profile, daily volume, recipient insert, transaction insert,
+        # invoice insert, BTC amount update and two savepoints with their releases, while
+        # reference data is served from the snapshots
+        with self.assertNumQueries(13):
+            response = self.client.post(self.url_create_transaction, data, HTTP_REFERER='http://dev.beamremit.com/')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        transaction = Transaction.objects.latest('id')
+        self.assertEqual(transaction.gocoin_invoice.invoice_id, response.data['invoice_id'])
+        self.assertEqual(transaction.amount_btc, 0.04)
+        self.assertEqual(transaction.recipient.last_name, 'Handa')
+        self.assertEqual(transaction.pricing, pricing)
+
+
+    @patch('transaction.views.payment_class.initiate')
+    def test_transaction_create_payment_unavailable(self, mock_payment_initiation):
+        user = self._create_user_with_profile()
+        token = self._create_token(user)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token)
+
+        gocoin.circuit_breaker.open()
+        self.addCleanup(gocoin.circuit_breaker.record_success)
+
+        response = self.client.post(self.url_create_transaction, {}, HTTP_REFERER='http://dev.beamremit.com/')
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response.data['detail'], constants.PAYMENT_PROCESSOR_UNAVAILABLE)
+        self.assertFalse(mock_payment_initiation.called)
+        self.assertFalse(Transaction.objects.exists())
+
+    def _post_async_transaction(self, user):
+        token = self._create_token(user)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token)
+        self._create_default_limit_beam()
+        self._create_state(site_id=0)
+        data = {
+            'pricing_id': self._create_default_pricing_beam().id,
+            'exchange_rate_id': self._create_default_exchange_rate().id,
+            'sent_amount': 10,
+            'sent_currency': 'GBP',
+            'receiving_country': 'GH',
+            'recipient': {
+                'first_name': 'Nikunj',
+                'last_name': 'Handa',
+                'phone_number': '0509392087'
+            }
+        }
+        return self.client.post(self.url_create_transaction, data, HTTP_REFERER='http://dev.beamremit.com/')
+
+    @override_settings(ASYNC_PAYMENT_INITIATION=True, GOCOIN_API_KEY='secret')
+    @patch('btc_payment.models.gocoin.generate_invoice')
+    def test_transaction_create_async(self, mock_generate_invoice):
+        mock_generate_invoice.return_value = {
+            'id': 'e2ca5f0c-9fa4-4f8c-8bfd-1cd41e0ae1e5',
+            'payment_address': '1B2QvsNpY6bNsCmhLpBsdbz3SLRtyvFRFP',
+            'inverse_spot_rate': 380.0,
+            'usd_spot_rate': 1.6,
+            'price': 0.04
+        }
+
+        response = self._post_async_transaction(self._create_user_with_profile())
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data['received_amount'], 51.5)
+        self.assertFalse(mock_generate_invoice.called)
+
+        url_payment = reverse('transaction:payment', args=(response.data['transaction_id'],))
+        response = self.client.get(url_payment)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['state'], GoCoinInvoiceJob.PENDING)
+        self.assertIsNone(response.data['invoice_id'])
+
+        call_command('process_invoice_jobs', once=True, stdout=StringIO())
+
+        response = self.client.get(url_payment)
+        self.assertEqual(response.data['state'], GoCoinInvoiceJob.DONE)
+        self.assertEqual(response.data['invoice_id'], 'e2ca5f0c-9fa4-4f8c-8bfd-1cd41e0ae1e5')
+
+        # jobs are only run once
+        call_command('process_invoice_jobs', once=True, stdout=StringIO())
+        self.assertEqual(mock_generate_invoice.call_count, 1)
+
+    @override_settings(ASYNC_PAYMENT_INITIATION=True, GOCOIN_API_KEY='secret')
+    @patch('btc_payment.models.gocoin.generate_invoice')
+    def test_transaction_create_async_failure(self, mock_generate_invoice):
+        mock_generate_invoice.side_effect = APIException
+
+        response = self._post_async_transaction(self._create_user_with_profile())
+        transaction_id = response.data['transaction_id']
+
+        call_command('process_invoice_jobs', once=True, stdout=StringIO())
+
+        response = self.client.get(reverse('transaction:payment', args=(transaction_id,)))
+        self.assertEqual(response.data['state'], GoCoinInvoiceJob.FAILED)
+        self.assertEqual(Transaction.objects.get(id=transaction_id).state, Transaction.INVALID)
+
+        # status of other senders' transactions is not revealed
+        token = self._create_token(self._create_user_with_profile())
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token)
+        response = self.client.get(reverse('transaction:payment', args=(transaction_id,)))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    @override_settings(ASYNC_PAYMENT_INITIATION=True)
+    @patch('transaction.views.payment_class.enqueue', side_effect=DatabaseError)
+    def test_transaction_create_async_enqueue_failure(self, mock_enqueue):
+        user = self._create_user_with_profile()
+
+        self.assertRaises(DatabaseError, self._post_async_transaction, user)
+
+        # the transaction is rolled back with its job
+        self.assertFalse(Transaction.objects.filter(sender=user).exists())
+        self.assertFalse(Recipient.objects.exists())
+
+    @override_settings(ASYNC_PAYMENT_INITIATION=True, GOCOIN_API_KEY='secret')
+    @patch('btc_payment.models.gocoin.generate_invoice')
+    def test_transaction_create_async_unexpected_error(self, mock_generate_invoice):
+        mock_generate_invoice.side_effect = [ValueError('unexpected'), {}]
+
+        first_id = self._post_async_transaction(self._create_user_with_profile()).data['transaction_id']
+        second_id = self._post_async_transaction(self._create_user_with_profile()).data['transaction_id']
+
+        call_command('process_invoice_jobs', once=True, stdout=StringIO())
+
+        # the error does not stop other jobs
+        self.assertEqual(mock_generate_invoice.call_count, 2)
+        for transaction_id in (first_id, second_id):
+            self.assertEqual(GoCoinInvoiceJob.objects.get(transaction_id=transaction_id).state, GoCoinInvoiceJob.FAILED)
+            self.assertEqual(Transaction.objects.get(id=transaction_id).state, Transaction.INVALID)
+
+    @override_settings(ASYNC_PAYMENT_INITIATION=True, GOCOIN_API_KEY='secret', GOCOIN_INVOICE_JOB_TIMEOUT=60)
+    @patch('btc_payment.models.gocoin.generate_invoice')
+    def test_transaction_create_async_requeued(self, mock_generate_invoice):
+        mock_generate_invoice.return_value = {
+            'id': 'e2ca5f0c-9fa4-4f8c-8bfd-1cd41e0ae1e5',
+            'payment_address': '1B2QvsNpY6bNsCmhLpBsdbz3SLRtyvFRFP',
+            'inverse_spot_rate': 380.0,
+            'usd_spot_rate': 1.6,
+            'price': 0.04
+        }
+
+        transaction_id = self._post_async_transaction(self._create_user_with_profile()).data['transaction_id']
+        job = GoCoinInvoiceJob.objects.get(transaction_id=transaction_id)
+        self.assertTrue(job.claim())
+
+        # the worker that claimed the job is still within its time
+        call_command('process_invoice_jobs', once=True, stdout=StringIO())
+        self.assertFalse(mock_generate_invoice.called)
+
+        GoCoinInvoiceJob.objects.filter(id=job.id).update(started_at=timezone.now() - timedelta(seconds=61))
+        call_command('process_invoice_jobs', once=True, stdout=StringIO())
+        self.assertEqual(mock_generate_invoice.call_count, 1)
+        self.assertEqual(GoCoinInvoiceJob.objects.get(id=job.id).state, GoCoinInvoiceJob.DONE)
+
 class AdminTests(TestCase, TestUtils):
 
     @classmethod
@@ -500,3 +763,222 @@ class AdminTests(TestCase, TestUtils):
         self.assertEqual(response.status_code, status.HTTP_302_FOUND)
         self.assertEqual(transaction.state, 'PROC')
         self.assertEqual(len(mailbox.outbox), no_emails + 1)
+
+
+class DailyVolumeTests(TestCase, TestUtils):
+
+    @classmethod
+    def setUpClass(cls):
+        UserenaSignup.objects.check_permissions()
+
+    def setUp(self):
+        self.user = self._create_user_with_profile()
+        self.site_beam = Site.objects.get(id=0)
+        self.site_bae = Site.objects.get(id=1)
+
+    def _volume(self, site):
+        return self.user.profile.todays_transaction_volume(site)
+
+    def test_paid_transaction_counted(self):
+        self._create_default_transaction(self.user)
+        self.assertEqual(self._volume(self.site_beam), 10)
+        self.assertEqual(self._volume(self.site_bae), 16)
+
+    def test_state_changes(self):
+        transaction = self._create_default_transaction(self.user)
+
+        transaction.state = Transaction.PROCESSED
+        transaction.save()
+        self.assertEqual(self._volume(self.site_beam), 10)
+
+        transaction.state = Transaction.CANCELLED
+        transaction.save()
+        self.assertEqual(self._volume(self.site_beam), 0)
+
+        transaction.set_paid()
+        self.assertEqual(self._volume(self.site_beam), 10)
+
+        transaction.set_invalid()
+        self.assertEqual(self._volume(self.site_beam), 0)
+        self.assertEqual(self._volume(self.site_bae), 0)
+
+    def test_deleted_transactions_removed(self):
+        transaction = self._create_default_transaction(self.user)
+        self._create_default_transaction(self.user)
+
+        Transaction.objects.get(id=transaction.id).delete()
+        self.assertEqual(self._volume(self.site_beam), 10)
+
+        Transaction.objects.filter(sender=self.user).delete()
+        self.assertEqual(self._volume(self.site_beam), 0)
+        self.assertEqual(self._volume(self.site_bae), 0)
+
+    def test_sender_deleted(self):
+        self._create_default_transaction(self.user)
+        self.user.delete()
+        self.assertFalse(DailyVolume.objects.exists())
+
+    def test_rebuild_daily_volume(self):
+        self._create_default_transaction(self.user)
+        self._create_default_transaction(self.user)
+        DailyVolume.objects.all().update(amount=0)
+
+        call_command('rebuild_daily_volume', stdout=StringIO())
+
+        self.assertEqual(self._volume(self.site_beam), 20)
+        self.assertEqual(self._volume(self.site_bae), 32)
+
+    def test_amounts_rounded(self):
+        pricing = self._create_default_pricing_beam()
+        exchange_rate = self._create_default_exchange_rate()
+        for _ in range(3):
+            self._create_transaction(self.user, pricing, exchange_rate, 0.1, 'GBP', 0.51, 'GH')
+
+        # 0.1 + 0.1 + 0.1 would be 0.30000000000000004
+        self.assertEqual(self._volume(self.site_beam), 0.3)
+
+        call_command('rebuild_daily_volume', stdout=StringIO())
+        self.assertEqual(self._volume(self.site_beam), 0.3)
+
+
+class TransactionModelTests(TestCase, TestUtils):
+
+    @classmethod
+    def setUpClass(cls):
+        UserenaSignup.objects.check_permissions()
+
+    def setUp(self):
+        user = self._create_user_with_profile()
+        self.transaction = Transaction.objects.get(id=self._create_default_transaction(user).id)
+
+    def test_update_writes_changed_fields_only(self):
+        with CaptureQueriesContext(connection) as context:
+            self.transaction.set_invalid()
+
+        statements = [q['sql'] for q in context.captured_queries if 'transaction_transaction' in q['sql']]
+        self.assertEqual(len(statements), 1)
+        self.assertIn('UPDATE', statements[0])
+        self.assertIn('"state"', statements[0])
+        self.assertIn('"invalidated_at"', statements[0])
+        self.assertNotIn('"sent_amount"', statements[0])
+
+        transaction = Transaction.objects.get(id=self.transaction.id)
+        self.assertEqual(transaction.state, Transaction.INVALID)
+        self.assertIsNotNone(transaction.invalidated_at)
+
+    def test_unchanged_save_skips_update(self):
+        with self.assertNumQueries(0):
+            self.transaction.save()
+
+    def test_save_with_explicit_pk(self):
+        values = Transaction.objects.filter(id=self.transaction.id).values().first()
+
+        transaction = Transaction(**dict(values, state=Transaction.INVALID))
+        transaction.save()
+        self.assertEqual(Transaction.objects.get(id=self.transaction.id).state, Transaction.INVALID)
+
+        # a row that does not exist yet is inserted
+        transaction = Transaction(**dict(values, id=self.transaction.id + 100, reference_number='99999'))
+        transaction.save()
+        self.assertTrue(Transaction.objects.filter(id=self.transaction.id + 100).exists())
+
+    def test_pricing_and_exchange_rate_immutable(self):
+        self.transaction.pricing = self._create_default_pricing_beam()
+        self.assertRaises(ValidationError, self.transaction.save)
+
+        transaction = Transaction.objects.get(id=self.transaction.id)
+        transaction.exchange_rate = self._create_default_exchange_rate()
+        self.assertRaises(ValidationError, transaction.save)
+
+
+@override_settings(TRANSACTION_SWEEP_CHUNK_SIZE=1)
+class ExpireTransactionsTests(TestCase, TestUtils):
+
+    @classmethod
+    def setUpClass(cls):
+        UserenaSignup.objects.check_permissions()
+
+    def setUp(self):
+        self.user = self._create_user_with_profile()
+
+    def _create_transaction_in_state(self, state, age, invoice_state=None, **values):
+        transaction = self._create_default_transaction(self.user)
+        values.update(state=state, initialized_at=timezone.now() - age)
+        if state != Transaction.PAID:
+            values['paid_at'] = None
+        if state == Transaction.INVALID:
+            values['invalidated_at'] = timezone.now() - age
+        Transaction.objects.filter(id=transaction.id).update(**values)
+        if invoice_state:
+            GoCoinInvoice(
+                transaction=transaction, invoice_id=str(transaction.id), btc_address='x', state=invoice_state).save()
+        return transaction
+
+    def _state(self, transaction):
+        return Transaction.objects.get(id=transaction.id).state
+
+    def test_expire(self):
+        stale = self._create_transaction_in_state(Transaction.INIT, timedelta(hours=2))
+        recent = self._create_transaction_in_state(Transaction.INIT, timedelta(minutes=5))
+        paid = self._create_transaction_in_state(Transaction.PAID, timedelta(hours=2))
+        underpaid = self._create_transaction_in_state(Transaction.INIT, timedelta(hours=2), GoCoinInvoice.UNDERPAID)
+        admin = self._create_admin_user()
+        job = GoCoinInvoiceJob.objects.create(transaction=stale)
+
+        out = StringIO()
+        call_command('expire_transactions', stdout=out)
+        self.assertEqual(out.getvalue().strip(), 'Expired 1 transactions.\nExpired 1 underpaid transactions.')
+
+        self.assertEqual(self._state(stale), Transaction.INVALID)
+        self.assertIsNotNone(Transaction.objects.get(id=stale.id).invalidated_at)
+        self.assertEqual(self._state(recent), Transaction.INIT)
+        self.assertEqual(self._state(paid), Transaction.PAID)
+
+        # pending invoice jobs are not run anymore
+        self.assertEqual(GoCoinInvoiceJob.objects.get(id=job.id).state, GoCoinInvoiceJob.FAILED)
+
+        # admins are told about money received for expired transactions
+        self.assertEqual(self._state(underpaid), Transaction.INVALID)
+        self.assertEqual(len(mailbox.outbox), 1)
+        self.assertEqual(mailbox.outbox[0].to, [admin.email])
+
+    def test_archive(self):
+        old = timedelta(days=40)
+        abandoned = self._create_transaction_in_state(Transaction.INVALID, old, GoCoinInvoice.UNPAID)
+        without_invoice = self._create_transaction_in_state(Transaction.INVALID, old)
+        invalid_invoice = self._create_transaction_in_state(Transaction.INVALID, old, GoCoinInvoice.INVALID)
+        underpaid = self._create_transaction_in_state(Transaction.INVALID, old, GoCoinInvoice.UNDERPAID)
+        commented = self._create_transaction_in_state(Transaction.INVALID, old, comments='called sender')
+        recent = self._create_transaction_in_state(Transaction.INVALID, timedelta(days=1))
+
+        out = StringIO()
+        call_command('expire_transactions', archive=True, stdout=out)
+        self.assertIn('Archived 3 transactions.', out.getvalue())
+
+        for transaction in (abandoned, without_invoice, invalid_invoice):
+            self.assertFalse(Transaction.objects.filter(id=transaction.id).exists())
+            self.assertFalse(Recipient.objects.filter(id=transaction.recipient_id).exists())
+            archived = ArchivedTransaction.objects.get(transaction_id=transaction.id)
+            self.assertEqual(archived.sender, self.user)
+            self.assertEqual(archived.recipient_last_name, transaction.recipient.last_name)
+            self.assertEqual(archived.sent_amount, transaction.sent_amount)
+            self.assertEqual(archived.reference_number, transaction.reference_number)
+
+        self.assertEqual(ArchivedTransaction.objects.get(transaction_id=abandoned.id).invoice_id, str(abandoned.id))
+        self.assertFalse(GoCoinInvoice.objects.filter(transaction_id=abandoned.id).exists())
+
+        for transaction in (underpaid, commented, recent):
+            self.assertEqual(self._state(transaction), Transaction.INVALID)
+
+    @override_settings(GOCOIN_INVOICE_LIFETIME=60 * 24 * 60 * 60)
+    def test_archive_keeps_payable_invoices(self):
+        old = timedelta(days=40)
+        unpaid = self._create_transaction_in_state(Transaction.INVALID, old, GoCoinInvoice.UNPAID)
+        invalid_invoice = self._create_transaction_in_state(Transaction.INVALID, old, GoCoinInvoice.INVALID)
+
+        call_command('expire_transactions', archive=True, stdout=StringIO())
+
+        # a late payment could still come in for the unpaid invoice
+
+        self.assertEqual(self._state(unpaid), Transaction.INVALID)
+        self.assertFalse(Transaction.objects.filter(id=invalid_invoice.id).exists())
@@ -21,5 +21,10 @@ urlpatterns = patterns(
         r'^(?P<pk>[0-9]+)/$',
         views.GetTransaction.as_view(),
         name='get'
+    ),
+    url(
+        r'^(?P<pk>[0-9]+)/payment/$',
+        views.GetPaymentStatus.as_view(),
+        name='payment'
     )
 )
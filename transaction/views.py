@@ -1,4 +1,5 @@
 from django.conf import settings
+from django.db import transaction as dbtransaction
 
 from rest_framework import status
 from rest_framework.generics import GenericAPIView, ListAPIView, RetrieveAPIView
@@ -7,8 +8,7 @@ from rest_framework.response import Response
 
 from beam.utils.angular_requests import get_site_by_request
 from beam.utils.exceptions import APIException
-from beam.utils.ip_blocking import country_blocked, is_tor_node,\
-    get_client_ip, HTTP_451_UNAVAILABLE_FOR_LEGAL_REASONS
+from beam.utils.pagination import KeysetPaginationMixin
 
 from transaction import constants
 from transaction import serializers
@@ -31,15 +31,17 @@ class CreateTransaction(GenericAPIView):
 
     def post_save(self, obj, created=False):
         # initiate payment with external payment processor
-        self.invoice_id = payment_class.initiate(obj)
+        if settings.ASYNC_PAYMENT_INITIATION:
+            payment_class.enqueue(obj)
+        else:
+            self.invoice_id = payment_class.initiate(obj)
 
     def post(self, request):
 
-        # block countries we are not licensed to operate in and tor clients
-        client_ip = get_client_ip(request)
-
-        if country_blocked(request, client_ip) or is_tor_node(client_ip):
-            return Response(status=HTTP_451_UNAVAILABLE_FOR_LEGAL_REASONS)
+        # fail fast while the payment processor is known to be down
+        if not payment_class.is_available():
+            return Response(
+                {'detail': constants.PAYMENT_PROCESSOR_UNAVAILABLE}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
 
         try:
 
@@ -61,11 +63,13 @@ class CreateTransaction(GenericAPIView):
                 todays_vol = request.user.profile.todays_transaction_volume(
                     site, request.DATA.get('sent_amount'))
 
+                limit = get_current_limit(site)
+
                 # sender has exceeded basic transaction limit
-                if todays_vol > get_current_limit(site).user_limit_basic:
+                if todays_vol > limit.user_limit_basic:
 
                     # sender has exceeded maximum daily transaction limit
-                    if todays_vol > get_current_limit(site).user_limit_complete:
+                    if todays_vol > limit.user_limit_complete:
                         return Response({'detail': constants.TRANSACTION_LIMIT_EXCEEDED}, status=status.HTTP_400_BAD_REQUEST)
 
                     #  sender has not provided additional document
@@ -76,6 +80,21 @@ class CreateTransaction(GenericAPIView):
                     if not request.user.profile.documents_verified:
                         return Response({'detail': constants.DOCUMENTS_NOT_VERIFIED}, status=status.HTTP_400_BAD_REQUEST)
 
+                # invoice is created in the background, see GetPaymentStatus
+                if settings.ASYNC_PAYMENT_INITIATION:
+
+                    # a transaction committed without its job would never get an invoice
+                    with dbtransaction.atomic():
+                        self.object = serializer.save(force_insert=True)
+                        self.post_save(self.object, created=True)
+
+                    return Response(
+                        {'transaction_id': self.object.id,
+                         'received_amount': self.object.received_amount,
+                         'received_currency': self.object.received_currency,
+                         'operation_mode': get_current_state(site).state},
+                        status=status.HTTP_202_ACCEPTED)
+
                 self.object = serializer.save(force_insert=True)
 
                 self.post_save(self.object, created=True)
@@ -97,15 +116,18 @@ class CreateTransaction(GenericAPIView):
             return Response(status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
-class ViewTransactions(ListAPIView):
+class ViewTransactions(KeysetPaginationMixin, ListAPIView):
     serializer_class = serializers.TransactionSerializer
     permission_classes = (IsAuthenticated, IsNoAdmin)
 
     paginate_by = 10
 
+    cursor_field = 'initialized_at'
+    invalid_cursor_error = constants.INVALID_CURSOR
+
     def get_queryset(self):
         user = self.request.user
-        queryset = Transaction.objects.filter(
+        queryset = Transaction.objects.select_related('recipient').filter(
             sender__id=user.id,
             state__in=(
                 Transaction.PAID, Transaction.INVALID,
@@ -119,7 +141,21 @@ class GetTransaction(RetrieveAPIView):
     serializer_class = serializers.TransactionSerializer
     permission_classes = (IsAuthenticated, IsNoAdmin)
 
+    def get_queryset(self):
+        user = self.request.user
+        queryset = Transaction.objects.select_related('recipient').filter(sender__id=user.id)
+        return queryset
+
+
+class GetPaymentStatus(RetrieveAPIView):
+    permission_classes = (IsAuthenticated, IsNoAdmin)
+
     def get_queryset(self):
         user = self.request.user
         queryset = Transaction.objects.filter(sender__id=user.id)
         return queryset
+
+    def retrieve(self, request, *args, **kwargs):
+        transaction = self.get_object()
+        state, invoice_id = payment_class.get_initiation_status(transaction)
+        return Response({'transaction_id': transaction.id, 'state': state, 'invoice_id': invoice_id})